@@ -2,7 +2,6 @@ from types import MethodType
 
 import numpy as np
 import random
-import torch
 
 from cfgs.path_cfgs import PATH
 
@@ -44,6 +43,15 @@ class Cfgs(PATH):
         # 检查点的路径，CKPT_VERSION CKPT_EPOCH被重写
         self.CKPT_PATH = None
 
+        # Save ckpt_VERSION/last_step.pkl every CKPT_EVERY training steps, 0 disables it;
+        # besides the weights it holds the loader positions and random states for an exact resume
+        # 每CKPT_EVERY步保存一次检查点，包含数据加载位置和随机数状态
+        self.CKPT_EVERY = 0
+
+        # Resume from last_step.pkl of CKPT_VERSION instead of its last_epoch.pkl
+        # 从CKPT_VERSION的last_step.pkl断点续训
+        self.RESUME_STEP = False
+
         # Print loss every step
         # 在每一步打印输出
         self.VERBOSE = True
@@ -60,10 +68,28 @@ class Cfgs(PATH):
         # 离线评估时设置为True
         self.EVAL_EVERY_EPOCH = True
 
+        # Stop the validation pass once the 95% confidence interval of the overall accuracy is within
+        # +-EVAL_CI points (questions visited in a random order, 0: always evaluate the whole split)
+        # 验证精度的置信区间足够小时提前结束验证
+        self.EVAL_CI = 0.
+
         # Set True to save the prediction vector (Ensemble)
         # 保存预测向量设为true
         self.TEST_SAVE_PRED = False
 
+        # Saved prediction vectors: 'float32' or 'float16', and the number of top answers kept per question (0: all)
+        # 预测向量的精度，以及每个问题只保存分数最高的PRED_TOPK个答案（0为全部保存）
+        self.PRED_DTYPE = 'float32'
+        self.PRED_TOPK = 0
+
+        # --RUN ensemble: prediction directories saved with TEST_SAVE_PRED, combined by 'mean', 'rank' or 'vote'
+        # 合并多个模型的预测向量（按块读取），ENSEMBLE_TOPK为rank/vote计入的答案数（None为默认值）
+        self.PRED_FILES = []
+        self.ENSEMBLE = 'mean'
+        self.ENSEMBLE_WEIGHTS = None
+        self.ENSEMBLE_TOPK = None
+        self.ENSEMBLE_CHUNK = 4096
+
         # Define the 'train' 'val' 'test' data split
         # 定义train, val, test的数据划分
         # (EVAL_EVERY_EPOCH triggered when set {'train': 'train'})
@@ -82,7 +108,7 @@ class Cfgs(PATH):
 
         # Set True to use pretrained word embedding
         # 使用预训练的词嵌入时设置为True
-        # (GloVe: spaCy https://spacy.io/)
+        # (GloVe: https://nlp.stanford.edu/projects/glove/, see utils/convert_glove.py)
         self.USE_GLOVE = True
 
         # Word embedding matrix size
@@ -108,6 +134,35 @@ class Cfgs(PATH):
 
         self.IMG_SPATIAL_FEAT_SIZE = 7
 
+        # Read image features from the packed memory-mapped store
+        # (built by utils/pack_img_feats.py) instead of per-image .npz files
+        # 使用打包后的特征（若存在），否则回退到逐个读取.npz
+        self.USE_PACKED_FEAT = True
+
+        # Dtype of the image features in the data pipeline ('float32' or 'float16'),
+        # the model upcasts them right before img_feat_linear
+        # float16特征减半磁盘、page cache和进程间传输，pack_img_feats.py --DTYPE float16
+        self.IMG_FEAT_DTYPE = 'float32'
+
+        # Evaluating on val, also evaluate the features rounded to this dtype ('float16' or 'bfloat16')
+        # and report the accuracy delta, None to disable
+        self.FEAT_DTYPE_DELTA = None
+
+        # Number of padded image features kept in a cache shared by all DataLoader workers
+        # (each slot takes IMG_FEAT_PAD_SIZE x IMG_FEAT_SIZE floats, ~0.8MB), 0 disables the cache
+        # 共享内存特征缓存的容量（图像数），0表示不使用
+        self.IMG_FEAT_CACHE_SIZE = 0
+
+        # Pad every batch only to its longest question / largest box count
+        # instead of MAX_TOKEN / IMG_FEAT_PAD_SIZE (masks are derived from the zero padding)
+        # 每个batch只补齐到batch内最长的问题和最多的框数
+        self.DYNAMIC_PAD = True
+
+        # Samples of every pool of BUCKET_POOL batches are sorted by length (tokens + boxes)
+        # before being cut into batches, so that batches need less padding; 0 keeps random batches
+        # 按长度分桶的batch数，0表示随机组batch
+        self.BUCKET_POOL = 0
+
         # Default training batch size: 64
         self.BATCH_SIZE = 32
 
@@ -120,6 +175,11 @@ class Cfgs(PATH):
         # increase the CPU memory usage when NUM_WORKS is large)
         self.PIN_MEM = True
 
+        # Number of training batches of every data stream loaded and copied to the GPU ahead of the
+        # training step by a background thread (with NUM_WORKERS > 0), 0 copies them on demand
+        # 提前加载并拷贝到GPU的batch数
+        self.PREFETCH = 2
+
         # Large model can not training with batch size 64
         # Gradient accumulate can split batch to reduce gpu memory usage
         # large模型不能以batch size为64训练，梯度累积可以划分batch，减少GPU消耗
@@ -231,20 +291,12 @@ class Cfgs(PATH):
         for arg in args_dict:
             setattr(self, arg, args_dict[arg])
 
-    def proc(self):
-        # 确保RUN_MODE为train/val/test/valNovel
-        assert self.RUN_MODE in ['train', 'val', 'test', 'valNovel']
+    def setup_torch(self):
+        import torch
 
-        # ------------ Devices setup 设置设备信息
-        # os.environ['CUDA_VISIBLE_DEVICES'] = self.GPU
-        # GPU数
-        self.N_GPU = len(self.GPU.split(','))
-        # 设备列表
-        self.DEVICES = [_ for _ in range(self.N_GPU)]
         # 线程数为2
         torch.set_num_threads(2)
 
-        # ------------ Seed setup
         # 设置随机种子
         # fix pytorch seed
         torch.manual_seed(self.SEED)
@@ -254,6 +306,22 @@ class Cfgs(PATH):
             torch.cuda.manual_seed_all(self.SEED)
         torch.backends.cudnn.deterministic = True
 
+    def proc(self):
+        # 确保RUN_MODE为train/val/test/valNovel/prepare/ensemble
+        assert self.RUN_MODE in ['train', 'val', 'test', 'valNovel', 'prepare', 'ensemble']
+
+        # ------------ Devices setup 设置设备信息
+        # os.environ['CUDA_VISIBLE_DEVICES'] = self.GPU
+        # GPU数
+        self.N_GPU = len(self.GPU.split(','))
+        # 设备列表
+        self.DEVICES = [_ for _ in range(self.N_GPU)]
+
+        # valNovel only scores result files and never imports torch (see core/eval_novel.py)
+        if self.RUN_MODE != 'valNovel':
+            self.setup_torch()
+
+        # ------------ Seed setup
         # fix numpy seed
         np.random.seed(self.SEED)
 
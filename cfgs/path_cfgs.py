@@ -26,6 +26,9 @@ class PATH:
             'test': self.FEATURE_PATH + 'test2015/',
         }
 
+        # 打包后的图像特征路径（utils/pack_img_feats.py生成）
+        self.PACKED_FEAT_PATH = self.FEATURE_PATH + 'packed/'
+
         # 问题路径
         self.QUESTION_PATH = {
             'train': self.DATASET_PATH + 'v2_OpenEnded_mscoco_train2014_questions.json',
@@ -34,6 +37,10 @@ class PATH:
             'vg': self.DATASET_PATH + 'VG_questions.json',
         }
 
+        # GloVe词向量（utils/convert_glove.py生成）：词表，每行一个词；向量矩阵.npy
+        self.GLOVE_WORDS_PATH = './datasets/glove/glove_words.txt'
+        self.GLOVE_VECTORS_PATH = './datasets/glove/glove_vectors.npy'
+
         # 答案路径
         self.ANSWER_PATH = {
             'train': self.DATASET_PATH + 'v2_mscoco_train2014_annotations.json',
@@ -51,6 +58,10 @@ class PATH:
         self.LOG_PATH = './results/log/'
         # 检查点路径
         self.CKPTS_PATH = './ckpts/'
+        # 预处理数据缓存路径（token矩阵等）
+        self.DATA_CACHE_PATH = './datasets/cache/'
+        # 编译后的数据集路径（--RUN prepare）
+        self.COMPILED_DATA_PATH = './datasets/compiled/'
         self.ATTN_PATH = './results/attn/'
         self.ANA_PATH = './results/analysis'
 
@@ -66,6 +77,12 @@ class PATH:
         if 'log' not in os.listdir('./results'):
             os.mkdir('./results/log')
 
+        if 'cache' not in os.listdir('./datasets'):
+            os.mkdir('./datasets/cache')
+
+        if 'compiled' not in os.listdir('./datasets'):
+            os.mkdir('./datasets/compiled')
+
         if 'ckpts' not in os.listdir('./'):
             os.mkdir('./ckpts')
 
@@ -0,0 +1,418 @@
+from core.data.data_utils import img_feat_path_load, tokenize, ans_stat, load_ques_ix
+from core.data.data_utils import load_ans_csr, csr_take_rows, lists_to_csr, REFSET_KINDS
+from core.data.file_utils import save_npy, save_json, file_fingerprint, manifest_matches
+from core.data.feat_store import PackedImgFeats
+from core.data.feat_cache import SharedImgFeatCache
+import numpy as np
+import glob, json, os
+
+
+# ---------------------------------
+# ---- Process-wide Corpus Registry ----
+# ---------------------------------
+# 训练集、参考集、技能对比集和验证集共用同一份解析后的数据：
+# 每个json文件只加载一次，词表、答案词典和特征索引也只建立一次；
+# 各个DataSet只保存自己的行索引
+#
+# Shared objects must be treated as read-only by the dataset views.
+
+_json_cache = {}
+_registry = {}
+
+# The vocabulary is built from the questions of all these splits
+VOCAB_SPLITS = ['train', 'val', 'test', 'vg']
+
+
+def load_json_once(path):
+    if path not in _json_cache:
+        with open(path, 'r') as f:
+            _json_cache[path] = json.load(f)
+    return _json_cache[path]
+
+
+def _cached(key, build_fn):
+    if key not in _registry:
+        _registry[key] = build_fn()
+    return _registry[key]
+
+
+def get_vocab(__C):
+    def build():
+        # Loading question word list
+        # 加载问题词汇表
+        stat_ques_list = []
+        for split in VOCAB_SPLITS:
+            stat_ques_list += load_json_once(__C.QUESTION_PATH[split])['questions']
+
+        return tokenize(
+            stat_ques_list,
+            __C.USE_GLOVE,
+            [__C.QUESTION_PATH[split] for split in VOCAB_SPLITS],
+            __C.GLOVE_WORDS_PATH,
+            __C.GLOVE_VECTORS_PATH,
+            __C.DATA_CACHE_PATH
+        )
+
+    return _cached(('vocab', __C.USE_GLOVE), build)
+
+
+def get_ans_dict(ans_dict_file):
+    return _cached(('ans_dict', ans_dict_file), lambda: ans_stat(ans_dict_file))
+
+
+def get_img_feat_index(__C, img_split_list):
+    """
+    返回 (打包特征, 图像编号-.npz路径字典)，两者之一为空
+    """
+    def build():
+        # Packed features are read as zero-copy slices of one memory-mapped array per split
+        # 打包特征存在时不再glob .npz文件
+        if getattr(__C, 'USE_PACKED_FEAT', False) and \
+                PackedImgFeats.available(__C.PACKED_FEAT_PATH, img_split_list):
+            print('== Using packed image features:', __C.PACKED_FEAT_PATH)
+            return PackedImgFeats(__C.PACKED_FEAT_PATH, img_split_list), {}
+
+        img_feat_path_list = []
+        for split in img_split_list:
+            # 构建train, val, test的数据路径
+            img_feat_path_list += glob.glob(__C.IMG_FEAT_PATH[split] + '*.npz')
+
+        # {image id} -> {image feature absolutely path}
+        return None, img_feat_path_load(img_feat_path_list)
+
+    return _cached(('img_feat', tuple(img_split_list), getattr(__C, 'USE_PACKED_FEAT', False)), build)
+
+
+def get_img_feat_cache(__C):
+    """
+    所有数据集共用一个共享内存特征缓存，IMG_FEAT_CACHE_SIZE为0时返回None
+    """
+    capacity = getattr(__C, 'IMG_FEAT_CACHE_SIZE', 0)
+    if not capacity:
+        return None
+
+    def build():
+        print('== Image feature cache: {} images'.format(capacity))
+        return SharedImgFeatCache(capacity, __C.IMG_FEAT_PAD_SIZE, __C.IMG_FEAT_SIZE, __C.IMG_FEAT_DTYPE)
+
+    return _cached(('img_feat_cache', capacity, __C.IMG_FEAT_PAD_SIZE, __C.IMG_FEAT_DTYPE), build)
+
+
+def release_json():
+    """
+    释放解析后的json，之后的DataLoader worker只会读取numpy数组，不会因引用计数触发写时复制
+    """
+    _json_cache.clear()
+
+
+class Corpus:
+    """
+    一个split组合（e.g. train+val+vg）的全部问题、答案及其预处理结果，按列存为numpy数组
+    Rows follow the concatenated question files, so refset 'index' entries are corpus rows.
+    Compiled once into a directory of .npy columns (see get_corpus), later runs load it with Corpus.load.
+
+    Columns:
+        qids, iids            : int64 [N]
+        ques_ix               : int32 [N, MAX_TOKEN]
+        ques_len              : int32 [N], number of words before truncation
+        skill_code            : int16 [N], index into skill_names, -1 if the question has no skill
+        concept_ptr/_id/_pos  : CSR of the 'concepts' dict, first token position of each concept
+        all_concept_ptr/_id   : CSR of 'all_concepts' (falls back to the 'concepts' keys)
+        ans_ptr/_ix/_score    : CSR of the answer targets (only when answers are loaded)
+
+    Inverted indexes (rows ascending within every entry):
+        concept_rows_ptr/_ix  : concept id -> rows whose 'all_concepts' contain it
+        skill_rows_ptr/_ix    : skill code -> rows of that skill
+
+    Reference sets ('refsets'), one entry per (question, concept) pair P and len(REFSET_KINDS) groups per pair:
+        rs_row, rs_concept    : int64 [P] target row, int32 [P] concept id
+        rs_ptr, rs_ref        : CSR over the P * len(REFSET_KINDS) groups, group = pair * len(REFSET_KINDS) + kind
+        skill_pos_ptr/_ref    : CSR of 'skill_refset'['pos'] per row, same for skill_neg_ptr/_ref
+    """
+    def __init__(self, __C, split_list, with_ans):
+        self.split_list = split_list
+
+        # Loading question and answer list
+        # 加载问题和答案列表
+        ques_list = []
+        ans_list = []
+        for split in split_list:
+            ques_list += load_json_once(__C.QUESTION_PATH[split])['questions']
+            if with_ans:
+                ans_list += load_json_once(__C.ANSWER_PATH[split])['annotations']
+
+        self.build_columns(ques_list)
+
+        self.token_to_ix, self.pretrained_emb = get_vocab(__C)
+
+        # Pre-tokenized questions, one row per entry of ques_list (cached on disk)
+        # 预先把所有问题转换为token编号矩阵，__getitem__里直接取行
+        self.ques_ix, self.ques_len = load_ques_ix(
+            ques_list,
+            self.token_to_ix,
+            __C.MAX_TOKEN,
+            [__C.QUESTION_PATH[split] for split in split_list],
+            __C.DATA_CACHE_PATH
+        )
+
+        self.ans_to_ix, self.ix_to_ans = get_ans_dict('core/data/answer_dict.json')
+
+        # Sparse answer scores (CSR), densified per batch in ans_collate
+        # 稀疏答案得分，在collate时才转换为稠密向量
+        self.ans_ptr, self.ans_ix, self.ans_score = None, None, None
+        if ans_list:
+            self.ans_ptr, self.ans_ix, self.ans_score = load_ans_csr(
+                ans_list,
+                self.ans_to_ix,
+                [__C.ANSWER_PATH[split] for split in split_list],
+                'core/data/answer_dict.json',
+                __C.DATA_CACHE_PATH
+            )
+
+            # Re-order the answer rows (ans_list order) to follow ques_list
+            ans_ques_rows = self.qid_rows(np.array([ans['question_id'] for ans in ans_list], np.int64))
+            self.ans_ptr, (self.ans_ix, self.ans_score) = csr_take_rows(
+                self.ans_ptr, (self.ans_ix, self.ans_score), np.argsort(ans_ques_rows)
+            )
+
+    # Columns saved to / loaded from a compiled corpus directory
+    COLUMNS = [
+        'qids', 'iids', 'qid_order', 'ques_ix', 'ques_len', 'skill_code',
+        'concept_ptr', 'concept_id', 'concept_pos', 'all_concept_ptr', 'all_concept_id',
+        'rs_row', 'rs_concept', 'rs_ptr', 'rs_ref',
+        'skill_pos_ptr', 'skill_pos_ref', 'skill_neg_ptr', 'skill_neg_ref',
+        'concept_rows_ptr', 'concept_rows_ix', 'skill_rows_ptr', 'skill_rows_ix',
+        'ans_ptr', 'ans_ix', 'ans_score'
+    ]
+
+    def __len__(self):
+        return len(self.qids)
+
+    def save(self, path):
+        for name in self.COLUMNS:
+            if getattr(self, name) is not None:
+                save_npy(getattr(self, name), os.path.join(path, name + '.npy'))
+        if self.pretrained_emb is not None:
+            save_npy(self.pretrained_emb, os.path.join(path, 'pretrained_emb.npy'))
+
+        save_json({
+            'split_list': self.split_list,
+            'skill_names': self.skill_names,
+            'concept_names': self.concept_names,
+            'tokens': list(self.token_to_ix),
+            'ans_to_ix': self.ans_to_ix,
+            'ix_to_ans': self.ix_to_ans
+        }, os.path.join(path, 'names.json'))
+
+    @classmethod
+    def load(cls, path):
+        # The columns are memory-mapped read-only: loading is instant and the DataLoader workers
+        # share the pages of the OS cache instead of each holding a copy
+        corpus = cls.__new__(cls)
+        for name in cls.COLUMNS:
+            fname = os.path.join(path, name + '.npy')
+            setattr(corpus, name, np.load(fname, mmap_mode='r') if os.path.exists(fname) else None)
+
+        fname = os.path.join(path, 'pretrained_emb.npy')
+        corpus.pretrained_emb = np.load(fname) if os.path.exists(fname) else None
+
+        with open(os.path.join(path, 'names.json'), 'r') as f:
+            names = json.load(f)
+        corpus.split_list = names['split_list']
+        corpus.skill_names = names['skill_names']
+        corpus.skill_to_code = {skill: code for code, skill in enumerate(corpus.skill_names)}
+        corpus.concept_names = names['concept_names']
+        corpus.concept_to_id = {c: ix for ix, c in enumerate(corpus.concept_names)}
+        corpus.token_to_ix = {word: ix for ix, word in enumerate(names['tokens'])}
+        corpus.ans_to_ix, corpus.ix_to_ans = names['ans_to_ix'], names['ix_to_ans']
+
+        return corpus
+
+    def qid_rows(self, qids):
+        # {question id} -> {row of the corpus}
+        # 问题编号-问题所在行，qids必须都在corpus中
+        return self.qid_order[np.searchsorted(self.qids, qids, sorter=self.qid_order)]
+
+    def build_columns(self, ques_list):
+        N = len(ques_list)
+        self.qids = np.array([ques['question_id'] for ques in ques_list], np.int64)
+        self.iids = np.array([ques['image_id'] for ques in ques_list], np.int64)
+        self.qid_order = np.argsort(self.qids, kind='stable')
+
+        skill_to_code = {}
+        self.skill_code = np.full(N, -1, np.int16)
+
+        concept_to_id = {}
+        self.concept_ptr = np.zeros(N + 1, np.int64)
+        self.all_concept_ptr = np.zeros(N + 1, np.int64)
+        concept_id, concept_pos, all_concept_id = [], [], []
+
+        for row, ques in enumerate(ques_list):
+            if ques.get('skill', None) is not None:
+                self.skill_code[row] = skill_to_code.setdefault(ques['skill'], len(skill_to_code))
+
+            concepts = ques.get('concepts', {})
+            for c, positions in concepts.items():
+                concept_id.append(concept_to_id.setdefault(c, len(concept_to_id)))
+                concept_pos.append(positions[0][0])
+            self.concept_ptr[row + 1] = len(concept_id)
+
+            for c in ques.get('all_concepts', concepts):
+                all_concept_id.append(concept_to_id.setdefault(c, len(concept_to_id)))
+            self.all_concept_ptr[row + 1] = len(all_concept_id)
+
+        self.build_refsets(ques_list, concept_to_id)
+
+        self.skill_names = list(skill_to_code)
+        self.skill_to_code = skill_to_code
+        self.concept_names = list(concept_to_id)
+        self.concept_to_id = concept_to_id
+        self.concept_id = np.array(concept_id, np.int32)
+        self.concept_pos = np.array(concept_pos, np.int32)
+        self.all_concept_id = np.array(all_concept_id, np.int32)
+
+        self.build_inverted_index()
+
+    def build_inverted_index(self):
+        # A stable sort by concept id / skill code keeps the rows of every entry ascending
+        # 概念-问题行、技能-问题行的倒排索引
+        entry_rows = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.all_concept_ptr))
+        self.concept_rows_ix = entry_rows[np.argsort(self.all_concept_id, kind='stable')]
+        self.concept_rows_ptr = np.zeros(len(self.concept_names) + 1, np.int64)
+        np.cumsum(np.bincount(self.all_concept_id, minlength=len(self.concept_names)), out=self.concept_rows_ptr[1:])
+
+        skill_rows = np.argsort(self.skill_code, kind='stable')
+        self.skill_rows_ix = skill_rows[self.skill_code[skill_rows] >= 0].astype(np.int64)
+        self.skill_rows_ptr = np.zeros(len(self.skill_names) + 1, np.int64)
+        np.cumsum(np.bincount(self.skill_code[self.skill_code >= 0], minlength=len(self.skill_names)),
+                  out=self.skill_rows_ptr[1:])
+
+    def concept_rows(self, concepts):
+        """
+        包含任一概念的问题行（升序），不在corpus中的概念被忽略
+        """
+        rows = [self.concept_rows_ix[self.concept_rows_ptr[c]:self.concept_rows_ptr[c + 1]]
+                for c in (self.concept_to_id[c] for c in set(concepts) if c in self.concept_to_id)]
+        if not rows:
+            return np.zeros(0, np.int64)
+        return np.unique(np.concatenate(rows))
+
+    def skill_rows(self, skill):
+        # 该技能的问题行（升序）
+        if skill not in self.skill_to_code:
+            return np.zeros(0, np.int64)
+        code = self.skill_to_code[skill]
+        return self.skill_rows_ix[self.skill_rows_ptr[code]:self.skill_rows_ptr[code + 1]]
+
+    def build_refsets(self, ques_list, concept_to_id):
+        # Flatten the nested 'refsets' / 'skill_refset' dicts, their 'index' entries are corpus rows
+        # 把嵌套的参考集字典编译为CSR数组，之后不再保留问题字典
+        rs_row, rs_concept, rs_groups = [], [], []
+        for row, ques in enumerate(ques_list):
+            for c, crefs in (ques.get('refsets', None) or {}).items():
+                rs_row.append(row)
+                rs_concept.append(concept_to_id.setdefault(c, len(concept_to_id)))
+                for dkey in REFSET_KINDS:
+                    # A kind without question ids counts as empty, as in the original has_refs check
+                    refs = crefs.get(dkey, {})
+                    rs_groups.append(refs['index'] if refs.get('question_id', None) else [])
+
+        self.rs_row = np.array(rs_row, np.int64)
+        self.rs_concept = np.array(rs_concept, np.int32)
+        self.rs_ptr, self.rs_ref = lists_to_csr(rs_groups)
+
+        skill_refsets = [ques.get('skill_refset', None) or {} for ques in ques_list]
+        self.skill_pos_ptr, self.skill_pos_ref = lists_to_csr([refs.get('pos', []) for refs in skill_refsets])
+        self.skill_neg_ptr, self.skill_neg_ref = lists_to_csr([refs.get('neg', []) for refs in skill_refsets])
+
+
+# -----------------------------
+# ---- Compiled Corpora ----
+# -----------------------------
+# 每个corpus编译为一个目录（各列一个.npy + names.json + manifest.json），manifest记录输入文件的
+# (大小, 修改时间, md5)和编译参数。manifest与输入一致时直接加载，否则重新编译。
+# The manifest is written last, so an interrupted compilation is never loaded.
+
+# Bump when the layout of a compiled corpus changes, older directories are then recompiled
+COMPILED_FORMAT_VERSION = 2
+
+
+def compiled_corpus_path(__C, split_list, with_ans):
+    return os.path.join(__C.COMPILED_DATA_PATH, '{}_{}_t{}{}'.format(
+        '+'.join(split_list), 'ans' if with_ans else 'ques', __C.MAX_TOKEN, '_glove' if __C.USE_GLOVE else ''
+    ))
+
+
+def corpus_manifest(__C, split_list, with_ans):
+    """
+    返回 (编译参数, 输入文件列表)
+    """
+    params = {
+        'version': COMPILED_FORMAT_VERSION,
+        'split_list': list(split_list),
+        'with_ans': with_ans,
+        'max_token': __C.MAX_TOKEN,
+        'use_glove': __C.USE_GLOVE
+    }
+
+    inputs = [__C.QUESTION_PATH[split] for split in VOCAB_SPLITS + list(split_list)]
+    if with_ans:
+        inputs += [__C.ANSWER_PATH[split] for split in split_list]
+    if __C.USE_GLOVE:
+        inputs += [__C.GLOVE_WORDS_PATH, __C.GLOVE_VECTORS_PATH]
+    inputs.append('core/data/answer_dict.json')
+
+    return params, sorted(set(inputs))
+
+
+def compile_corpus(__C, split_list, with_ans, path, params, inputs):
+    corpus = Corpus(__C, split_list, with_ans)
+
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        os.remove(os.path.join(path, 'manifest.json'))
+    for fname in glob.glob(os.path.join(path, '*.npy')):
+        os.remove(fname)
+
+    corpus.save(path)
+    save_json({
+        'params': params,
+        'inputs': {input_path: file_fingerprint(input_path) for input_path in inputs}
+    }, os.path.join(path, 'manifest.json'))
+    print('== Compiled corpus:', path)
+
+    return corpus
+
+
+def get_corpus(__C, split_list, with_ans):
+    def build():
+        path = compiled_corpus_path(__C, split_list, with_ans)
+        params, inputs = corpus_manifest(__C, split_list, with_ans)
+        if manifest_matches(path, params, inputs):
+            print('== Loaded compiled corpus:', path)
+            return Corpus.load(path)
+
+        return compile_corpus(__C, split_list, with_ans, path, params, inputs)
+
+    key = ('corpus', tuple(split_list), with_ans, __C.MAX_TOKEN, __C.USE_GLOVE)
+    return _cached(key, build)
+
+
+def prepare_corpora(__C):
+    """
+    --RUN prepare: 编译train/val/test模式所用的corpus，之后的运行直接加载
+    """
+    # (split, whether the answers are loaded), as in DataSet for each RUN_MODE
+    for run_mode, with_ans in [('train', True), ('val', False), ('test', False)]:
+        split_list = __C.SPLIT[run_mode].split('+')
+        missing = [__C.QUESTION_PATH[split] for split in split_list
+                   if not os.path.exists(__C.QUESTION_PATH[split])]
+        if missing:
+            print('Skip {}: {} DOES NOT EXIST'.format(run_mode, ', '.join(missing)))
+            continue
+
+        print('Preparing {} ({}) ........'.format(run_mode, '+'.join(split_list)))
+        corpus = get_corpus(__C, split_list, with_ans)
+        print('== {} questions'.format(len(corpus)))
+
+    release_json()
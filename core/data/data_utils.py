@@ -1,25 +1,71 @@
-from core.data.ans_punct import prep_ans
+from core.data.normalize import prep_ans_list, get_words
+from core.data.file_utils import hash_files, save_json
 
-from core.data.save_glove_embeds import StoredEmbeds
 import numpy as np
-import random, re, json
+import random, json, os, hashlib, contextlib, threading, torch
 # noinspection PyProtectedMember
 from torch.utils.data._utils.collate import default_collate
 
-try:
-    # noinspection PyUnresolvedReferences
-    import en_vectors_web_lg
-except ImportError:
-    import spacy
 
+# Reference kinds of a concept reference set, in the order of the groups in Corpus.rs_ptr
+# 参考集中每个(问题, 概念)对的参考问题类别
+REFSET_KINDS = ['pos', 'neg1', 'neg2']
 
-def shuffle_list(ans_list):
-    random.shuffle(ans_list)
 
+def shuffle_list(rows):
+    np.random.shuffle(rows)
 
-def save_json(obj, fname):
-    with open(fname, 'w') as f:
-        json.dump(obj, f)
+
+def seed_worker(worker_id):
+    # DataLoader workers are forked with the same numpy RNG state, reseed from the per-worker torch seed
+    # 参考集采样使用np.random，每个worker需要不同的种子
+    np.random.seed(torch.initial_seed() % 2 ** 32)
+
+
+@contextlib.contextmanager
+def seeded_random(seed):
+    # Seeds random and np.random for one item, the previous states are restored afterwards
+    # (the dataset may run in the main process when NUM_WORKERS is 0)
+    py_state, np_state = random.getstate(), np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        yield
+    finally:
+        random.setstate(py_state)
+        np.random.set_state(np_state)
+
+
+def get_rng_state():
+    """
+    保存python、numpy、torch（CPU和GPU）的随机数状态，只包含tensor和基本类型，torch.load(weights_only=True)也能加载
+    """
+    np_state = np.random.get_state()
+    state = {
+        'python': random.getstate(),
+        'numpy': (torch.from_numpy(np_state[1].astype(np.int64)),) + tuple(np_state[2:]),
+        'torch': torch.get_rng_state(),
+        'cuda': []
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    key, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state(('MT19937', key.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    torch.set_rng_state(state['torch'])
+    if state['cuda']:
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def save_json_async(build_fn, fname):
+    # build_fn() is built and saved in a background thread; the process waits for it before exiting
+    thread = threading.Thread(target=lambda: save_json(build_fn(), fname))
+    thread.start()
+    return thread
 
 
 def load_json(fname):
@@ -71,22 +117,95 @@ def ques_load(ques_list):
     return qid_to_ques
 
 
-def get_words(question_str):
-    return re.sub(
-        r"([.,'!?\"()*#:;])",
-        '',
-        question_str.lower()
-    ).replace('-', ' ').replace('/', ' ').split()
+def hash_vocab(token_to_ix):
+    return hashlib.md5(json.dumps(token_to_ix, sort_keys=True).encode()).hexdigest()
+
 
+def save_npz(fname, **arrays):
+    # The cache directory is not tracked by git and prepare runs before check_path, create it on first use
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+    tmp_fname = fname + '.tmp{}'.format(os.getpid())
+    with open(tmp_fname, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_fname, fname)
 
-def tokenize(stat_ques_list, use_glove, save_embeds=False):
+
+def load_ques_ix(ques_list, token_to_ix, max_token, ques_files, cache_path):
     """
-    用Glove进行word embedding，传入的use_glove必须为True
-    使用spacy工具和en_vectors_web_lg
+    返回所有问题的token编号矩阵 int32 [N, max_token] 和未截断的问题长度 int32 [N]
+    以词表和问题文件的hash为key缓存到磁盘，之后的运行直接读取
     """
-    # This function basically requires use_glove to be true in order to work correctly.
-    # Otherwise, the indices in token_to_ix don't match the actual embedding matrix.
+    key = hashlib.md5('{}_{}_{}'.format(
+        hash_vocab(token_to_ix), hash_files(ques_files), max_token
+    ).encode()).hexdigest()
+    cache_file = os.path.join(cache_path, 'ques_ix_' + key + '.npz')
+
+    if os.path.exists(cache_file):
+        cached = np.load(cache_file)
+        if cached['ques_ix'].shape[0] == len(ques_list):
+            print('== Loaded tokenized questions:', cache_file)
+            return cached['ques_ix'], cached['ques_len']
+
+    ques_ix, ques_len = proc_ques_list(ques_list, token_to_ix, max_token)
+    save_npz(cache_file, ques_ix=ques_ix, ques_len=ques_len)
+    print('== Saved tokenized questions:', cache_file)
+
+    return ques_ix, ques_len
 
+
+def load_ans_csr(ans_list, ans_to_ix, ans_files, ans_dict_file, cache_path):
+    """
+    返回所有标注的稀疏答案得分（CSR格式，行顺序与ans_list一致）
+    以标注文件和答案词典的hash为key缓存到磁盘
+    """
+    key = hashlib.md5('{}_{}'.format(
+        hash_files(ans_files), hash_files([ans_dict_file])
+    ).encode()).hexdigest()
+    cache_file = os.path.join(cache_path, 'ans_csr_' + key + '.npz')
+
+    if os.path.exists(cache_file):
+        ans_csr = np.load(cache_file)
+        if ans_csr['ptr'].shape[0] == len(ans_list) + 1:
+            print('== Loaded answer targets:', cache_file)
+            return ans_csr['ptr'], ans_csr['ix'], ans_csr['score']
+
+    ans_ptr, ans_ix, ans_score = proc_ans_list(ans_list, ans_to_ix)
+    save_npz(cache_file, ptr=ans_ptr, ix=ans_ix, score=ans_score)
+    print('== Saved answer targets:', cache_file)
+
+    return ans_ptr, ans_ix, ans_score
+
+
+def csr_take_rows(ptr, values, rows):
+    """
+    按rows取CSR的行（可用于重排或删除行），values为与ptr对应的若干数组
+    """
+    rows = np.asarray(rows, np.int64)
+    row_lens = ptr[rows + 1] - ptr[rows]
+
+    new_ptr = np.zeros(len(rows) + 1, np.int64)
+    np.cumsum(row_lens, out=new_ptr[1:])
+
+    take = np.arange(new_ptr[-1], dtype=np.int64) + np.repeat(ptr[rows] - new_ptr[:-1], row_lens)
+
+    return new_ptr, [v[take] for v in values]
+
+
+def lists_to_csr(lists, dtype=np.int64):
+    """
+    把若干个列表拼接为CSR (ptr, values)
+    """
+    ptr = np.zeros(len(lists) + 1, np.int64)
+    np.cumsum([len(l) for l in lists], out=ptr[1:])
+    values = np.fromiter((v for l in lists for v in l), dtype, count=int(ptr[-1]))
+    return ptr, values
+
+
+def tokenize(stat_ques_list, use_glove, ques_files, glove_words_file, glove_vectors_file, cache_path):
+    """
+    建立词表，并从本地GloVe二进制文件（词表 + memory-mapped向量）中取出对应的词向量
+    结果以问题文件内容的hash为key缓存到磁盘
+    """
     # 定义一些特殊字符 PAD：空格；UNK：未知字符；[MASK]：掩盖代号；[CLS]：分类符
     token_to_ix = {
         'PAD': 0,
@@ -95,53 +214,65 @@ def tokenize(stat_ques_list, use_glove, save_embeds=False):
         '[CLS]': 3
     }
 
-    spacy_tool = None
-    pretrained_emb = []
-    stored_embeds = StoredEmbeds(embed_fname='./ckpts/glove_embeds.pkl')
-    if use_glove:
-        try:
-            spacy_tool = en_vectors_web_lg.load()
-        except NameError:
-            try:
-                spacy_tool = spacy.load('en_vectors_web_lg')
-            except OSError:
-                if not stored_embeds.has_embeds():
-                    raise ValueError('Spacy could not be loaded and no stored glove embeddings were found.')
-                return stored_embeds.get_embeds()
-
-        known_vec = spacy_tool('the').vector
-        mu = 0.
-        sigma = np.sqrt(1. / known_vec.shape[0])
-
-        # 特殊字符的嵌入
-        pretrained_emb.append(spacy_tool('PAD').vector)
-        pretrained_emb.append(spacy_tool('UNK').vector)
-        pretrained_emb.append(
-            sigma * np.random.randn(*known_vec.shape).astype(dtype=known_vec.dtype) + mu
-        )  # Embedding for [MASK]
-        pretrained_emb.append(
-            sigma * np.random.randn(*known_vec.shape).astype(dtype=known_vec.dtype) + mu
-        )  # Embedding for [CLS]
+    key = hashlib.md5('{}_{}_{}'.format(
+        hash_files(ques_files), use_glove, hash_files([glove_words_file]) if use_glove else ''
+    ).encode()).hexdigest()
+    cache_file = os.path.join(cache_path, 'vocab_' + key + '.npz')
+
+    if os.path.exists(cache_file):
+        print('== Loaded vocabulary:', cache_file)
+        vocab = np.load(cache_file)
+        token_to_ix = {str(word): ix for ix, word in enumerate(vocab['tokens'])}
+        pretrained_emb = vocab['emb'] if use_glove else None
+        return token_to_ix, pretrained_emb
 
     for ques in stat_ques_list:
         # words是一个列表
-        words = get_words(ques['question'])
-
-        for word in words:
+        for word in get_words(ques['question']):
             if word not in token_to_ix:
                 # 将没见过的词添加到token_to_ix的label-encoding的词典中
                 token_to_ix[word] = len(token_to_ix)
-                if use_glove:
-                    pretrained_emb.append(spacy_tool(word).vector)
 
-    if save_embeds:
-        # Embeddings will not be overwritten if file already exists.
-        stored_embeds.set_embeds(token_to_ix, pretrained_emb)
-        stored_embeds.save()
+    tokens = list(token_to_ix)
+    pretrained_emb = np.zeros((0, 0), np.float32)
+    if use_glove:
+        pretrained_emb = load_glove_vectors(tokens, glove_words_file, glove_vectors_file)
+
+        mu = 0.
+        sigma = np.sqrt(1. / pretrained_emb.shape[1])
+        # Embeddings for [MASK] and [CLS]
+        pretrained_emb[2:4] = sigma * np.random.randn(2, pretrained_emb.shape[1]).astype(pretrained_emb.dtype) + mu
+
+    save_npz(cache_file, tokens=np.array(tokens), emb=pretrained_emb)
+    print('== Saved vocabulary:', cache_file)
+
+    return token_to_ix, pretrained_emb if use_glove else None
+
+
+def load_glove_vectors(words, glove_words_file, glove_vectors_file):
+    """
+    一次遍历GloVe词表文件找到所有词所在的行，再用一次fancy index从memmap中取出向量
+    不在GloVe中的词向量为0
+    """
+    word_to_pos = {word: pos for pos, word in enumerate(words)}
+    rows = np.full(len(words), -1, np.int64)
 
-    pretrained_emb = np.array(pretrained_emb)
+    with open(glove_words_file, 'r', encoding='utf-8') as f:
+        for row, line in enumerate(f):
+            pos = word_to_pos.get(line.rstrip('\n'))
+            if pos is not None and rows[pos] < 0:
+                rows[pos] = row
 
-    return token_to_ix, pretrained_emb
+    glove_vectors = np.load(glove_vectors_file, mmap_mode='r')
+    found_pos = np.nonzero(rows > -1)[0]
+    # Gather in increasing row order, so the memory map is read front to back
+    found_pos = found_pos[np.argsort(rows[found_pos])]
+
+    pretrained_emb = np.zeros((len(words), glove_vectors.shape[1]), np.float32)
+    pretrained_emb[found_pos] = glove_vectors[rows[found_pos]]
+    print('== Found GloVe vectors for {} of {} words'.format(len(found_pos), len(words)))
+
+    return pretrained_emb
 
 
 # def ans_stat(stat_ans_list, ans_freq):
@@ -216,6 +347,16 @@ def proc_ques(ques, token_to_ix, max_token, add_cls=False):
     return ques_ix
 
 
+def proc_ques_list(ques_list, token_to_ix, max_token):
+    ques_ix = np.zeros((len(ques_list), max_token), np.int32)
+    ques_len = np.zeros(len(ques_list), np.int32)
+    for row, ques in enumerate(ques_list):
+        ques_ix[row] = proc_ques(ques, token_to_ix, max_token, add_cls=False)
+        ques_len[row] = len(get_words(ques['question']))
+
+    return ques_ix, ques_len
+
+
 def get_score(occur):
     if occur == 0:
         return .0
@@ -233,8 +374,7 @@ def proc_ans(ans, ans_to_ix):
     ans_score = np.zeros(ans_to_ix.__len__(), np.float32)
     ans_prob_dict = {}
 
-    for ans_ in ans['answers']:
-        ans_proc = prep_ans(ans_['answer'])
+    for ans_proc in prep_ans_list([ans_['answer'] for ans_ in ans['answers']]):
         if ans_proc not in ans_prob_dict:
             ans_prob_dict[ans_proc] = 1
         else:
@@ -247,101 +387,186 @@ def proc_ans(ans, ans_to_ix):
     return ans_score
 
 
+def proc_ans_list(ans_list, ans_to_ix):
+    ans_ptr = np.zeros(len(ans_list) + 1, np.int64)
+    ans_ix, ans_score = [], []
+
+    for row, ans in enumerate(ans_list):
+        ans_prob_dict = {}
+        for ans_proc in prep_ans_list([ans_['answer'] for ans_ in ans['answers']]):
+            if ans_proc not in ans_prob_dict:
+                ans_prob_dict[ans_proc] = 1
+            else:
+                ans_prob_dict[ans_proc] += 1
+
+        for ans_ in ans_prob_dict:
+            if ans_ in ans_to_ix:
+                ans_ix.append(ans_to_ix[ans_])
+                ans_score.append(get_score(ans_prob_dict[ans_]))
+
+        ans_ptr[row + 1] = len(ans_ix)
+
+    return ans_ptr, np.array(ans_ix, np.int64), np.array(ans_score, np.float32)
+
+
+def pad_stack(samples, length=None):
+    """
+    把第0维长度不同的样本（框数或token数）补零后堆叠为一个batch
+    length defaults to the longest sample of the batch, samples of equal length are simply stacked
+    """
+    samples = [torch.as_tensor(x) for x in samples]
+    if length is None:
+        length = max(max(len(x) for x in samples), 1)
+    if all(len(x) == length for x in samples):
+        return torch.stack(samples)
+
+    batch = samples[0].new_zeros((len(samples), length) + samples[0].shape[1:])
+    for i, x in enumerate(samples):
+        batch[i, :len(x)] = x
+    return batch
+
+
+def pad_collate(batch):
+    # Images and questions are padded to the longest sample of the batch (see DYNAMIC_PAD)
+    img_feat_iter, ques_ix_iter, ans_iter = zip(*batch)
+    return pad_stack(img_feat_iter), pad_stack(ques_ix_iter), default_collate(ans_iter)
+
+
+def ans_collate(batch, ans_size):
+    """
+    每个样本的答案为稀疏的(答案编号, 得分)，在这里一次scatter得到整个batch的稠密目标
+    """
+    img_feat_iter, ques_ix_iter, ans_iter = zip(*batch)
+
+    ans_ix, ans_score = zip(*ans_iter)
+    ans_rows = torch.repeat_interleave(
+        torch.arange(len(batch)),
+        torch.tensor([len(ix) for ix in ans_ix], dtype=torch.long)
+    )
+
+    ans_dense = torch.zeros(len(batch), ans_size, dtype=torch.float32)
+    ans_dense[ans_rows, torch.cat(ans_ix)] = torch.cat(ans_score)
+
+    return pad_stack(img_feat_iter), pad_stack(ques_ix_iter), ans_dense
+
+
 def refset_collate(batch):
     tgt, refs, label, pos, qid_data = zip(*batch)
 
-    tgt, label, pos = default_collate(tgt), default_collate(label), default_collate(pos)
+    label, pos = default_collate(label), default_collate(pos)
 
     refs = list(refs)
     n_refs = len(refs[0])  # number of reference examples
 
-    batched_refs = []
-    for i in range(n_refs):
-        ref_i_all = [per_row[i] for per_row in refs]
-        ref_i_batched = default_collate(ref_i_all)
-        batched_refs.append(ref_i_batched)
+    # Target and reference questions share one length: pointing concatenates the reference
+    # hidden states, positions are offset by the question length
+    # 目标问题和参考问题补齐到同一长度，图像补齐到同一框数（训练时拼接成一个batch做一次前向）
+    groups = [list(tgt)] + [[per_row[i] for per_row in refs] for i in range(n_refs)]
+    ques_len = max(len(sample[1]) for group in groups for sample in group)
+    img_len = max(max(len(sample[0]) for group in groups for sample in group), 1)
 
-    return tgt, batched_refs, label, pos, qid_data
+    batched_groups = []
+    for group in groups:
+        img_feat_iter, ques_ix_iter, ans_iter = zip(*group)
+        batched_groups.append(
+            (pad_stack(img_feat_iter, img_len), pad_stack(ques_ix_iter, ques_len), default_collate(ans_iter))
+        )
+
+    return batched_groups[0], batched_groups[1:], label, pos, qid_data
 
 
-def refset_tocuda(refset_data):
+def ans_tocuda(ans_data, non_blocking=False):
+    return tuple(x.cuda(non_blocking=non_blocking) for x in ans_data)
+
+
+def refset_tocuda(refset_data, non_blocking=False):
     tgt, batched_refs, label, pos, qid_data = refset_data
 
     # label += 1
 
     # print(f'label: {label}')
     # print("---------------------------------------------")
-    label, pos = label.cuda(), pos.cuda()
+    label, pos = label.cuda(non_blocking=non_blocking), pos.cuda(non_blocking=non_blocking)
 
-    tgt = (tgt[0].cuda(), tgt[1].cuda(), tgt[2].cuda())
+    tgt = tuple(x.cuda(non_blocking=non_blocking) for x in tgt)
 
     if all(len(x) for x in batched_refs):
-        batched_refs = [(x[0].cuda(), x[1].cuda(), x[2].cuda()) for x in batched_refs]
+        batched_refs = [tuple(x.cuda(non_blocking=non_blocking) for x in ref) for ref in batched_refs]
 
     return tgt, batched_refs, label, pos, qid_data
 
 
-def refset_point_refset_index(question_list, max_token, novel_indices=None, aug_factor=1):
+def refset_point_refset_index(corpus, rs_ptr, max_token, novel_indices=None, aug_factor=1):
+    """
+    返回可用的(问题, 概念)对编号数组：每类参考问题都非空，且概念位置小于max_token
+    新问题的概念对重复aug_factor次
+    """
     # This assumes that each concept only appears once in the question. 每个概念仅在问题中出现一次
     # If this is a bad assumption, then we need to iterate over question['concepts']
+    has_refs = (np.diff(rs_ptr).reshape(-1, len(REFSET_KINDS)) > 0).all(axis=1)
+
+    # Assumes each concepts appears once.
+    positions = get_concept_positions(corpus, corpus.rs_row, corpus.rs_concept)
+    valid = has_refs & (positions < max_token)
 
-    n_questions = len(question_list)
-    # 初始化新问题的判别列表
-    is_novel = [False for _ in range(n_questions)]
+    # 新问题的判别数组
+    is_novel = np.zeros(len(corpus), bool)
     if novel_indices:
-        # 如果没有传入新问题的索引，则初始化所有问题为新问题
-        for x in novel_indices:
-            is_novel[x] = True
-
-    rs_idx = []
-    count_novel = 0
-    for qidx, question in enumerate(question_list):
-        if question.get('refsets', None):
-            # 如果当前问题有参考集
-            # c是concept
-            for c, crefs in question['refsets'].items():
-                has_refs = True
-                for dkey, vals in crefs.items():
-                    # len(vals['index']) == 0 or len(vals['question_id']) == 0
-                    if not len(vals['index']) or not len(vals['question_id']):
-                        has_refs = False
-                        break
-
-                # Assumes each concepts appears once.
-                if get_concept_position(question, c) < max_token and has_refs:
-                    rs_idx.append((qidx, c))
-
-                    if is_novel[qidx]:
-                        for _ in range(aug_factor - 1):
-                            rs_idx.append((qidx, c))
-                            count_novel += 1
+        is_novel[novel_indices] = True
+
+    pair_is_novel = is_novel[corpus.rs_row]
+    repeats = np.where(pair_is_novel, aug_factor, 1) * valid
+    rs_idx = np.repeat(np.arange(len(repeats), dtype=np.int64), repeats)
 
+    count_novel = int((repeats[pair_is_novel] - 1).clip(min=0).sum())
     print('Added {x} number of novel questions for the refset'.format(x=count_novel))
 
     return rs_idx
 
 
-def prune_refsets(question_list, refset_sizes, max_token):
+def prune_refsets(corpus, max_token):
     """
-    refset_sizes: list(zip(['pos', 'neg1', 'neg2'], [1, 1, 1]))
+    删除超过MAX_TOKEN的参考问题，返回新的 (rs_ptr, rs_ref)，不修改共享的corpus
     """
-    for question in question_list:
-        if question.get('refsets', None):
-            # 如果当前问题有参考集
-            for c, crefs in question['refsets'].items():
-                for dkey, _ in refset_sizes:
-                    for i, idx in reversed(list(enumerate(crefs[dkey]['index']))):
-                        if len(get_words(question_list[idx]['question'])) > max_token:
-                            # 超过MAX_TOKEN部分将其删除
-                            crefs[dkey]['index'].pop(i)
-                            crefs[dkey]['question_id'].pop(i)
+    n_groups = len(corpus.rs_ptr) - 1
+    group_of_ref = np.repeat(np.arange(n_groups, dtype=np.int64), np.diff(corpus.rs_ptr))
+    keep = corpus.ques_len[corpus.rs_ref] <= max_token
 
-    return question_list
+    rs_ptr = np.zeros(n_groups + 1, np.int64)
+    np.cumsum(np.bincount(group_of_ref[keep], minlength=n_groups), out=rs_ptr[1:])
 
+    return rs_ptr, corpus.rs_ref[keep]
 
-def get_concept_position(question, concept):
+
+def get_concept_position(corpus, row, concept):
     # This assumes that concepts are only 1 word. Also, as in refset_index(), we assume each concept appears once.
-    return question['concepts'].get(concept, [[-1]])[0][0]
+    start, end = corpus.concept_ptr[row], corpus.concept_ptr[row + 1]
+    hits = np.nonzero(corpus.concept_id[start:end] == corpus.concept_to_id.get(concept, -1))[0]
+    if not len(hits):
+        return -1
+    return int(corpus.concept_pos[start + hits[0]])
+
+
+def get_concept_positions(corpus, rows, concept_ids):
+    """
+    get_concept_position的向量化版本，rows和concept_ids一一对应，不存在的概念返回-1
+    Only the concept entries of the given rows are read, the cost does not grow with the corpus.
+    """
+    rows = np.asarray(rows, np.int64)
+    concept_ids = np.asarray(concept_ids, np.int64)
+    starts = corpus.concept_ptr[rows]
+    lens = corpus.concept_ptr[rows + 1] - starts
+
+    # Concept entries of every query, query by query
+    query_of_entry = np.repeat(np.arange(len(rows), dtype=np.int64), lens)
+    entries = np.arange(lens.sum(), dtype=np.int64) + np.repeat(starts - (np.cumsum(lens) - lens), lens)
+    hit = corpus.concept_id[entries] == concept_ids[query_of_entry]
+
+    # The first matching entry of every query, as in get_concept_position
+    hit_queries, first = np.unique(query_of_entry[hit], return_index=True)
+    positions = np.full(len(rows), -1, np.int64)
+    positions[hit_queries] = corpus.concept_pos[entries[hit][first]]
+    return positions
 
 
 def do_token_masking(token_id, token_to_ix, mask_mode):
@@ -378,25 +603,28 @@ def do_token_masking(token_id, token_to_ix, mask_mode):
 
 
 # noinspection PyPep8Naming,PyShadowingBuiltins
-def filter_concept_skill(ques_list, ans_list, concept, skill):
-    N, N_ans = len(ques_list), len(ans_list)
+def filter_concept_skill(corpus, concept, skill):
+    """
+    返回去掉新问题后剩余的行号，不修改共享的corpus
+    """
+    N, N_ans = len(corpus), len(corpus.ans_ptr) - 1
     assert N == N_ans
 
-    novel_ques_ids, novel_indices = get_novel_ids(ques_list, concept, skill)
+    novel_ques_ids, novel_indices = get_novel_ids(corpus, concept, skill)
 
-    count = 0
-    for id in reversed(novel_indices):  # going back to front, delete novel idx
-        # 通过逆序索引，逐个删除新出现的问题答案对
-        del ques_list[id]
-        del ans_list[id]
-        count += 1
+    # 去掉新出现的问题答案对所在的行
+    keep = np.ones(N, bool)
+    keep[novel_indices] = False
+    rows = np.nonzero(keep)[0]
 
-    print('Removed {x} number of novel questions from the current split'.format(x=count))
-    print('New dataset size is {x}'.format(x=len(ques_list)))
+    print('Removed {x} number of novel questions from the current split'.format(x=N - len(rows)))
+    print('New dataset size is {x}'.format(x=len(rows)))
+
+    return rows
 
 
 # noinspection PyPep8Naming
-def get_novel_ids(ques_list, concept, skill):
+def get_novel_ids(corpus, concept, skill):
     # 新的编号，新的索引
     novel_ids, novel_indices = [], []
     if not concept:
@@ -407,60 +635,41 @@ def get_novel_ids(ques_list, concept, skill):
         # concept是字符串格式，以,为分隔符
         concept = concept.split(',')
 
-    # 转换为集合去重
-    concept_set = set(concept)
-
-    # N是问题数
-    N = len(ques_list)
-
-    for i in range(N):
-        ques = ques_list[i]
-
-        # 这里猜测ques_list是个字典组成的列表
-        if 'all_concepts' not in ques:
-            # all_concepts不在当前取出的ques的keys里，就取concepts对应的值至curr_concepts
-            curr_concepts = set(ques['concepts'])
-        else:
-            curr_concepts = set(ques['all_concepts'])
-
-        # 是否找到当前概念
-        found_concept = bool(len(concept_set & curr_concepts))
+    # Rows containing any of the concepts (all_concepts, concepts when missing), from the inverted index
+    # 包含任一概念的问题行
+    novel_indices = corpus.concept_rows(concept)
 
-        if not found_concept:
-            # found_concept为False，未找到当前概念
-            continue
+    if not (skill is None or skill.lower() == 'none'):
+        # 当前ques对应的skill是当前skill值
+        novel_indices = np.intersect1d(novel_indices, corpus.skill_rows(skill), assume_unique=True)
 
-        if (skill is None or skill.lower() == 'none') or ques['skill'] == skill:
-            # skill为空/当前ques对应的skill是当前skill值
-            # Found a match, add question id 找到一组匹配，保存问题的编号和索引
-            novel_ids.append(ques['question_id'])
-            novel_indices.append(i)
+    # Found a match, add question id 找到一组匹配，保存问题的编号和索引
+    novel_ids = corpus.qids[novel_indices]
 
     print('Found {x} number of novel question ids'.format(x=len(novel_ids)))
-    return novel_ids, novel_indices
+    return novel_ids.tolist(), novel_indices.tolist()
 
 
-def sample_references(question, concept, reftype_key, n_samples=1):
-    return random.sample(question['refsets'][concept][reftype_key]['index'], k=n_samples)
+def sample_references(ref_ptr, ref_index, group, n_samples=1):
+    start, end = ref_ptr[group], ref_ptr[group + 1]
+    return ref_index[start + np.random.choice(end - start, n_samples, replace=False)].tolist()
 
 
-def sample_refset(question, concept, refset_sizes):
+def sample_refset(rs_ptr, rs_ref, pair, refset_sizes):
     sampled_rs = []
     for dkey, n_samples in refset_sizes:
-        sampled_rs.append(sample_references(question, concept, dkey, n_samples))
+        group = pair * len(REFSET_KINDS) + REFSET_KINDS.index(dkey)
+        sampled_rs.append(sample_references(rs_ptr, rs_ref, group, n_samples))
     return sampled_rs
 
 
-def build_skill_references(question_list):
-    skill_refs = []
-    for i, ques in enumerate(question_list):
-        if ques.get('skill_refset', None):
-            if len(ques['skill_refset']['pos']) and len(ques['skill_refset']['neg']) > 1:
-                skill_refs.append((i, 'none'))
-    return skill_refs
+def build_skill_references(corpus):
+    n_pos = np.diff(corpus.skill_pos_ptr)
+    n_neg = np.diff(corpus.skill_neg_ptr)
+    return np.nonzero((n_pos > 0) & (n_neg > 1))[0]
 
 
-def sample_contrasting_skills(question, n_pos_samples, n_neg_samples):
-    pos_samples_ = random.sample(question['skill_refset']['pos'], k=n_pos_samples)
-    neg_samples_ = random.sample(question['skill_refset']['neg'], k=n_neg_samples)
+def sample_contrasting_skills(corpus, row, n_pos_samples, n_neg_samples):
+    pos_samples_ = sample_references(corpus.skill_pos_ptr, corpus.skill_pos_ref, row, n_pos_samples)
+    neg_samples_ = sample_references(corpus.skill_neg_ptr, corpus.skill_neg_ref, row, n_neg_samples)
     return pos_samples_, neg_samples_
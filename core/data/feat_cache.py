@@ -0,0 +1,163 @@
+import torch
+import torch.multiprocessing as mp
+
+
+# -------------------------------------
+# ---- Shared Image Feature Cache ----
+# -------------------------------------
+# 固定大小的共享内存缓存，保存截断到IMG_FEAT_PAD_SIZE个框的图像特征及其框数，按image id索引
+# The cache is created in the main process before the DataLoader workers start; its tensors
+# live in shared memory, so every worker (and every epoch) reads and fills the same slots.
+#
+# Eviction follows the CLOCK policy: each slot has a reference bit that is set on every hit,
+# the hand clears set bits and evicts the first slot whose bit is already clear.
+#
+# Image ids are mapped to slots by an open-addressing hash table (linear probing, backward-shift
+# deletion) kept in shared memory as well. Only put (insertion and eviction) takes the lock; get probes
+# the table and copies the features without it, and every slot carries a version counter (seqlock):
+# odd while the slot is being rewritten, so a hit whose copy raced with an eviction is detected and
+# reported as a miss. The hit/miss counters are updated without the lock and are approximate.
+
+# Multiplicative hashing constant (2^64 / golden ratio)
+_HASH_MULT = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+
+
+class SharedImgFeatCache:
+    """
+    capacity个 IMG_FEAT_PAD_SIZE x IMG_FEAT_SIZE 的特征块（float32时每张图约0.8MB，float16减半）
+    """
+    def __init__(self, capacity, img_feat_pad_size, img_feat_size, dtype='float32'):
+        self.capacity = capacity
+
+        self.feats = torch.zeros(capacity, img_feat_pad_size, img_feat_size, dtype=getattr(torch, dtype)).share_memory_()
+        self.slot_iids = torch.full((capacity,), -1, dtype=torch.int64).share_memory_()
+        self.slot_num_boxes = torch.zeros(capacity, dtype=torch.int64).share_memory_()
+        self.slot_versions = torch.zeros(capacity, dtype=torch.int64).share_memory_()
+        self.ref_bits = torch.zeros(capacity, dtype=torch.uint8).share_memory_()
+
+        # Hash table {image id -> slot}, at most half full
+        self.table_bits = max(int(2 * capacity - 1).bit_length(), 1)
+        self.table_mask = (1 << self.table_bits) - 1
+        self.table_iids = torch.full((1 << self.table_bits,), -1, dtype=torch.int64).share_memory_()
+        self.table_slots = torch.full((1 << self.table_bits,), -1, dtype=torch.int64).share_memory_()
+
+        # [hand, hits, misses]
+        self.state = torch.zeros(3, dtype=torch.int64).share_memory_()
+        self.lock = mp.Lock()
+
+    def home(self, iid):
+        # First table position probed for iid
+        return ((int(iid) * _HASH_MULT) & _MASK64) >> (64 - self.table_bits)
+
+    def probe(self, iid):
+        """
+        返回iid在哈希表中的位置，不存在时返回-1
+        Without the lock the answer may be stale, callers validate the slot it points to.
+        """
+        table_iids = self.table_iids.numpy()
+        pos = self.home(iid)
+        for _ in range(len(table_iids)):
+            table_iid = table_iids[pos]
+            if table_iid == iid:
+                return pos
+            if table_iid == -1:
+                return -1
+            pos = (pos + 1) & self.table_mask
+        return -1
+
+    def find(self, iid):
+        pos = self.probe(iid)
+        return int(self.table_slots[pos]) if pos != -1 else -1
+
+    def get(self, iid):
+        """
+        命中时返回特征的拷贝，否则返回None
+        """
+        slot = self.find(iid)
+        if slot != -1:
+            versions, slot_iids = self.slot_versions.numpy(), self.slot_iids.numpy()
+            version = versions[slot]
+            if version % 2 == 0 and slot_iids[slot] == iid:
+                img_feat = self.feats[slot, :int(self.slot_num_boxes[slot])].numpy().copy()
+                # The slot was not evicted or rewritten during the copy
+                if versions[slot] == version and slot_iids[slot] == iid:
+                    self.state[1] += 1
+                    self.ref_bits[slot] = 1
+                    return img_feat
+
+        self.state[2] += 1
+        return None
+
+    def put(self, iid, img_feat):
+        # img_feat: num_boxes x IMG_FEAT_SIZE, num_boxes <= IMG_FEAT_PAD_SIZE
+        with self.lock:
+            if self.probe(iid) != -1:
+                # Another worker has inserted it meanwhile
+                return
+
+            ref_bits = self.ref_bits.numpy()
+            hand = int(self.state[0])
+            while ref_bits[hand]:
+                ref_bits[hand] = 0
+                hand = (hand + 1) % self.capacity
+
+            versions = self.slot_versions.numpy()
+            versions[hand] += 1
+            if self.slot_iids[hand] != -1:
+                self.table_remove(int(self.slot_iids[hand]))
+
+            self.feats[hand, :len(img_feat)] = torch.from_numpy(img_feat)
+            self.slot_iids[hand] = iid
+            self.slot_num_boxes[hand] = len(img_feat)
+            versions[hand] += 1
+            self.table_insert(iid, hand)
+
+            ref_bits[hand] = 1
+            self.state[0] = (hand + 1) % self.capacity
+
+    def table_insert(self, iid, slot):
+        # Called with the lock held, the table always has a free position
+        table_iids, table_slots = self.table_iids.numpy(), self.table_slots.numpy()
+        pos = self.home(iid)
+        while table_iids[pos] != -1:
+            pos = (pos + 1) & self.table_mask
+        table_slots[pos] = slot
+        table_iids[pos] = iid
+
+    def table_remove(self, iid):
+        # Called with the lock held; later entries of the probe run are shifted back into the hole,
+        # so lookups never need tombstones
+        table_iids, table_slots = self.table_iids.numpy(), self.table_slots.numpy()
+        hole = self.probe(iid)
+        if hole == -1:
+            return
+
+        pos = hole
+        while True:
+            pos = (pos + 1) & self.table_mask
+            if table_iids[pos] == -1:
+                break
+            # Entries whose home lies cyclically in (hole, pos] stay where they are
+            home = self.home(table_iids[pos])
+            if (hole < pos and hole < home <= pos) or (hole > pos and (home > hole or home <= pos)):
+                continue
+            table_slots[hole] = table_slots[pos]
+            table_iids[hole] = table_iids[pos]
+            hole = pos
+        table_iids[hole] = -1
+
+    def stats(self):
+        # hits, misses, hit rate and the number of filled slots
+        hits, misses = int(self.state[1]), int(self.state[2])
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / max(hits + misses, 1),
+            'used': int((self.slot_iids >= 0).sum()),
+            'capacity': self.capacity
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.state[1:] = 0
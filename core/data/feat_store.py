@@ -0,0 +1,147 @@
+import numpy as np
+import glob, os, zipfile
+
+
+# -----------------------------------
+# ---- Packed Image Feature Store ----
+# -----------------------------------
+# 将每个split下的*.npz特征文件打包成一个连续的.npy数组（可memory-map），
+# 另存一个索引文件：image id -> (行偏移, 框数)
+#
+# Layout of a packed split:
+#   {split}_feats.npy  : float32 or float16 [total_boxes, IMG_FEAT_SIZE], boxes of all images back to back
+#   {split}_index.npz  : iids (sorted), offsets, num_boxes
+
+def packed_feat_paths(packed_dir, split):
+    return os.path.join(packed_dir, split + '_feats.npy'), \
+           os.path.join(packed_dir, split + '_index.npz')
+
+
+def iid_from_feat_path(path):
+    return int(path.split('/')[-1].split('_')[-1].split('.')[0])
+
+
+def npz_array_shape(path, key='x'):
+    """
+    只读取.npz中数组的头信息，返回shape，不解压数据
+    """
+    with zipfile.ZipFile(path) as zf:
+        with zf.open(key + '.npy') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, _ = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, _ = np.lib.format.read_array_header_2_0(f)
+
+    return shape
+
+
+def pack_img_feats(feat_dir, packed_dir, split, dtype=np.float32):
+    """
+    把feat_dir下所有.npz特征（'x'为 IMG_FEAT_SIZE x num_boxes）按框转置后写入一个连续数组
+    """
+    path_list = sorted(glob.glob(feat_dir + '*.npz'))
+    if not path_list:
+        raise ValueError('No .npz features found in {}'.format(feat_dir))
+
+    iids = np.array([iid_from_feat_path(path) for path in path_list], np.int64)
+    shapes = [npz_array_shape(path) for path in path_list]
+    feat_size = shapes[0][0]
+    num_boxes = np.array([shape[1] for shape in shapes], np.int32)
+
+    offsets = np.zeros(len(path_list) + 1, np.int64)
+    offsets[1:] = np.cumsum(num_boxes)
+
+    os.makedirs(packed_dir, exist_ok=True)
+    feats_path, index_path = packed_feat_paths(packed_dir, split)
+
+    # The index is written last, so an interrupted run never leaves a usable half-packed split
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    feats = np.lib.format.open_memmap(feats_path, mode='w+', dtype=dtype, shape=(int(offsets[-1]), feat_size))
+    for ix, path in enumerate(path_list):
+        feats[offsets[ix]:offsets[ix + 1]] = np.load(path)['x'].transpose((1, 0))
+        if ix % 1000 == 0:
+            print('\rPacking {}: [{} | {}] '.format(split, ix, len(path_list)), end='          ')
+    feats.flush()
+    del feats
+
+    order = np.argsort(iids, kind='stable')
+    np.savez(
+        index_path,
+        iids=iids[order],
+        offsets=offsets[:-1][order],
+        num_boxes=num_boxes[order]
+    )
+    print('\rPacked {} images ({} boxes) of split {} to {}'.format(
+        len(path_list), int(offsets[-1]), split, feats_path))
+
+
+class PackedImgFeats:
+    """
+    按image id读取打包后的图像特征，返回memmap上的切片（零拷贝）
+    Several splits can be opened together (e.g. train+val); image ids are unique across COCO splits.
+    """
+    def __init__(self, packed_dir, splits):
+        self.packed_dir = packed_dir
+        self.splits = list(splits)
+
+        iids, offsets, num_boxes, split_ix = [], [], [], []
+        for ix, split in enumerate(self.splits):
+            index = np.load(packed_feat_paths(packed_dir, split)[1])
+            iids.append(index['iids'])
+            offsets.append(index['offsets'])
+            num_boxes.append(index['num_boxes'])
+            split_ix.append(np.full(len(index['iids']), ix, np.int8))
+
+        iids = np.concatenate(iids)
+        order = np.argsort(iids, kind='stable')
+        self.iids = iids[order]
+        self.offsets = np.concatenate(offsets)[order]
+        self.num_boxes = np.concatenate(num_boxes)[order]
+        self.split_ix = np.concatenate(split_ix)[order]
+
+        # Memory maps are opened lazily, so every DataLoader worker maps the files itself
+        # and all of them share the OS page cache
+        self._feats = [None] * len(self.splits)
+
+    @staticmethod
+    def available(packed_dir, splits):
+        return all(os.path.exists(packed_feat_paths(packed_dir, split)[1]) for split in splits)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_feats'] = [None] * len(self.splits)
+        return state
+
+    def __len__(self):
+        return len(self.iids)
+
+    def __contains__(self, iid):
+        row = np.searchsorted(self.iids, int(iid))
+        return row < len(self.iids) and self.iids[row] == int(iid)
+
+    def row(self, iid):
+        row = int(np.searchsorted(self.iids, int(iid)))
+        if row >= len(self.iids) or self.iids[row] != int(iid):
+            raise KeyError(iid)
+        return row
+
+    def boxes_of(self, iids):
+        # Number of boxes of every image id (all must be in the store)
+        return self.num_boxes[np.searchsorted(self.iids, iids)]
+
+    def feats(self, split_ix):
+        if self._feats[split_ix] is None:
+            feats_path = packed_feat_paths(self.packed_dir, self.splits[split_ix])[0]
+            # Copy-on-write: the slices can be handed to torch.from_numpy as they are (no read-only
+            # warning), pages stay shared until written and the file itself is never modified
+            self._feats[split_ix] = np.load(feats_path, mmap_mode='c')
+        return self._feats[split_ix]
+
+    def __getitem__(self, iid):
+        # num_boxes x IMG_FEAT_SIZE
+        row = self.row(iid)
+        offset = self.offsets[row]
+        return self.feats(self.split_ix[row])[offset:offset + self.num_boxes[row]]
@@ -0,0 +1,72 @@
+import numpy as np
+import hashlib, json, os
+
+
+# ----------------------------
+# ---- Compiled File Utils ----
+# ----------------------------
+# 原子写入和基于manifest的编译缓存检查，不依赖torch（valNovel的评测路径也会用到）
+
+_file_hashes = {}
+
+
+def hash_files(path_list):
+    """
+    文件内容的md5，同一进程内按(路径, 大小, 修改时间)缓存，避免重复读取大文件
+    """
+    md5 = hashlib.md5()
+    for path in path_list:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if key not in _file_hashes:
+            file_md5 = hashlib.md5()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 24), b''):
+                    file_md5.update(chunk)
+            _file_hashes[key] = file_md5.hexdigest()
+        md5.update(_file_hashes[key].encode())
+
+    return md5.hexdigest()
+
+
+def save_npy(arr, fname):
+    # Write to a temporary file first so concurrent runs never read a partial cache file
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+    tmp_fname = fname + '.tmp{}'.format(os.getpid())
+    with open(tmp_fname, 'wb') as f:
+        np.save(f, arr)
+    os.replace(tmp_fname, fname)
+
+
+def save_json(obj, fname):
+    tmp_fname = fname + '.tmp{}'.format(os.getpid())
+    with open(tmp_fname, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_fname, fname)
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'md5': hash_files([path])}
+
+
+def manifest_matches(path, params, inputs):
+    fname = os.path.join(path, 'manifest.json')
+    if not os.path.exists(fname):
+        return False
+
+    with open(fname, 'r') as f:
+        manifest = json.load(f)
+    if manifest['params'] != params or sorted(manifest['inputs']) != inputs:
+        return False
+
+    for input_path, fingerprint in manifest['inputs'].items():
+        if not os.path.exists(input_path):
+            return False
+        # Only files whose size or modification time changed are hashed again
+        stat = os.stat(input_path)
+        if (stat.st_size, stat.st_mtime_ns) != (fingerprint['size'], fingerprint['mtime_ns']) and \
+                hash_files([input_path]) != fingerprint['md5']:
+            return False
+
+    return True
@@ -0,0 +1,249 @@
+from core.data.file_utils import save_npy, save_json, file_fingerprint, manifest_matches
+from core.data import normalize
+import numpy as np
+import glob, json, os
+
+
+# ----------------------------------
+# ---- Ground-truth Answer Index ----
+# ----------------------------------
+# 验证集标注的评测所需部分：每个问题归一化后的GT答案编号、问题类型和答案类型，以及问题的技能和概念
+# （用于找出新问题子集）。每个进程只建立一次，并像corpus一样编译成目录（各列一个.npy + names.json + manifest.json），
+# later evaluations and valNovel runs memory-map the columns instead of parsing the annotation file again.
+# Only numpy is needed, valNovel scores result files without torch.
+
+# Bump when the layout or the answer normalization of a compiled index changes
+GT_INDEX_FORMAT_VERSION = 2
+
+_gt_indexes = {}
+
+
+class GtIndex:
+    """
+    按标注文件中的顺序：
+        qids / qid_order      : int64 [N], question ids and their argsort (for qid_pos)
+        num_gt                : int64 [N], number of GT answers
+        ans_ids               : int32 [N, max GT answers], normalized GT answers as ids into vocab, -1 padded
+        ques_type / ans_type  : int64 [N], ids into ques_type_names / ans_type_names
+        skill_code            : int16 [N], index into skill_names, -1 if the question has no skill
+        concept_ptr/_id       : CSR of the questions' 'all_concepts' (the 'concepts' keys when missing)
+    """
+    COLUMNS = ['qids', 'qid_order', 'num_gt', 'ans_ids', 'ques_type', 'ans_type',
+               'skill_code', 'concept_ptr', 'concept_id']
+
+    @classmethod
+    def from_annotations(cls, anns, ques_list=()):
+        # As in the original VQAEval loop, the GT answers are only punctuation-processed when they are
+        # not all the same; each distinct raw answer is processed once.
+        index = cls.__new__(cls)
+        index.qids = np.array([ann['question_id'] for ann in anns], np.int64)
+        index.qid_order = np.argsort(index.qids, kind='stable')
+        index.num_gt = np.array([len(ann['answers']) for ann in anns], np.int64)
+        gt_ptr = np.concatenate([[0], np.cumsum(index.num_gt)])
+        gt_rows = np.repeat(np.arange(len(anns)), index.num_gt)
+
+        raw_answers = [ans['answer'] for ann in anns for ans in ann['answers']]
+        raw_vocab = list(dict.fromkeys(raw_answers))
+        raw_to_id = {raw_ans: raw_id for raw_id, raw_ans in enumerate(raw_vocab)}
+        raw_ids = np.fromiter(map(raw_to_id.__getitem__, raw_answers), np.int64, len(raw_answers))
+
+        proc_vocab = normalize.process_punctuation_list(raw_vocab)
+        index._ans_to_id = {}
+        for ans in raw_vocab + proc_vocab:
+            index._ans_to_id.setdefault(ans, len(index._ans_to_id))
+        index.vocab = list(index._ans_to_id)
+        keep_ids = np.array([index._ans_to_id[ans] for ans in raw_vocab], np.int64)
+        proc_ids = np.array([index._ans_to_id[ans] for ans in proc_vocab], np.int64)
+
+        # Questions whose GT answers are not all the same
+        starts = gt_ptr[:-1][index.num_gt > 0]
+        differ = np.zeros(len(anns), bool)
+        differ[index.num_gt > 0] = np.minimum.reduceat(raw_ids, starts) != np.maximum.reduceat(raw_ids, starts)
+
+        index.ans_ids = np.full((len(anns), index.num_gt.max(initial=0)), -1, np.int32)
+        index.ans_ids[gt_rows, np.arange(len(raw_ids)) - gt_ptr[gt_rows]] = \
+            np.where(differ[gt_rows], proc_ids[raw_ids], keep_ids[raw_ids])
+
+        index.ques_type_names, index.ques_type = intern_names([ann['question_type'] for ann in anns])
+        index.ans_type_names, index.ans_type = intern_names([ann['answer_type'] for ann in anns])
+
+        # Skills and concepts as in Corpus.build_columns, questions without an annotation are left out
+        qid_to_ques = {ques['question_id']: ques for ques in ques_list}
+        skill_to_code, concept_to_id = {}, {}
+        index.skill_code = np.full(len(anns), -1, np.int16)
+        index.concept_ptr = np.zeros(len(anns) + 1, np.int64)
+        concept_id = []
+        for pos, ann in enumerate(anns):
+            ques = qid_to_ques.get(ann['question_id'], {})
+            if ques.get('skill', None) is not None:
+                index.skill_code[pos] = skill_to_code.setdefault(ques['skill'], len(skill_to_code))
+            for c in ques.get('all_concepts', ques.get('concepts', {})):
+                concept_id.append(concept_to_id.setdefault(c, len(concept_to_id)))
+            index.concept_ptr[pos + 1] = len(concept_id)
+        index.concept_id = np.array(concept_id, np.int32)
+        index.skill_names = list(skill_to_code)
+        index.concept_names = list(concept_to_id)
+        return index
+
+    def __len__(self):
+        return len(self.qids)
+
+    @property
+    def ans_to_id(self):
+        # Built on first use after loading, then shared by every evaluation of the process
+        if self._ans_to_id is None:
+            self._ans_to_id = {ans: ans_id for ans_id, ans in enumerate(self.vocab)}
+        return self._ans_to_id
+
+    def qid_pos(self, qids):
+        # {question id} -> {position in the index}, qids must all be annotated
+        pos = self.qid_order[np.searchsorted(self.qids, qids, sorter=self.qid_order)]
+        if not np.array_equal(self.qids[pos], qids):
+            raise KeyError('question ids without ground-truth annotation')
+        return pos
+
+    def novel_qids(self, concept, skill):
+        """
+        同get_novel_ids：包含任一概念（且技能为skill）的问题编号，concept为逗号分隔的字符串或列表
+        """
+        if not concept:
+            return []
+        if isinstance(concept, str):
+            concept = concept.split(',')
+
+        wanted = [ix for ix, c in enumerate(self.concept_names) if c in set(concept)]
+        entry_pos = np.repeat(np.arange(len(self)), np.diff(self.concept_ptr))
+        pos = np.unique(entry_pos[np.isin(self.concept_id, wanted)])
+
+        if not (skill is None or skill.lower() == 'none'):
+            code = self.skill_names.index(skill) if skill in self.skill_names else -2
+            pos = pos[self.skill_code[pos] == code]
+
+        print('Found {x} number of novel question ids'.format(x=len(pos)))
+        return self.qids[pos].tolist()
+
+    def save(self, path):
+        for name in self.COLUMNS:
+            save_npy(getattr(self, name), os.path.join(path, name + '.npy'))
+        save_json({
+            'vocab': self.vocab,
+            'ques_type_names': self.ques_type_names,
+            'ans_type_names': self.ans_type_names,
+            'skill_names': self.skill_names,
+            'concept_names': self.concept_names
+        }, os.path.join(path, 'names.json'))
+
+    @classmethod
+    def load(cls, path):
+        index = cls.__new__(cls)
+        for name in cls.COLUMNS:
+            setattr(index, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+
+        with open(os.path.join(path, 'names.json'), 'r') as f:
+            names = json.load(f)
+        index.vocab = names['vocab']
+        index.ques_type_names = names['ques_type_names']
+        index.ans_type_names = names['ans_type_names']
+        index.skill_names = names['skill_names']
+        index.concept_names = names['concept_names']
+        index._ans_to_id = None
+        return index
+
+
+def intern_names(names):
+    # Names in the order they first appear, and the id of every entry
+    unique = list(dict.fromkeys(names))
+    name_to_id = {name: name_id for name_id, name in enumerate(unique)}
+    return unique, np.fromiter(map(name_to_id.__getitem__, names), np.int64, len(names))
+
+
+def get_gt_index(__C, split):
+    """
+    split的GT索引：同一进程只建立一次，标注和问题文件未变时从编译目录内存映射加载
+    """
+    def build():
+        ans_file, ques_file = __C.ANSWER_PATH[split], __C.QUESTION_PATH[split]
+        path = os.path.join(__C.COMPILED_DATA_PATH, 'gt_' + split)
+        params = {'version': GT_INDEX_FORMAT_VERSION, 'split': split}
+        inputs = sorted({ans_file, ques_file})
+        if manifest_matches(path, params, inputs):
+            print('== Loaded ground-truth index:', path)
+            return GtIndex.load(path)
+
+        with open(ans_file, 'r') as f:
+            anns = json.load(f)['annotations']
+        with open(ques_file, 'r') as f:
+            index = GtIndex.from_annotations(anns, json.load(f)['questions'])
+
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, 'manifest.json')):
+            os.remove(os.path.join(path, 'manifest.json'))
+        for fname in glob.glob(os.path.join(path, '*.npy')):
+            os.remove(fname)
+
+        index.save(path)
+        save_json({
+            'params': params,
+            'inputs': {input_path: file_fingerprint(input_path) for input_path in inputs}
+        }, os.path.join(path, 'manifest.json'))
+        print('== Compiled ground-truth index:', path)
+
+        return index
+
+    key = (split, __C.ANSWER_PATH[split], __C.QUESTION_PATH[split])
+    if key not in _gt_indexes:
+        _gt_indexes[key] = build()
+    return _gt_indexes[key]
+
+
+def load_res_answers(res_file, gt_index):
+    """
+    结果文件 -> {question id: predicted answer}，必须正好覆盖索引中的全部问题（同VQA.loadRes）
+    """
+    with open(res_file, 'r') as f:
+        anns = json.load(f)
+    assert type(anns) == list, 'results is not an array of objects'
+
+    res_answers = {ann['question_id']: ann['answer'] for ann in anns}
+    assert len(res_answers) == len(gt_index) and \
+        np.isin(np.fromiter(res_answers, np.int64, len(res_answers)), gt_index.qids).all(), \
+        'Results do not correspond to current VQA set. Either the results do not have predictions for all question ids in annotation file or there is atleast one question id that does not belong to the question ids in the annotation file.'
+    return res_answers
+
+
+def answer_gt_ids(gt_index, ix_to_ans):
+    # Answer dict index -> normalized answer id of the index (-2: no GT answer of any question),
+    # every answer of the answer dict is normalized once
+    answers = normalize.prep_res_ans_list([ix_to_ans[str(ix)] for ix in range(len(ix_to_ans))])
+    return np.array([gt_index.ans_to_id.get(ans, -2) for ans in answers], np.int64)
+
+
+def gt_accuracy(gt_index, pos, res_ids):
+    """
+    pos处问题的VQA准确率 in [0, 1]：每个GT答案轮流留出，其余GT答案中与预测相同的个数/3（最多为1），再取平均
+    """
+    gt_ans_ids = gt_index.ans_ids[pos]
+    hit = gt_ans_ids == res_ids[:, None]
+    matching = hit.sum(1, keepdims=True) - hit
+    gt_acc = np.minimum(1, matching / 3.)
+    gt_acc[gt_ans_ids == -1] = 0
+
+    # Summed GT answer by GT answer like the original VQAEval loop, so the floats are bit-identical
+    sum_gt_acc = np.zeros(len(pos))
+    for i in range(gt_acc.shape[1]):
+        sum_gt_acc += gt_acc[:, i]
+    return sum_gt_acc / gt_index.num_gt[pos]
+
+
+def res_ans_ids(gt_index, qids, ans_ix, ix_to_ans):
+    """
+    推理得到的答案编号直接交给VQAEval，不经过结果文件：返回按索引位置排列的归一化预测答案id
+    (-2: 不是任何GT答案)。qids必须正好覆盖索引中的全部问题（同load_res_answers）
+    """
+    qids = np.asarray(qids, np.int64)
+    assert len(qids) == len(gt_index) and len(np.unique(qids)) == len(qids), \
+        'Results do not correspond to current VQA set. Either the results do not have predictions for all question ids in annotation file or there is atleast one question id that does not belong to the question ids in the annotation file.'
+
+    ids = np.empty(len(gt_index), np.int64)
+    ids[gt_index.qid_pos(qids)] = answer_gt_ids(gt_index, ix_to_ans)[ans_ix]
+    return ids
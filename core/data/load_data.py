@@ -1,12 +1,11 @@
-from core.data.data_utils import get_concept_position, prune_refsets
+from core.data.data_utils import get_concept_position, get_concept_positions, prune_refsets
 from core.data.data_utils import refset_point_refset_index, sample_refset, do_token_masking
-from core.data.data_utils import img_feat_path_load, ques_load, tokenize, ans_stat
-from core.data.data_utils import proc_img_feat, proc_ques, proc_ans
-from core.data.data_utils import filter_concept_skill, get_novel_ids
-from core.data.data_utils import build_skill_references, sample_contrasting_skills
+from core.data.data_utils import proc_img_feat, filter_concept_skill, get_novel_ids
+from core.data.data_utils import build_skill_references, sample_contrasting_skills, pad_stack, seeded_random
+from core.data.corpus import get_corpus, get_img_feat_index, get_img_feat_cache
 import numpy as np
-import random
-import glob, json, torch
+import random, contextlib
+import torch
 # noinspection PyPep8Naming
 import torch.utils.data as Data
 
@@ -16,9 +15,6 @@ class DataSet(Data.Dataset):
         # 加载Cfgs配置类
         self.__C = __C
 
-        # Loading all image paths
-        # 加载所有图像路径
-        self.img_feat_path_list = []
         # 分离出图像数据集标签，e.g. RUN_MODE为train+val+test
         img_split_list = __C.SPLIT[__C.RUN_MODE].split('+')
 
@@ -27,137 +23,161 @@ class DataSet(Data.Dataset):
             # VQA-CP从VQA v2/v1构建具有不同答案分布的train-test划分（Sec.3 Comparison to Existing
             img_split_list = ['train', 'val']
 
-        for split in img_split_list:
-            if split in ['train', 'val', 'test']:
-                # 构建train, val, test的数据路径
-                self.img_feat_path_list += glob.glob(__C.IMG_FEAT_PATH[split] + '*.npz')
-
-        # Loading question word list
-        # 加载问题词汇表
-        # QUESTION_PATH在base_cfgs.py的fix_and_add_args和path_cfgs.py的init_path定义
-        stat_ques_list = \
-            json.load(open(__C.QUESTION_PATH['train'], 'r'))['questions'] + \
-            json.load(open(__C.QUESTION_PATH['val'], 'r'))['questions'] + \
-            json.load(open(__C.QUESTION_PATH['test'], 'r'))['questions'] + \
-            json.load(open(__C.QUESTION_PATH['vg'], 'r'))['questions']
-
-        # Loading question and answer list
-        # 加载问题和答案列表
-        self.ques_list = []
-        self.ans_list = []
+        img_split_list = [split for split in img_split_list if split in ['train', 'val', 'test']]
+
+        # Image features, questions, vocabulary and answers are shared with every other
+        # dataset built on the same splits (see core/data/corpus.py)
+        # 共享的数据只读，本数据集只保存自己的行索引self.rows
+        self.img_feat_store, self.iid_to_img_feat_path = get_img_feat_index(__C, img_split_list)
+        self.img_feat_cache = get_img_feat_cache(__C)
 
         split_list = __C.SPLIT[__C.RUN_MODE].split('+')
-        for split in split_list:
-            # 从RUN_MODE里加载问题到ques_list
-            self.ques_list += json.load(open(__C.QUESTION_PATH[split], 'r'))['questions']
-            if __C.RUN_MODE in ['train', 'vqaAccRegion', 'evalAll']:
-                # 如果RUN_MODE是'train', 'vqaAccRegion', 'evalAll'中的模式，则加载答案至ans_list变量
-                self.ans_list += json.load(open(__C.ANSWER_PATH[split], 'r'))['annotations']
+        # 如果RUN_MODE是'train', 'vqaAccRegion', 'evalAll'中的模式，则加载答案
+        self.corpus = get_corpus(__C, split_list, with_ans=__C.RUN_MODE in ['train', 'vqaAccRegion', 'evalAll'])
+
+        self.ques_ix = self.corpus.ques_ix
+        # Number of real tokens of every question (at least 1, see DYNAMIC_PAD)
+        self.ques_ntok = np.clip(self.corpus.ques_len, 1, self.ques_ix.shape[1])
 
         self.rs_idx = []
         self.qid2bbanns = {}
 
+        # Seed of the current pass over the dataset, set by ResumableLoader (see seeded), -1 when unset
+        self.sample_seed = torch.full((1,), -1, dtype=torch.int64).share_memory_()
+
         # ------------------------
         # ---- Data statistic ----
         # ------------------------
 
-        # {image id} -> {image feature absolutely path}
-        # iid_to_img_feat_path：图像编号-图像绝对路径 的字典
-        self.iid_to_img_feat_path = img_feat_path_load(self.img_feat_path_list)
+        # Rows of the corpus used by this dataset
+        # 本数据集使用的问题行号
+        self.rows = np.arange(len(self.corpus), dtype=np.int64)
 
         self.novel_ques_ids = None
         # 在exec2steps.py中line 30-32设置self.__C.NOVEL
         # 在train的时候学习新技能-概念
         # NOVEL在CONCEPT或者SKILL不为None时为remove
         if self.__C.NOVEL == 'remove' and self.__C.RUN_MODE == 'train':
-            filter_concept_skill(self.ques_list, self.ans_list, concept=self.__C.CONCEPT, skill=self.__C.SKILL)
+            self.rows = filter_concept_skill(self.corpus, concept=self.__C.CONCEPT, skill=self.__C.SKILL)
         elif self.__C.NOVEL == 'get_ids' and self.__C.RUN_MODE == 'val':
             # 只取ques_id
             self.novel_ques_ids, _ = \
-                get_novel_ids(self.ques_list, concept=self.__C.CONCEPT, skill=self.__C.SKILL)
+                get_novel_ids(self.corpus, concept=self.__C.CONCEPT, skill=self.__C.SKILL)
         else:
             # ques_id和索引均保留
             self.novel_ques_ids, self.novel_indices = \
-                get_novel_ids(self.ques_list, concept=self.__C.CONCEPT, skill=self.__C.SKILL)
+                get_novel_ids(self.corpus, concept=self.__C.CONCEPT, skill=self.__C.SKILL)
 
         # Define run data size
-        if __C.RUN_MODE in ['train']:
-            # 如果RUN_MODE为训练模式，设置数据大小为答案集的大小
-            self.data_size = self.ans_list.__len__()
-        else:
-            # 否则设置为问题集的大小
-            self.data_size = self.ques_list.__len__()
+        self.data_size = len(self.rows)
 
         print('== Dataset size:', self.data_size)
 
-        # {question id} -> {question}
-        # qid_to_ques：字典 问题编号-问题
-        self.qid_to_ques = ques_load(self.ques_list)
-
         # Tokenize
-        self.token_to_ix, self.pretrained_emb = tokenize(
-            stat_ques_list,
-            __C.USE_GLOVE,
-            # 只有train的时候才保存
-            save_embeds=(self.__C.RUN_MODE in {'train'})  # Embeddings will not be overwritten if file already exists.
-        )
+        self.token_to_ix, self.pretrained_emb = self.corpus.token_to_ix, self.corpus.pretrained_emb
         self.token_size = self.token_to_ix.__len__()
         print('== Question token vocab size:', self.token_size)
 
         # Answers stats
-        # self.ans_to_ix, self.ix_to_ans = ans_stat(self.stat_ans_list, __C.ANS_FREQ)
         # 从json数据里加载答案数据
-        self.ans_to_ix, self.ix_to_ans = ans_stat('core/data/answer_dict.json')
+        self.ans_to_ix, self.ix_to_ans = self.corpus.ans_to_ix, self.corpus.ix_to_ans
         self.ans_size = self.ans_to_ix.__len__()
         print('== Answer vocab size (occurr more than {} times):'.format(8), self.ans_size)
         print('Finished!\n')
 
     def __getitem__(self, idx):
-        # For code safety
-        img_feat_iter = np.zeros(1)
-        img_pos_feat_iter = np.zeros(1)
-        ques_ix_iter = np.zeros(1)
-        ans_iter = np.zeros(1)
-
         # Process ['train'] and ['val', 'test'] respectively
-        if self.__C.RUN_MODE in ['train', 'evalAll']:
-            # Load the run data from list
-            ans = self.ans_list[idx]
-            ques = self.qid_to_ques[str(ans['question_id'])]
+        return self.load_row(self.rows[idx], with_ans=self.__C.RUN_MODE in ['train', 'evalAll'])
 
-            # Process image feature from (.npz) file
-            img_feat = np.load(self.iid_to_img_feat_path[str(ans['image_id'])])
-            img_feat_x = img_feat['x'].transpose((1, 0))
-
-            img_feat_iter = proc_img_feat(img_feat_x, self.__C.IMG_FEAT_PAD_SIZE)
-
-            # Process question
-            ques_ix_iter = proc_ques(
-                ques, self.token_to_ix, self.__C.MAX_TOKEN, add_cls=False
-            )
+    def load_row(self, row, with_ans=False, full_ques=False):
+        # For code safety
+        ans_iter = torch.from_numpy(np.zeros(1))
 
-            # Process answer
-            ans_iter = proc_ans(ans, self.ans_to_ix)
+        # Process image feature
+        img_feat_iter = self.load_img_feat(self.corpus.iids[row])
 
+        # Process question, only its real tokens with DYNAMIC_PAD (padded per batch in the collate)
+        if self.__C.DYNAMIC_PAD and not full_ques:
+            ques_ix_iter = self.ques_ix[row, :self.ques_ntok[row]].astype(np.int64)
         else:
-            # Load the run data from list
-            ques = self.ques_list[idx]
+            ques_ix_iter = self.ques_ix[row].astype(np.int64)
 
-            img_feat = np.load(self.iid_to_img_feat_path[str(ques['image_id'])])
-            img_feat_x = img_feat['x'].transpose((1, 0))
-
-            img_feat_iter = proc_img_feat(img_feat_x, self.__C.IMG_FEAT_PAD_SIZE)
-
-            # Process question
-            ques_ix_iter = proc_ques(ques, self.token_to_ix, self.__C.MAX_TOKEN, add_cls=False)
+        # Process answer: (answer indices, scores), see ans_collate
+        if with_ans:
+            ans_slice = slice(self.corpus.ans_ptr[row], self.corpus.ans_ptr[row + 1])
+            # Copied out of the read-only memory-mapped columns
+            ans_iter = (torch.from_numpy(np.array(self.corpus.ans_ix[ans_slice])),
+                        torch.from_numpy(np.array(self.corpus.ans_score[ans_slice])))
 
         return torch.from_numpy(img_feat_iter), \
                torch.from_numpy(ques_ix_iter), \
-               torch.from_numpy(ans_iter)
+               ans_iter
 
     def __len__(self):
         return self.data_size
 
+    def item_rows(self):
+        # Corpus row of every item (the target question for the reference set datasets)
+        return self.rows
+
+    def item_lengths(self):
+        """
+        每个样本的token数+框数，用于BucketBatchSampler
+        Box counts are only known up front with the packed features, otherwise IMG_FEAT_PAD_SIZE is used.
+        """
+        rows = self.item_rows()
+        if self.img_feat_store is not None:
+            num_boxes = np.minimum(self.img_feat_store.boxes_of(self.corpus.iids[rows]), self.__C.IMG_FEAT_PAD_SIZE)
+        else:
+            num_boxes = self.__C.IMG_FEAT_PAD_SIZE
+        return self.ques_ntok[rows] + num_boxes
+
+    def seeded(self, idx):
+        """
+        item idx的随机采样只由本轮的sample_seed决定，与worker无关，断点续训时可以复现
+        """
+        sample_seed = int(self.sample_seed)
+        if sample_seed < 0:
+            return contextlib.nullcontext()
+        return seeded_random((sample_seed + int(idx)) % 2 ** 32)
+
+    def load_img_feat(self, iid):
+        if self.img_feat_cache is not None:
+            img_feat_x = self.img_feat_cache.get(iid)
+            if img_feat_x is None:
+                img_feat_x = self.read_img_feat(iid)
+                self.img_feat_cache.put(iid, img_feat_x)
+        else:
+            img_feat_x = self.read_img_feat(iid)
+
+        # With DYNAMIC_PAD only the real boxes are returned (padded per batch in the collate)
+        if self.__C.DYNAMIC_PAD:
+            return img_feat_x
+        return proc_img_feat(img_feat_x, self.__C.IMG_FEAT_PAD_SIZE)
+
+    def read_img_feat(self, iid):
+        # min(num_boxes, IMG_FEAT_PAD_SIZE) x IMG_FEAT_SIZE
+        if self.img_feat_store is not None:
+            # View into the memory map
+            img_feat_x = self.img_feat_store[iid]
+        else:
+            # Process image feature from (.npz) file
+            img_feat = np.load(self.iid_to_img_feat_path[str(iid)])
+            img_feat_x = img_feat['x'].transpose((1, 0))
+
+        # Still a view into the memory map when the packed dtype is IMG_FEAT_DTYPE, cast otherwise
+        return img_feat_x[:self.__C.IMG_FEAT_PAD_SIZE].astype(self.__C.IMG_FEAT_DTYPE, copy=False)
+
+    def load_img_feats(self, iids):
+        """
+        一次加载一组图像特征，重复的图像只读取一次
+        Returns a float tensor [len(iids), num_boxes, IMG_FEAT_SIZE], num_boxes is the largest box count
+        of the images with DYNAMIC_PAD and IMG_FEAT_PAD_SIZE otherwise
+        """
+        unique_iids, inverse = np.unique(iids, return_inverse=True)
+        img_feats = pad_stack([self.load_img_feat(iid) for iid in unique_iids])
+        return img_feats[torch.from_numpy(inverse.reshape(-1))]
+
 
 class RefPointDataSet(DataSet):
     """
@@ -169,13 +189,14 @@ class RefPointDataSet(DataSet):
 
         self.refset_sizes = list(zip(['pos', 'neg1', 'neg2'], [1, 1, 1]))
 
-        # 裁剪问题列表
-        self.ques_list = prune_refsets(self.ques_list, self.refset_sizes, self.__C.MAX_TOKEN)
+        # 裁剪参考问题，裁剪后的CSR只属于本数据集
+        self.rs_ptr, self.rs_ref = prune_refsets(self.corpus, self.__C.MAX_TOKEN)
 
-        if not self.rs_idx:
-            # 参考集索引rs_idx为空
+        if not len(self.rs_idx):
+            # 参考集索引rs_idx为空，rs_idx为(问题, 概念)对的编号
             self.rs_idx = refset_point_refset_index(
-                self.ques_list,
+                self.corpus,
+                self.rs_ptr,
                 self.__C.MAX_TOKEN,
                 self.novel_indices,
                 aug_factor=getattr(self.__C, 'NOVEL_AUGMENT', 1)
@@ -186,38 +207,59 @@ class RefPointDataSet(DataSet):
     def __len__(self):
         return len(self.rs_idx)
 
-    def __getitem__(self, idx):
-        target_idx, target_concept = self.rs_idx[idx]
+    def item_rows(self):
+        return self.corpus.rs_row[self.rs_idx]
+
+    def sample_item(self, idx):
+        # (target row, target concept, shuffled candidate rows)
+        pair = self.rs_idx[idx]
+        target_idx = self.corpus.rs_row[pair]
+        target_concept = self.corpus.concept_names[self.corpus.rs_concept[pair]]
         pos_idx_list, neg1_idx_list, neg2_idx_list = \
-            sample_refset(self.ques_list[target_idx], target_concept, self.refset_sizes)
+            sample_refset(self.rs_ptr, self.rs_ref, pair, self.refset_sizes)
         all_cand_idx = pos_idx_list + neg1_idx_list + neg2_idx_list
 
         random.shuffle(all_cand_idx)
 
+        return target_idx, target_concept, all_cand_idx
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (list, tuple)):
+            # A whole batch from a BatchSampler (DataLoader with batch_size=None)
+            with self.seeded(idx[0]):
+                return self.load_batch(idx)
+
+        with self.seeded(idx):
+            return self.load_item(idx)
+
+    def load_item(self, idx):
+        target_idx, target_concept, all_cand_idx = self.sample_item(idx)
+
         # This assumes that there is only one positive example 假定只有一个正例
+        # Questions keep MAX_TOKEN here, as the point positions are offset by the question length
         data_ref = []
         point_positions = []
         ref_qids = []
         cand_q_len = 0
         for i_cand in all_cand_idx:
-            curr_cand = super().__getitem__(i_cand)
-            curr_cand_pt_pos = get_concept_position(self.ques_list[i_cand], target_concept)
+            curr_cand = self.load_row(i_cand, full_ques=True)
+            curr_cand_pt_pos = get_concept_position(self.corpus, i_cand, target_concept)
             if curr_cand_pt_pos > -1:
                 curr_cand_pt_pos += cand_q_len
                 point_positions.append(curr_cand_pt_pos)
 
             data_ref.append(curr_cand)
-            ref_qids.append(self.ques_list[i_cand]['question_id'])
-            cand_q_len += len(curr_cand[2])  # length of current candidate question
+            ref_qids.append(int(self.corpus.qids[i_cand]))
+            cand_q_len += len(curr_cand[1])  # length of current candidate question
 
-        data_target = super().__getitem__(target_idx)
-        target_concept_pos = get_concept_position(self.ques_list[target_idx], target_concept)
+        data_target = self.load_row(target_idx, full_ques=True)
+        target_concept_pos = get_concept_position(self.corpus, target_idx, target_concept)
 
         assert target_concept_pos != -1
 
-        ori_id = data_target[2][target_concept_pos]
+        ori_id = data_target[1][target_concept_pos]
         new_id = do_token_masking(ori_id, self.token_to_ix, self.__C.TGT_MASKING)
-        data_target[2][target_concept_pos] = new_id
+        data_target[1][target_concept_pos] = new_id
 
         cand_labels = [target_concept_pos]
 
@@ -226,30 +268,88 @@ class RefPointDataSet(DataSet):
 
         qid_data_ = {
             'concept': target_concept,
-            'tgt': self.ques_list[target_idx]['question_id'],
+            'tgt': int(self.corpus.qids[target_idx]),
             'refs': ref_qids
         }
 
         return data_target, data_ref, cand_labels, point_positions, qid_data_
 
+    def load_batch(self, indices):
+        """
+        一次取出整个batch，直接返回refset_collate的输出格式
+        Rows of all targets and references are gathered first, so every image of the batch is loaded once.
+        Not named __getitems__: DataLoaders of torch>=2.0 would pass its output to collate_fn again.
+        """
+        items = [self.sample_item(idx) for idx in indices]
+        batch_size, n_cands = len(items), len(items[0][2])
+
+        target_rows = np.array([item[0] for item in items], np.int64)
+        cand_rows = np.array([item[2] for item in items], np.int64)
+        concept_ids = np.array([self.corpus.concept_to_id[item[1]] for item in items], np.int64)
+
+        rows = np.concatenate([target_rows, cand_rows.T.reshape(-1)])
+        img_feats = self.load_img_feats(self.corpus.iids[rows])
+
+        # Target and reference questions share one length (the longest of the batch with DYNAMIC_PAD)
+        max_token = int(self.ques_ntok[rows].max()) if self.__C.DYNAMIC_PAD else self.ques_ix.shape[1]
+        ques_ix = torch.from_numpy(self.ques_ix[rows, :max_token].astype(np.int64))
+        # For code safety, no answers are loaded for the references
+        ans = torch.zeros(batch_size, 1, dtype=torch.float64)
+
+        # Mask the concept token of every target question
+        target_concept_pos = get_concept_positions(self.corpus, target_rows, concept_ids)
+        assert (target_concept_pos != -1).all()
+        for i, pos in enumerate(target_concept_pos):
+            ques_ix[i, pos] = do_token_masking(int(ques_ix[i, pos]), self.token_to_ix, self.__C.TGT_MASKING)
+
+        # Positions of the concept in the concatenated candidate questions
+        cand_concept_pos = get_concept_positions(
+            self.corpus, cand_rows.reshape(-1), np.repeat(concept_ids, n_cands)
+        ).reshape(batch_size, n_cands)
+        point_positions = [
+            [pos + i_cand * max_token for i_cand, pos in enumerate(item_pos) if pos > -1]
+            for item_pos in cand_concept_pos
+        ]
+
+        def take(i):
+            return img_feats[i * batch_size:(i + 1) * batch_size], ques_ix[i * batch_size:(i + 1) * batch_size], ans
+
+        tgt = take(0)
+        batched_refs = [take(i_cand + 1) for i_cand in range(n_cands)]
+
+        cand_labels = torch.from_numpy(target_concept_pos).view(batch_size, 1)
+        point_positions = torch.tensor(point_positions, dtype=torch.long)
+
+        qid_data = tuple({
+            'concept': item[1],
+            'tgt': int(self.corpus.qids[item[0]]),
+            'refs': self.corpus.qids[item[2]].tolist()
+        } for item in items)
+
+        return tgt, batched_refs, cand_labels, point_positions, qid_data
+
 
 class SkillContrastDataSet(DataSet):
     def __init__(self, __C):
         super().__init__(__C)
 
         print('Building skill references...')
-        self.rs_idx = build_skill_references(self.ques_list)
+        self.rs_idx = build_skill_references(self.corpus)
         print('Training reference set questions with skill references: {}'.format(len(self)))
         self.pretrained_emb = None
 
     def __len__(self):
         return len(self.rs_idx)
 
+    def item_rows(self):
+        return self.rs_idx
+
     def __getitem__(self, idx):
-        target_idx, target_concept = self.rs_idx[idx]
+        target_idx, target_concept = self.rs_idx[idx], 'none'
 
-        pos_idx_list, neg1_idx_list = \
-            sample_contrasting_skills(self.ques_list[target_idx], n_pos_samples=1, n_neg_samples=2)
+        with self.seeded(idx):
+            pos_idx_list, neg1_idx_list = \
+                sample_contrasting_skills(self.corpus, target_idx, n_pos_samples=1, n_neg_samples=2)
 
         all_cand_idx = pos_idx_list + neg1_idx_list
         point_positions = [0]
@@ -258,18 +358,18 @@ class SkillContrastDataSet(DataSet):
         data_ref = []
         ref_qids = []
         for i_cand in all_cand_idx:
-            curr_cand = super().__getitem__(i_cand)
+            curr_cand = self.load_row(i_cand)
             data_ref.append(curr_cand)
-            ref_qids.append(self.ques_list[i_cand]['question_id'])
+            ref_qids.append(int(self.corpus.qids[i_cand]))
 
-        data_target = super().__getitem__(target_idx)
+        data_target = self.load_row(target_idx)
 
         cand_labels = torch.from_numpy(np.array(point_positions)).type(torch.LongTensor)
         point_positions = torch.from_numpy(np.array(point_positions)).type(torch.LongTensor)
 
         qid_data_ = {
             'concept': target_concept,
-            'tgt': self.ques_list[target_idx]['question_id'],
+            'tgt': int(self.corpus.qids[target_idx]),
             'refs': ref_qids
         }
         return data_target, data_ref, cand_labels, point_positions, qid_data_
@@ -0,0 +1,158 @@
+import functools, re
+
+
+# -------------------------------------
+# ---- Question / Answer Normalization ----
+# -------------------------------------
+# 问题分词和答案归一化的唯一实现，数据处理（ans_punct.py, data_utils.py）和评测（utils/vqaEval.py）共用。
+# Punctuation is handled with str.translate instead of one replace per mark, and the results are
+# memoized by raw string in bounded LRU caches (answers repeat a lot across questions and annotators).
+# The outputs are identical to the original VQA implementation, including its quirks.
+
+contractions = {
+    "aint": "ain't", "arent": "aren't", "cant": "can't", "couldve":
+    "could've", "couldnt": "couldn't", "couldn'tve": "couldn't've",
+    "couldnt've": "couldn't've", "didnt": "didn't", "doesnt":
+    "doesn't", "dont": "don't", "hadnt": "hadn't", "hadnt've":
+    "hadn't've", "hadn'tve": "hadn't've", "hasnt": "hasn't", "havent":
+    "haven't", "hed": "he'd", "hed've": "he'd've", "he'dve":
+    "he'd've", "hes": "he's", "howd": "how'd", "howll": "how'll",
+    "hows": "how's", "Id've": "I'd've", "I'dve": "I'd've", "Im":
+    "I'm", "Ive": "I've", "isnt": "isn't", "itd": "it'd", "itd've":
+    "it'd've", "it'dve": "it'd've", "itll": "it'll", "let's": "let's",
+    "maam": "ma'am", "mightnt": "mightn't", "mightnt've":
+    "mightn't've", "mightn'tve": "mightn't've", "mightve": "might've",
+    "mustnt": "mustn't", "mustve": "must've", "neednt": "needn't",
+    "notve": "not've", "oclock": "o'clock", "oughtnt": "oughtn't",
+    "ow's'at": "'ow's'at", "'ows'at": "'ow's'at", "'ow'sat":
+    "'ow's'at", "shant": "shan't", "shed've": "she'd've", "she'dve":
+    "she'd've", "she's": "she's", "shouldve": "should've", "shouldnt":
+    "shouldn't", "shouldnt've": "shouldn't've", "shouldn'tve":
+    "shouldn't've", "somebody'd": "somebodyd", "somebodyd've":
+    "somebody'd've", "somebody'dve": "somebody'd've", "somebodyll":
+    "somebody'll", "somebodys": "somebody's", "someoned": "someone'd",
+    "someoned've": "someone'd've", "someone'dve": "someone'd've",
+    "someonell": "someone'll", "someones": "someone's", "somethingd":
+    "something'd", "somethingd've": "something'd've", "something'dve":
+    "something'd've", "somethingll": "something'll", "thats":
+    "that's", "thered": "there'd", "thered've": "there'd've",
+    "there'dve": "there'd've", "therere": "there're", "theres":
+    "there's", "theyd": "they'd", "theyd've": "they'd've", "they'dve":
+    "they'd've", "theyll": "they'll", "theyre": "they're", "theyve":
+    "they've", "twas": "'twas", "wasnt": "wasn't", "wed've":
+    "we'd've", "we'dve": "we'd've", "weve": "we've", "werent":
+    "weren't", "whatll": "what'll", "whatre": "what're", "whats":
+    "what's", "whatve": "what've", "whens": "when's", "whered":
+    "where'd", "wheres": "where's", "whereve": "where've", "whod":
+    "who'd", "whod've": "who'd've", "who'dve": "who'd've", "wholl":
+    "who'll", "whos": "who's", "whove": "who've", "whyll": "why'll",
+    "whyre": "why're", "whys": "why's", "wont": "won't", "wouldve":
+    "would've", "wouldnt": "wouldn't", "wouldnt've": "wouldn't've",
+    "wouldn'tve": "wouldn't've", "yall": "y'all", "yall'll":
+    "y'all'll", "y'allll": "y'all'll", "yall'd've": "y'all'd've",
+    "y'alld've": "y'all'd've", "y'all'dve": "y'all'd've", "youd":
+    "you'd", "youd've": "you'd've", "you'dve": "you'd've", "youll":
+    "you'll", "youre": "you're", "youve": "you've"
+}
+
+manual_map = { 'none': '0',
+              'zero': '0',
+              'one': '1',
+              'two': '2',
+              'three': '3',
+              'four': '4',
+              'five': '5',
+              'six': '6',
+              'seven': '7',
+              'eight': '8',
+               'nine': '9',
+              'ten': '10'}
+articles = ['a', 'an', 'the']
+period_strip = re.compile(r"(?!<=\d)(\.)(?!\d)")
+comma_strip = re.compile(r"(\d)(\,)(\d)")
+punct = [';', r"/", '[', ']', '"', '{', '}',
+                '(', ')', '=', '+', '\\', '_', '-',
+                '>', '<', '@', '`', ',', '?', '!']
+
+article_set = set(articles)
+punct_set = set(punct)
+
+# Every punctuation mark removed, used when the text contains a digit-comma-digit sequence
+strip_punct_table = str.maketrans({p: '' for p in punct})
+# get_words: marks removed, '-' and '/' split words
+ques_punct_table = str.maketrans(dict({p: '' for p in '.,\'!?"()*#:;'}, **{'-': ' ', '/': ' '}))
+
+ANS_CACHE_SIZE = 2 ** 18
+QUES_CACHE_SIZE = 2 ** 16
+
+
+@functools.lru_cache(maxsize=ANS_CACHE_SIZE)
+def process_punctuation(inText):
+    marks = punct_set.intersection(inText)
+    if marks:
+        if comma_strip.search(inText) is not None:
+            table = strip_punct_table
+        else:
+            # A mark next to a space is removed, otherwise it becomes a space
+            table = str.maketrans({
+                p: '' if (p + ' ' in inText or ' ' + p in inText) else ' ' for p in marks
+            })
+        outText = inText.translate(table)
+    else:
+        outText = inText
+
+    if '.' in outText:
+        # The original code passes re.UNICODE as the count argument, so at most 32 periods are stripped
+        outText = period_strip.sub("", outText, count=re.UNICODE)
+    return outText
+
+
+@functools.lru_cache(maxsize=ANS_CACHE_SIZE)
+def process_digit_article(inText):
+    outText = []
+    for word in inText.lower().split():
+        word = manual_map.get(word, word)
+        if word not in article_set:
+            outText.append(contractions.get(word, word))
+    return ' '.join(outText)
+
+
+@functools.lru_cache(maxsize=ANS_CACHE_SIZE)
+def prep_ans(answer):
+    answer = process_digit_article(process_punctuation(answer))
+    answer = answer.replace(',', '')
+    return answer
+
+
+@functools.lru_cache(maxsize=ANS_CACHE_SIZE)
+def prep_res_ans(answer):
+    # Normalization of a predicted answer in VQAEval
+    answer = answer.replace('\n', ' ').replace('\t', ' ').strip()
+    return process_digit_article(process_punctuation(answer))
+
+
+@functools.lru_cache(maxsize=QUES_CACHE_SIZE)
+def ques_words(question_str):
+    return tuple(question_str.lower().translate(ques_punct_table).split())
+
+
+def get_words(question_str):
+    return list(ques_words(question_str))
+
+
+# ---- Batch API ----
+
+def prep_ans_list(answers):
+    return [prep_ans(answer) for answer in answers]
+
+
+def process_punctuation_list(answers):
+    return [process_punctuation(answer) for answer in answers]
+
+
+def prep_res_ans_list(answers):
+    return [prep_res_ans(answer) for answer in answers]
+
+
+def get_words_list(questions):
+    return [get_words(question_str) for question_str in questions]
@@ -0,0 +1,117 @@
+from core.data.file_utils import save_npy, save_json
+import numpy as np
+import json, os, torch
+
+
+# -------------------------------
+# ---- Prediction Vector Store ----
+# -------------------------------
+# TEST_SAVE_PRED的预测向量按batch直接写入预先分配的memory-mapped .npy，不在内存中拼接和pickle。
+#
+# Layout of a store directory:
+#   pred.npy    : float32 / float16 [N, ans_size], or [N, topk] scores of the top-k answers
+#   ans_ix.npy  : int32 [N, topk], answer indices of the top-k scores (top-k stores only)
+#   qids.npy    : int64 [N], question id of every row
+#   meta.json   : ans_size, topk, dtype; written last, an interrupted run never leaves a readable store
+
+class PredWriter:
+    def __init__(self, path, num_ques, ans_size, dtype='float32', topk=0):
+        self.path = path
+        self.ans_size = ans_size
+        self.dtype = dtype
+        self.topk = topk
+        self.count = 0
+
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            os.remove(os.path.join(path, 'meta.json'))
+
+        width = topk if topk else ans_size
+        self.pred = np.lib.format.open_memmap(
+            os.path.join(path, 'pred.npy'), mode='w+', dtype=np.dtype(dtype), shape=(num_ques, width))
+        self.ans_ix = None
+        if topk:
+            self.ans_ix = np.lib.format.open_memmap(
+                os.path.join(path, 'ans_ix.npy'), mode='w+', dtype=np.int32, shape=(num_ques, topk))
+
+    def write(self, pred):
+        # pred: batch x ans_size scores; top-k and the dtype conversion run on pred's device before the copy
+        pred = torch.as_tensor(pred).detach()
+        if self.topk:
+            pred, ans_ix = pred.topk(self.topk, dim=1)
+            self.ans_ix[self.count:self.count + pred.shape[0]] = ans_ix.cpu().numpy()
+
+        self.pred[self.count:self.count + pred.shape[0]] = pred.to(getattr(torch, self.dtype)).cpu().numpy()
+        self.count += pred.shape[0]
+
+    def close(self, qids):
+        assert self.count == len(qids) == len(self.pred), \
+            'wrote {} prediction vectors for {} questions'.format(self.count, len(qids))
+
+        self.pred.flush()
+        if self.ans_ix is not None:
+            self.ans_ix.flush()
+        del self.pred, self.ans_ix
+
+        save_npy(np.asarray(qids, np.int64), os.path.join(self.path, 'qids.npy'))
+        save_json({'ans_size': self.ans_size, 'topk': self.topk, 'dtype': self.dtype},
+                  os.path.join(self.path, 'meta.json'))
+
+    def abort(self):
+        # The pass did not predict every question (EVAL_CI early stop): remove the partial arrays,
+        # and the directory when nothing else is in it
+        del self.pred, self.ans_ix
+        for name in ['pred.npy', 'ans_ix.npy']:
+            if os.path.exists(os.path.join(self.path, name)):
+                os.remove(os.path.join(self.path, name))
+        if not os.listdir(self.path):
+            os.rmdir(self.path)
+
+
+class PredReader:
+    """
+    读取PredWriter写出的预测向量，按块返回float32的完整 [rows, ans_size] 数组（top-k之外的答案为fill）
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.ans_size = meta['ans_size']
+        self.topk = meta['topk']
+
+        self.qids = np.load(os.path.join(path, 'qids.npy'))
+        self.qid_order = np.argsort(self.qids, kind='stable')
+        self.pred = np.load(os.path.join(path, 'pred.npy'), mmap_mode='r')
+        self.ans_ix = np.load(os.path.join(path, 'ans_ix.npy'), mmap_mode='r') if self.topk else None
+
+    def __len__(self):
+        return len(self.qids)
+
+    def qid_rows(self, qids):
+        # {question id} -> {row of the store}, qids must all be in the store
+        rows = self.qid_order[np.searchsorted(self.qids, qids, sorter=self.qid_order)]
+        if not np.array_equal(self.qids[rows], qids):
+            raise KeyError('question ids without a saved prediction vector')
+        return rows
+
+    def dense(self, rows, fill=0.):
+        pred = self.pred[rows].astype(np.float32)
+        if not self.topk:
+            return pred
+
+        dense = np.full((len(pred), self.ans_size), fill, np.float32)
+        np.put_along_axis(dense, self.ans_ix[rows].astype(np.int64), pred, axis=1)
+        return dense
+
+    def chunks(self, chunk_size, qids=None, fill=0.):
+        """
+        按块遍历：(qids of the chunk, float32 [chunk, ans_size])，qids给定时按其顺序读取（用于对齐多个模型）
+        """
+        if qids is None:
+            for start in range(0, len(self), chunk_size):
+                rows = np.arange(start, min(start + chunk_size, len(self)))
+                yield self.qids[rows], self.dense(rows, fill)
+        else:
+            qids = np.asarray(qids, np.int64)
+            for start in range(0, len(qids), chunk_size):
+                chunk_qids = qids[start:start + chunk_size]
+                yield chunk_qids, self.dense(self.qid_rows(chunk_qids), fill)
@@ -0,0 +1,68 @@
+import queue, threading
+import torch
+
+
+# ---------------------------------
+# ---- Device Prefetch Stage ----
+# ---------------------------------
+# 后台线程从DataLoader取batch并提前拷贝到GPU，训练循环拿到的batch已经在GPU上：
+# the copies run on a side CUDA stream (non_blocking from the pinned batches of PIN_MEM),
+# the consumer's stream waits for them only when the batch is handed over.
+
+def record_stream(obj, stream):
+    # Tensors allocated on the side stream are used on the consumer's stream, keep the allocator from reusing them early
+    if isinstance(obj, torch.Tensor):
+        obj.record_stream(stream)
+    elif isinstance(obj, (list, tuple)):
+        for x in obj:
+            record_stream(x, stream)
+
+
+class DevicePrefetcher:
+    """
+    Iterates loader_iter in a background thread, applies to_device to every batch and keeps up to
+    depth batches ready. Only used with DataLoader workers: the thread never runs dataset code then,
+    and the random states of the main process are only touched by the training loop.
+    """
+    def __init__(self, loader_iter, to_device, depth):
+        self.ready = queue.Queue(maxsize=depth)
+        self.stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+
+        self.thread = threading.Thread(target=self.fetch, args=(loader_iter, to_device), daemon=True)
+        self.thread.start()
+
+    def fetch(self, loader_iter, to_device):
+        try:
+            for batch in loader_iter:
+                event = None
+                if self.stream is not None:
+                    with torch.cuda.stream(self.stream):
+                        batch = to_device(batch)
+                        event = torch.cuda.Event()
+                        event.record(self.stream)
+                else:
+                    batch = to_device(batch)
+
+                self.ready.put((batch, event, None))
+
+            self.ready.put((None, None, StopIteration()))
+
+        except Exception as e:
+            # Raised again in the training loop
+            self.ready.put((None, None, e))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch, event, error = self.ready.get()
+        if error is not None:
+            # The pass is over, later calls keep raising
+            self.ready.put((None, None, error))
+            raise error
+
+        if event is not None:
+            torch.cuda.current_stream().wait_event(event)
+            record_stream(batch, torch.cuda.current_stream())
+
+        return batch
@@ -0,0 +1,159 @@
+from core.data.prefetch import DevicePrefetcher
+import numpy as np
+# noinspection PyPep8Naming
+import torch.utils.data as Data
+
+
+# ------------------------------------
+# ---- Length Bucketing Sampler ----
+# ------------------------------------
+# 每个batch只补齐到batch内最长的样本（DYNAMIC_PAD），把长度相近的样本放进同一个batch可以减少补齐：
+# the samples are shuffled, every pool of pool_batches x batch_size samples is sorted by length
+# and cut into batches, and the order of the batches is shuffled again.
+
+class BucketBatchSampler(Data.Sampler):
+    """
+    dataset.item_lengths() returns the length (token count + box count) of every item,
+    it is called at the start of every epoch since the external shuffle re-orders the rows
+    """
+    def __init__(self, dataset, batch_size, pool_batches, drop_last=True):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.pool_size = batch_size * pool_batches
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        lengths = self.dataset.item_lengths()
+        order = np.random.permutation(len(lengths))
+
+        for start in range(0, len(order), self.pool_size):
+            pool = order[start:start + self.pool_size]
+            order[start:start + self.pool_size] = pool[np.argsort(lengths[pool], kind='stable')]
+
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+
+        for ix in np.random.permutation(len(batches)):
+            yield batches[ix].tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+
+def random_batch_sampler(dataset, batch_size, pool_batches):
+    """
+    pool_batches为0时返回普通的随机batch采样器，否则按长度分桶
+    """
+    if pool_batches:
+        return BucketBatchSampler(dataset, batch_size, pool_batches)
+    return Data.BatchSampler(Data.RandomSampler(dataset), batch_size, drop_last=True)
+
+
+# ----------------------------------
+# ---- Resumable Data Loading ----
+# ----------------------------------
+# 断点续训：每一轮的batch顺序在开始时一次性确定，检查点中保存这一轮的batch和已经消耗的batch数，
+# the pass continues from the next batch after a restart, finished batches are not loaded again.
+
+class ResumableBatchSampler(Data.Sampler):
+    """
+    Draws every batch of a pass from batch_sampler when the pass starts;
+    with resume_at set, the saved batches of the interrupted pass are continued instead
+    """
+    def __init__(self, batch_sampler):
+        self.batch_sampler = batch_sampler
+        self.batches = []
+        self.resume_at = None
+
+    def __iter__(self):
+        if self.resume_at is None:
+            self.batches = [[int(ix) for ix in batch] for batch in self.batch_sampler]
+            start = 0
+        else:
+            start, self.resume_at = self.resume_at, None
+
+        for batch in self.batches[start:]:
+            yield batch
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+
+class ResumableLoader:
+    """
+    Iterates a DataLoader built on a ResumableBatchSampler (as sampler or batch_sampler) and counts the
+    consumed batches. Every pass draws a new dataset.sample_seed from np.random of the main process, so
+    the random sampling of the items (DataSet.seeded) is saved along with the pass.
+
+    Batches are handed over after to_device; with DataLoader workers, up to prefetch batches are
+    loaded and copied ahead by a DevicePrefetcher (the count only covers the handed over ones).
+    """
+    def __init__(self, loader, to_device=None, prefetch=0):
+        self.loader = loader
+        self.sampler = loader.batch_sampler if loader.batch_sampler is not None else loader.sampler
+        assert isinstance(self.sampler, ResumableBatchSampler)
+
+        self.to_device = to_device if to_device is not None else (lambda batch: batch)
+        self.prefetch = prefetch if loader.num_workers > 0 else 0
+
+        self.loader_iter = None
+        self.consumed = 0
+
+    def start_pass(self):
+        # sample_seed lives in shared memory, so that persistent workers see the seed of every pass
+        self.loader.dataset.sample_seed.fill_(int(np.random.randint(2 ** 31)))
+        self.consumed = 0
+        self.loader_iter = self.device_iter()
+
+    def device_iter(self):
+        if self.prefetch:
+            return DevicePrefetcher(iter(self.loader), self.to_device, self.prefetch)
+        return map(self.to_device, iter(self.loader))
+
+    def __iter__(self):
+        # One pass, or the rest of the restored one
+        if self.loader_iter is None:
+            self.start_pass()
+
+        loader_iter, self.loader_iter = self.loader_iter, None
+        for batch in loader_iter:
+            self.consumed += 1
+            yield batch
+
+    def next(self):
+        # Endless, a new pass starts when the current one is exhausted
+        if self.loader_iter is None:
+            self.start_pass()
+
+        try:
+            batch = next(self.loader_iter)
+        except StopIteration:
+            self.start_pass()
+            batch = next(self.loader_iter)
+
+        self.consumed += 1
+        return batch
+
+    def state_dict(self):
+        sample_seed = int(self.loader.dataset.sample_seed)
+        return {
+            'batches': self.sampler.batches,
+            'consumed': self.consumed,
+            'sample_seed': sample_seed if sample_seed >= 0 else None
+        }
+
+    def load_state_dict(self, state):
+        if state['sample_seed'] is None:
+            # The loader had not started yet
+            return
+
+        self.sampler.batches = state['batches']
+        self.sampler.resume_at = state['consumed']
+        self.loader.dataset.sample_seed.fill_(state['sample_seed'])
+        self.consumed = state['consumed']
+
+        # The workers start here, before the random states of the checkpoint are restored
+        self.loader_iter = self.device_iter()
@@ -0,0 +1,97 @@
+from core.data.corpus import get_ans_dict
+from core.data.pred_store import PredReader
+from core.data.data_utils import save_json
+import numpy as np
+
+
+# --------------------------------
+# ---- Out-of-core Ensembling ----
+# --------------------------------
+# 按块读取多个TEST_SAVE_PRED保存的预测向量（core/data/pred_store.py）并合并，
+# memory stays bounded by one accumulator and one model's chunk (ENSEMBLE_CHUNK x ans_size), whatever
+# the number of models. The questions follow the order of the first store.
+#
+#   mean : weighted mean of the answer scores (answers outside a top-k store score 0)
+#   rank : weighted Borda count, the ENSEMBLE_TOPK best answers of a model get ENSEMBLE_TOPK .. 1 points (default 10)
+#   vote : every model votes with its weight for its ENSEMBLE_TOPK best answers (default 1), ties go to the mean score
+
+ENSEMBLE_MODES = ['mean', 'rank', 'vote']
+DEFAULT_TOPK = {'mean': 1, 'rank': 10, 'vote': 1}
+
+
+def top_answers(pred, k):
+    # Indices of the k best answers of every row, best first
+    top = np.argpartition(-pred, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(pred, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+
+def ensemble_chunk(preds, weights, mode, topk):
+    """
+    preds: iterable of float32 [chunk, ans_size], one per model; returns the answer index of every row
+    """
+    score, votes = None, None
+    for pred, weight in zip(preds, weights):
+        if score is None:
+            score = np.zeros_like(pred)
+            votes = np.zeros_like(pred) if mode != 'mean' else None
+
+        score += weight * pred
+        if mode != 'mean':
+            top = top_answers(pred, topk)
+            points = np.arange(topk, 0, -1, dtype=np.float32) if mode == 'rank' else np.ones(topk, np.float32)
+            votes[np.arange(len(pred))[:, None], top] += weight * points
+
+    if mode == 'mean':
+        return score.argmax(1)
+
+    return np.where(votes == votes.max(1, keepdims=True), score, -np.inf).argmax(1)
+
+
+def ensemble(pred_paths, weights=None, mode='mean', topk=None, chunk_size=4096):
+    """
+    返回 (question ids, 合并后的答案编号)
+    """
+    assert mode in ENSEMBLE_MODES, 'unknown ensemble mode {}'.format(mode)
+    readers = [PredReader(path) for path in pred_paths]
+    weights = [1.] * len(readers) if not weights else [float(weight) for weight in weights]
+    assert len(weights) == len(readers), '{} weights for {} prediction files'.format(len(weights), len(readers))
+
+    qids = readers[0].qids
+    for path, reader in zip(pred_paths, readers):
+        assert len(reader) == len(qids) and reader.ans_size == readers[0].ans_size, \
+            '{} does not predict the same questions and answers as {}'.format(path, pred_paths[0])
+
+    # Answers outside the top-k of a store all score the same, they are never ranked or voted for
+    topk = min([topk or DEFAULT_TOPK[mode]] + [reader.topk for reader in readers if reader.topk])
+
+    ans_ix = np.zeros(len(qids), np.int64)
+    for start in range(0, len(qids), chunk_size):
+        print('\rEnsembling: [{} | {}] '.format(start, len(qids)), end='          ')
+        chunk_qids = qids[start:start + chunk_size]
+        # Models are read one after another, their chunks aligned to the question order of the first store
+        preds = (reader.dense(reader.qid_rows(chunk_qids)) for reader in readers)
+        ans_ix[start:start + chunk_size] = ensemble_chunk(preds, weights, mode, topk)
+    print('')
+
+    return qids, ans_ix
+
+
+def run_ensemble(__C):
+    qids, ans_ix = ensemble(
+        __C.PRED_FILES,
+        weights=__C.ENSEMBLE_WEIGHTS,
+        mode=__C.ENSEMBLE,
+        topk=__C.ENSEMBLE_TOPK,
+        chunk_size=__C.ENSEMBLE_CHUNK
+    )
+    _, ix_to_ans = get_ans_dict('core/data/answer_dict.json')
+
+    result_file = __C.RESULT_PATH + 'result_ensemble_' + __C.VERSION + '.json'
+    print('Save the result to file: {}'.format(result_file))
+    save_json([{
+        'answer': ix_to_ans[str(ans_ix[qix])],  # ix_to_ans(load with json) keys are type of string
+        'question_id': int(qids[qix])
+    } for qix in range(len(qids))], result_file)
+
+    return result_file
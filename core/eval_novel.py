@@ -1,48 +1,41 @@
-from core.data.load_data import DataSet
-from utils.vqa import VQA
+from core.data.gt_index import get_gt_index, load_res_answers
 from utils.vqaEval import VQAEval
 
-import os, copy
+import os
 
 
 class Execution:
     def __init__(self, __C):
 
         self.__C = __C
-        __C_eval = copy.deepcopy(__C)
-        setattr(__C_eval, 'RUN_MODE', 'val')
-        print('Loading validation set for per-epoch evaluation ........')
-        self.dataset_eval = DataSet(__C_eval)
+        # Only the val ground-truth index is needed (memory-mapped from datasets/compiled/gt_val/):
+        # no image features, vocabulary or DataSet, and no torch
+        print('Loading the val ground-truth index ........')
+        self.gt_index = get_gt_index(__C, 'val')
+        self.novel_ques_ids = self.gt_index.novel_qids(concept=__C.CONCEPT, skill=__C.SKILL)
 
     def run(self, run_mode):
         if run_mode == 'valNovel':
-            self.eval(self.dataset_eval)
+            # Load parameters
+            if not self.__C.RESULT_EVAL_FILE:
+                exit(-1)
+
+            for result_eval_file in self.__C.RESULT_EVAL_FILE:
+                self.eval(result_eval_file)
         else:
             exit(-1)
 
     # Evaluation
-    def eval(self, dataset):
-
-        print(self.__C.RESULT_EVAL_FILE)
+    def eval(self, result_eval_file):
 
-        # Load parameters
-        if self.__C.RESULT_EVAL_FILE is None:
-            exit(-1)
+        print(result_eval_file)
 
-        if not os.path.isfile(self.__C.RESULT_EVAL_FILE):
+        if not os.path.isfile(result_eval_file):
             exit(-1)
 
-        result_eval_file = self.__C.RESULT_EVAL_FILE
-
-        # create vqa object and vqaRes object
-        ques_file_path = self.__C.QUESTION_PATH['val']
-        ans_file_path = self.__C.ANSWER_PATH['val']
-
-        vqa = VQA(ans_file_path, ques_file_path)
-        vqaRes = vqa.loadRes(result_eval_file, ques_file_path)
-
-        # create vqaEval object by taking vqa and vqaRes
-        vqaEval = VQAEval(vqa, vqaRes, n=2)  # n is precision of accuracy (number of places after decimal), default is 2
+        # create vqaEval object by taking the gt index and the predicted answers
+        vqaEval = VQAEval(gtIndex=self.gt_index, resAnswers=load_res_answers(result_eval_file, self.gt_index),
+                          n=2)  # n is precision of accuracy (number of places after decimal), default is 2
 
         # evaluate results
         """
@@ -63,11 +56,10 @@ class Execution:
             print("%s : %.02f" % (ansType, vqaEval.accuracy['perAnswerType'][ansType]))
         print("\n")
 
-        novel_ques_ids = dataset.novel_ques_ids
-        if self.__C.NOVEL and novel_ques_ids is not None:
+        if len(self.novel_ques_ids):
             # evaluate results on novel subset
 
-            vqaEval.evaluate(novel_ques_ids)
+            vqaEval.evaluate(self.novel_ques_ids)
 
             # print accuracies
             print("\n")
@@ -1,12 +1,18 @@
 from core.data.load_data import DataSet, RefPointDataSet, SkillContrastDataSet
+from core.data.corpus import release_json
 from core.model.PointNet import PointNet
 from core.model.optim import get_optim, adjust_lr
 from core.model.losses import Losses
-from core.data.data_utils import shuffle_list, refset_collate, refset_tocuda
-from utils.vqa import VQA
+from core.data.data_utils import shuffle_list, refset_collate, refset_tocuda, ans_collate, ans_tocuda, seed_worker
+from core.data.data_utils import pad_collate, get_rng_state, set_rng_state, save_json_async
+from core.data.samplers import ResumableBatchSampler, ResumableLoader, random_batch_sampler
 from utils.vqaEval import VQAEval
+from core.data.gt_index import get_gt_index, res_ans_ids, gt_accuracy
+from core.running_eval import RunningAccuracy
+from core.data.pred_store import PredWriter
+from core.slice_eval import eval_slices
 
-import os, json, torch, datetime, pickle, copy, shutil, time
+import os, json, torch, datetime, copy, shutil, time, functools
 import numpy as np
 import torch.nn as nn
 # noinspection PyPep8Naming
@@ -59,6 +65,9 @@ class Execution:
             print('Loading validation set for per-epoch evaluation ........')
             self.dataset_eval = DataSet(__C_eval)
 
+        # All datasets are built, the parsed json is no longer needed
+        release_json()
+
     def train(self, dataset, refdataset=None, sk_contdataset=None, dataset_eval=None):
         # Obtain needed information
         data_size = dataset.data_size
@@ -88,6 +97,7 @@ class Execution:
         loss_fn = torch.nn.BCELoss(reduction='sum').cuda()
 
         # Load checkpoint if resume training
+        train_state = None
         if self.__C.RESUME:
             print('========== Resume training ==========')
 
@@ -96,10 +106,20 @@ class Execution:
                       'CKPT_VERSION and CKPT_EPOCH will not work')
 
                 path = self.__C.CKPT_PATH
+            elif self.__C.RESUME_STEP:
+                path = self.__C.CKPTS_PATH + \
+                       'ckpt_' + self.__C.CKPT_VERSION + \
+                       '/last_step.pkl'
             else:
+                # Written at the end of every epoch
                 path = self.__C.CKPTS_PATH + \
                        'ckpt_' + self.__C.CKPT_VERSION + \
-                       '/epoch' + str(self.__C.CKPT_EPOCH) + '.pkl'
+                       '/last_epoch.pkl'
+
+            if not os.path.isfile(path):
+                raise FileNotFoundError(
+                    'No checkpoint to resume from at {} (the training writes last_epoch.pkl after every epoch, '
+                    'and last_step.pkl with --CKPT_EVERY for --RESUME_STEP)'.format(path))
 
             # Load the network parameters
             print('Loading ckpt {}'.format(path))
@@ -109,10 +129,19 @@ class Execution:
 
             # Load the optimizer paramters
             optim = get_optim(self.__C, net, data_size, ckpt['lr_base'])
-            optim._step = int(data_size / self.__C.BATCH_SIZE * self.__C.CKPT_EPOCH)
             optim.optimizer.load_state_dict(ckpt['optimizer'])
 
-            start_epoch = self.__C.CKPT_EPOCH
+            if 'train_state' in ckpt:
+                # Step checkpoints (CKPT_EVERY) continue right after their last finished step
+                train_state = ckpt['train_state']
+                start_epoch = train_state['epoch']
+                optim._step = train_state['optim_step']
+            else:
+                # Epoch checkpoints record their epoch, CKPT_EPOCH is used for checkpoints without it
+                start_epoch = ckpt.get('epoch', self.__C.CKPT_EPOCH)
+                optim._step = int(data_size / self.__C.BATCH_SIZE * start_epoch)
+
+            os.makedirs(self.__C.CKPTS_PATH + 'ckpt_' + self.__C.VERSION, exist_ok=True)
 
         else:
             if ('ckpt_' + self.__C.VERSION) in os.listdir(self.__C.CKPTS_PATH):
@@ -126,49 +155,95 @@ class Execution:
         loss_sum = 0
 
         # Define multi-thread dataloader
-        if self.__C.SHUFFLE_MODE in ['external']:
-            dataloader = Data.DataLoader(
-                dataset,
-                batch_size=self.__C.BATCH_SIZE,
-                shuffle=False,
-                num_workers=self.__C.NUM_WORKERS,
-                pin_memory=self.__C.PIN_MEM,
-                drop_last=True
-            )
+        # The batches of every pass are drawn up front by ResumableBatchSampler, so that step checkpoints
+        # can save the position of every loader (see core/data/samplers.py).
+        # The workers persist across passes, and the batches are handed over on the GPU,
+        # PREFETCH of them loaded and copied ahead (see core/data/prefetch.py)
+        persistent = self.__C.NUM_WORKERS > 0
+        to_device = functools.partial(ans_tocuda, non_blocking=self.__C.PIN_MEM)
+        to_device_refset = functools.partial(refset_tocuda, non_blocking=self.__C.PIN_MEM)
+
+        # Item order of the external shuffle, kept in the main process as the workers persist
+        shuffle_order = np.arange(len(dataset))
+        if self.__C.SHUFFLE_MODE in ['external'] and not self.__C.BUCKET_POOL:
+            # shuffle_order is shuffled at the start of every epoch
+            batch_sampler = Data.BatchSampler(shuffle_order, self.__C.BATCH_SIZE, drop_last=True)
         else:
-            dataloader = Data.DataLoader(
-                dataset,
-                batch_size=self.__C.BATCH_SIZE,
-                shuffle=True,
-                num_workers=self.__C.NUM_WORKERS,
-                pin_memory=self.__C.PIN_MEM,
-                drop_last=True
-            )
+            # Batches of similar length when BUCKET_POOL is set, padded per batch (see BucketBatchSampler)
+            batch_sampler = random_batch_sampler(dataset, self.__C.BATCH_SIZE, self.__C.BUCKET_POOL)
+
+        dataloader = ResumableLoader(Data.DataLoader(
+            dataset,
+            batch_sampler=ResumableBatchSampler(batch_sampler),
+            num_workers=self.__C.NUM_WORKERS,
+            pin_memory=self.__C.PIN_MEM,
+            persistent_workers=persistent,
+            collate_fn=functools.partial(ans_collate, ans_size=ans_size)
+        ), to_device, self.__C.PREFETCH)
 
         if self.__C.USE_GROUNDING:
-            refsetloader = Data.DataLoader(
+            # Whole batches are fetched by RefPointDataSet.load_batch, which loads every image once
+            # 每次从数据集取出整个batch，batch内重复的图像只加载一次
+            refsetloader = ResumableLoader(Data.DataLoader(
                 refdataset,
-                batch_size=self.__C.BATCH_SIZE,
-                shuffle=True,
+                sampler=ResumableBatchSampler(
+                    random_batch_sampler(refdataset, self.__C.BATCH_SIZE, self.__C.BUCKET_POOL)
+                ),
+                batch_size=None,
                 num_workers=self.__C.NUM_WORKERS,
                 pin_memory=self.__C.PIN_MEM,
-                drop_last=True,
-                collate_fn=refset_collate
-            )
-
-            refsetloader_iter = iter(refsetloader)
+                persistent_workers=persistent,
+                worker_init_fn=seed_worker
+            ), to_device_refset, self.__C.PREFETCH)
 
         if self.__C.SKILL_CONT_LOSS:
-            sk_contloader = Data.DataLoader(
+            sk_contloader = ResumableLoader(Data.DataLoader(
                 sk_contdataset,
-                batch_size=self.__C.BATCH_SIZE // 4,
-                shuffle=True,
+                batch_sampler=ResumableBatchSampler(
+                    random_batch_sampler(sk_contdataset, self.__C.BATCH_SIZE // 4, self.__C.BUCKET_POOL)
+                ),
                 num_workers=self.__C.NUM_WORKERS,
                 pin_memory=self.__C.PIN_MEM,
-                drop_last=True,
-                collate_fn=refset_collate
-            )
-            sk_contloader_iter = iter(sk_contloader)
+                persistent_workers=persistent,
+                collate_fn=refset_collate,
+                worker_init_fn=seed_worker
+            ), to_device_refset, self.__C.PREFETCH)
+
+        def save_step_ckpt(epoch, loader_state):
+            # Weights plus everything needed to continue after the last finished step (RESUME_STEP)
+            # 保存断点续训需要的全部状态，先写临时文件再替换，保存中途被中断时旧的检查点仍然可用
+            state = {
+                'state_dict': net.state_dict(),
+                'optimizer': optim.optimizer.state_dict(),
+                'lr_base': optim.lr_base,
+                'train_state': {
+                    'epoch': epoch,
+                    'optim_step': optim._step,
+                    'loss_sum': float(loss_sum),
+                    'shuffle_order': torch.from_numpy(shuffle_order.copy()),
+                    'loader': loader_state,
+                    'refset_loader': refsetloader.state_dict() if self.__C.USE_GROUNDING else None,
+                    'sk_cont_loader': sk_contloader.state_dict() if self.__C.SKILL_CONT_LOSS else None,
+                    'rng': get_rng_state()
+                }
+            }
+            ckpt_path = self.__C.CKPTS_PATH + 'ckpt_' + self.__C.VERSION + '/last_step.pkl'
+            torch.save(state, ckpt_path + '.tmp')
+            os.replace(ckpt_path + '.tmp', ckpt_path)
+
+        # Continue the interrupted passes, the random states are restored once every loader has started
+        if train_state is not None:
+            loss_sum = train_state['loss_sum']
+            shuffle_order[:] = train_state['shuffle_order'].numpy()
+
+            if train_state['loader'] is not None:
+                dataloader.load_state_dict(train_state['loader'])
+            if self.__C.USE_GROUNDING and train_state['refset_loader'] is not None:
+                refsetloader.load_state_dict(train_state['refset_loader'])
+            if self.__C.SKILL_CONT_LOSS and train_state['sk_cont_loader'] is not None:
+                sk_contloader.load_state_dict(train_state['sk_cont_loader'])
+
+            set_rng_state(train_state['rng'])
 
         # Training script
         for epoch in range(start_epoch, self.__C.MAX_EPOCH):
@@ -186,13 +261,17 @@ class Execution:
             )
             logfile.close()
 
-            # Learning Rate Decay
-            if epoch in self.__C.LR_DECAY_LIST:
-                adjust_lr(optim, self.__C.LR_DECAY_R)
+            # The checkpoint of an interrupted epoch was saved after its decay and shuffle
+            resume_epoch = epoch == start_epoch and train_state is not None and train_state['loader'] is not None
 
-            # Externally shuffle
-            if self.__C.SHUFFLE_MODE == 'external':
-                shuffle_list(dataset.ans_list)
+            if not resume_epoch:
+                # Learning Rate Decay
+                if epoch in self.__C.LR_DECAY_LIST:
+                    adjust_lr(optim, self.__C.LR_DECAY_R)
+
+                # Externally shuffle
+                if self.__C.SHUFFLE_MODE == 'external':
+                    shuffle_list(shuffle_order)
 
             time_start = time.time()
             # Iteration
@@ -200,14 +279,10 @@ class Execution:
                     img_feat_iter,
                     ques_ix_iter,
                     ans_iter
-            ) in enumerate(dataloader):
+            ) in enumerate(dataloader, start=train_state['loader']['consumed'] if resume_epoch else 0):
 
                 optim.zero_grad()
 
-                img_feat_iter = img_feat_iter.cuda()
-                ques_ix_iter = ques_ix_iter.cuda()
-                ans_iter = ans_iter.cuda()
-
                 for accu_step in range(self.__C.GRAD_ACCU_STEPS):
 
                     sub_img_feat_iter = \
@@ -260,73 +335,36 @@ class Execution:
                 if self.__C.USE_GROUNDING and random.random() <= self.__C.GROUNDING_PROB:
                     optim.zero_grad()
 
-                    try:
-                        point_batch = next(refsetloader_iter)
-                    except StopIteration:
-                        refsetloader_iter = iter(refsetloader)
-                        point_batch = next(refsetloader_iter)
-
-                    target, refs, mask_tok_pos, point_positions, qid_data = refset_tocuda(point_batch)
+                    target, refs, mask_tok_pos, point_positions, qid_data = refsetloader.next()
 
                     # -------------- Forward pass: target and refs ---------------- #
-                    output = net(target[0], target[1])
-                    target_vqa_output, target_hiddens = output[0], output[1]
+                    output, split = self.group_forward(net, target, refs)
+                    target_hiddens, *refs_hiddens = split(output[1])
+                    _, *refs_masks = split(output[2].squeeze(2).squeeze(1))
 
                     # -------------- Compute loss of pointing  -------------- #
-                    refs_vqa_output, refs_hiddens, refs_masks = [], [], []
-                    for i in range(len(refs)):
-                        ref_output = net(refs[i][0], refs[i][1])
-                        r_output, r_hidden, r_hidden_mask = ref_output[0], ref_output[1], ref_output[2]
-                        refs_vqa_output.append(r_output)
-                        refs_hiddens.append(r_hidden)
-                        refs_masks.append(r_hidden_mask.squeeze(2).squeeze(1))
 
                     # 在这里调用pointing_loss，调用CrossEntropyLoss
                     # target的最大不能超过input的width
 
-                    print(point_positions)
-
                     loss_pointing = loss_fns.pointing_loss(
                         target_hiddens, refs_hiddens, refs_masks, mask_tok_pos, point_positions
                     )
 
                     if self.__C.SKILL_CONT_LOSS:
-                        try:
-                            sk_cont_batch = next(sk_contloader_iter)
-                        except StopIteration:
-                            sk_contloader_iter = iter(sk_contloader)
-                            sk_cont_batch = next(sk_contloader_iter)
-
-                        # print(sk_cont_batch)
-                        # print("----------------------------------------------------------------")
-                        target, refs, _, point_positions, _ = refset_tocuda(sk_cont_batch)
+                        target, refs, _, point_positions, _ = sk_contloader.next()
 
-                        output = net(target[0], target[1])
+                        output, split = self.group_forward(net, target, refs)
 
                         if self.__C.SKILL_POOL == 'cls':
-                            target_tokens = output[-1][1]
-                            target_mask = None
+                            target_tokens, *refs_tokens = split(output[-1][1])
+                            target_mask, refs_masks = None, [None] * len(refs)
                         else:
-                            target_tokens = output[1]
-                            target_mask = output[2].squeeze(2).squeeze(1)
+                            target_tokens, *refs_tokens = split(output[1])
+                            target_mask, *refs_masks = split(output[2].squeeze(2).squeeze(1))
 
                         # -------------- Compute skill loss  -------------- #
 
-                        refs_tokens = []
-                        refs_masks = []
-                        for i in range(len(refs)):
-                            ref_output = net(refs[i][0], refs[i][1])
-
-                            if self.__C.SKILL_POOL == 'cls':
-                                r_token = ref_output[-1][1]
-                                r_token_mask = None
-                            else:
-                                r_token = ref_output[1]
-                                r_token_mask = ref_output[2].squeeze(2).squeeze(1)
-
-                            refs_tokens.append(r_token)
-                            refs_masks.append(r_token_mask)
-
                         loss_sk_cont = loss_fns.skill_contrast_loss(
                             target_tokens,
                             target_mask,
@@ -340,6 +378,9 @@ class Execution:
                     loss_pointing.backward()
                     optim.step()
 
+                if self.__C.CKPT_EVERY and (step + 1) % self.__C.CKPT_EVERY == 0:
+                    save_step_ckpt(epoch, dataloader.state_dict())
+
             time_end = time.time()
             print('Finished in {}s'.format(int(time_end - time_start)))
 
@@ -349,7 +390,8 @@ class Execution:
             state = {
                 'state_dict': net.state_dict(),
                 'optimizer': optim.optimizer.state_dict(),
-                'lr_base': optim.lr_base
+                'lr_base': optim.lr_base,
+                'epoch': epoch_finish
             }
             torch.save(
                 state,
@@ -374,6 +416,10 @@ class Execution:
             )
             logfile.close()
 
+            # Hit/miss counters of the shared image feature cache, for sizing IMG_FEAT_CACHE_SIZE
+            if dataset.img_feat_cache is not None:
+                print('Image feature cache: {}'.format(dataset.img_feat_cache.stats()))
+
             # Eval after every epoch
             if dataset_eval is not None:
                 with torch.no_grad():
@@ -385,6 +431,26 @@ class Execution:
 
             loss_sum = 0
 
+            if self.__C.CKPT_EVERY:
+                # The next epoch starts from scratch
+                save_step_ckpt(epoch_finish, None)
+
+    @staticmethod
+    def group_forward(net, target, refs):
+        """
+        目标问题和全部参考问题沿batch维拼接，只做一次前向（refset_collate已补齐到同一长度和框数）
+        Returns the output of net and split(x), which cuts a batch-first output of the forward
+        back into [target, ref 1, ..., ref n]
+        """
+        groups = [target] + list(refs)
+        bounds = np.cumsum([0] + [group[0].size(0) for group in groups])
+        output = net(torch.cat([group[0] for group in groups]), torch.cat([group[1] for group in groups]))
+
+        def split(x):
+            return [x[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+        return output, split
+
     # Evaluation
     def eval(self, dataset, state_dict=None, valid=False):
 
@@ -407,9 +473,12 @@ class Execution:
             print('Finish!')
 
         # Store the prediction list
-        qid_list = [ques['question_id'] for ques in dataset.ques_list]
+        qid_list = dataset.corpus.qids[dataset.rows]
         ans_ix_list = []
-        pred_list = []
+
+        # Answers predicted from the features rounded to FEAT_DTYPE_DELTA, for the accuracy delta
+        delta_dtype = getattr(torch, self.__C.FEAT_DTYPE_DELTA) if valid and self.__C.FEAT_DTYPE_DELTA else None
+        delta_ans_ix_list = []
 
         data_size = dataset.data_size
         token_size = dataset.token_size
@@ -432,12 +501,43 @@ class Execution:
 
         net.load_state_dict(state_dict)
 
+        # Stream the whole prediction vectors batch by batch into a memory-mapped store
+        pred_writer = None
+        if self.__C.TEST_SAVE_PRED:
+
+            if self.__C.CKPT_PATH is not None:
+                ensemble_path = \
+                    self.__C.PRED_PATH + \
+                    'result_run_' + self.__C.CKPT_VERSION
+            else:
+                ensemble_path = \
+                    self.__C.PRED_PATH + \
+                    'result_run_' + self.__C.CKPT_VERSION + \
+                    '_epoch' + str(self.__C.CKPT_EPOCH)
+
+            print('Save the prediction vectors to: {}'.format(ensemble_path))
+            pred_writer = PredWriter(ensemble_path, len(qid_list), ans_size,
+                                     dtype=self.__C.PRED_DTYPE, topk=self.__C.PRED_TOPK)
+
+        # Accuracies accumulated as the batches arrive. With EVAL_CI the questions are visited in a random
+        # order and the pass stops once the confidence interval of the overall accuracy is tight enough
+        # 固定种子的独立随机数，不影响训练的随机状态
+        running = None
+        order = np.arange(len(qid_list))
+        if valid:
+            gt_index = get_gt_index(self.__C, 'val')
+            running = RunningAccuracy(gt_index, dataset.ix_to_ans, novel_ques_ids)
+            if self.__C.EVAL_CI:
+                order = np.random.RandomState(self.__C.SEED).permutation(len(qid_list))
+        early_stop = False
+
         dataloader = Data.DataLoader(
             dataset,
             batch_size=self.__C.EVAL_BATCH_SIZE,
-            shuffle=False,
+            sampler=order.tolist(),
             num_workers=self.__C.NUM_WORKERS,
-            pin_memory=True
+            pin_memory=True,
+            collate_fn=pad_collate
         )
 
         for step, (
@@ -445,9 +545,10 @@ class Execution:
                 ques_ix_iter,
                 ans_iter
         ) in enumerate(dataloader):
-            print("\rEvaluation: [step %4d/%4d]" % (
+            print("\rEvaluation: [step %4d/%4d]%s" % (
                 step,
                 int(data_size / self.__C.EVAL_BATCH_SIZE),
+                running.summary() if running is not None else ''
             ), end='          ')
 
             img_feat_iter = img_feat_iter.cuda()
@@ -458,6 +559,11 @@ class Execution:
             pred_np = pred.cpu().data.numpy()
             pred_argmax = np.argmax(pred_np, axis=1)
 
+            if running is not None:
+                batch_start = step * self.__C.EVAL_BATCH_SIZE
+                running.update(qid_list[order[batch_start:batch_start + len(pred_argmax)]], pred_argmax)
+                early_stop = bool(self.__C.EVAL_CI) and running.converged(self.__C.EVAL_CI)
+
             # Save the answer index
             if pred_argmax.shape[0] != self.__C.EVAL_BATCH_SIZE:
                 pred_argmax = np.pad(
@@ -469,25 +575,44 @@ class Execution:
 
             ans_ix_list.append(pred_argmax)
 
+            if delta_dtype is not None:
+                if img_feat_iter.dtype != torch.float32:
+                    raise ValueError('FEAT_DTYPE_DELTA needs float32 features, got {} '
+                                     '(set IMG_FEAT_DTYPE float32, or --PACKED_FEAT False for half '
+                                     'precision packs)'.format(img_feat_iter.dtype))
+
+                delta_pred = net(img_feat_iter.to(delta_dtype), ques_ix_iter)[0]
+                delta_argmax = np.argmax(delta_pred.cpu().data.numpy(), axis=1)
+                delta_ans_ix_list.append(np.pad(
+                    delta_argmax,
+                    (0, self.__C.EVAL_BATCH_SIZE - delta_argmax.shape[0]),
+                    mode='constant',
+                    constant_values=-1
+                ))
+
             # Save the whole prediction vector
-            if self.__C.TEST_SAVE_PRED:
-                if pred_np.shape[0] != self.__C.EVAL_BATCH_SIZE:
-                    pred_np = np.pad(
-                        pred_np,
-                        ((0, self.__C.EVAL_BATCH_SIZE - pred_np.shape[0]), (0, 0)),
-                        mode='constant',
-                        constant_values=-1
-                    )
+            if pred_writer is not None:
+                pred_writer.write(pred)
 
-                pred_list.append(pred_np)
+            if early_stop:
+                break
 
         print('')
-        ans_ix_list = np.array(ans_ix_list).reshape(-1)
-
-        result = [{
-            'answer': dataset.ix_to_ans[str(ans_ix_list[qix])],  # ix_to_ans(load with json) keys are type of string
-            'question_id': int(qid_list[qix])
-        } for qix in range(qid_list.__len__())]
+        if early_stop:
+            if pred_writer is not None:
+                print('Early stop: the prediction vectors are not saved')
+                pred_writer.abort()
+            self.eval_estimate(running, qid_list[order], delta_ans_ix_list, val_ckpt_flag)
+            return
+
+        # Back from the visiting order to the order of qid_list
+        ans_ix_list = np.array(ans_ix_list).reshape(-1)[:len(qid_list)][np.argsort(order)]
+
+        def answer_list(ans_ix):
+            return [{
+                'answer': dataset.ix_to_ans[str(ans_ix[qix])],  # ix_to_ans(load with json) keys are type of string
+                'question_id': int(qid_list[qix])
+            } for qix in range(qid_list.__len__())]
 
         # Write the results to result file
         if valid:
@@ -517,44 +642,19 @@ class Execution:
 
             print('Save the result to file: {}'.format(result_eval_file))
 
-        json.dump(result, open(result_eval_file, 'w'))
-
-        # Save the whole prediction vector
-        if self.__C.TEST_SAVE_PRED:
-
-            if self.__C.CKPT_PATH is not None:
-                ensemble_file = \
-                    self.__C.PRED_PATH + \
-                    'result_run_' + self.__C.CKPT_VERSION + \
-                    '.json'
-            else:
-                ensemble_file = \
-                    self.__C.PRED_PATH + \
-                    'result_run_' + self.__C.CKPT_VERSION + \
-                    '_epoch' + str(self.__C.CKPT_EPOCH) + \
-                    '.json'
-
-            print('Save the prediction vector to file: {}'.format(ensemble_file))
-
-            pred_list = np.array(pred_list).reshape(-1, ans_size)
-            result_pred = [{
-                'pred': pred_list[qix],
-                'question_id': int(qid_list[qix])
-            } for qix in range(qid_list.__len__())]
+        if valid:
+            # Only archived: written in the background, the evaluation takes the answer indices directly
+            save_json_async(lambda: answer_list(ans_ix_list), result_eval_file)
+        else:
+            json.dump(answer_list(ans_ix_list), open(result_eval_file, 'w'))
 
-            pickle.dump(result_pred, open(ensemble_file, 'wb+'), protocol=-1)
+        if pred_writer is not None:
+            pred_writer.close(qid_list[order])
 
         # Run validation script
         if valid:
-            # create vqa object and vqaRes object
-            ques_file_path = self.__C.QUESTION_PATH['val']
-            ans_file_path = self.__C.ANSWER_PATH['val']
-
-            vqa = VQA(ans_file_path, ques_file_path)
-            vqaRes = vqa.loadRes(result_eval_file, ques_file_path)
-
-            # create vqaEval object by taking vqa and vqaRes
-            vqaEval = VQAEval(vqa, vqaRes,
+            # create vqaEval object by taking the gt index and the predicted answers
+            vqaEval = VQAEval(gtIndex=gt_index, resAnsIds=res_ans_ids(gt_index, qid_list, ans_ix_list, dataset.ix_to_ans),
                               n=2)  # n is precision of accuracy (number of places after decimal), default is 2
 
             # evaluate results
@@ -563,6 +663,7 @@ class Execution:
             By default it uses all the question ids in annotation file
             """
             vqaEval.evaluate()
+            overall_acc = vqaEval.accuracy['overall']
 
             # print accuracies
             print("\n")
@@ -572,51 +673,122 @@ class Execution:
                 print("%s : %.02f" % (ansType, vqaEval.accuracy['perAnswerType'][ansType]))
             print("\n")
 
-            if type(novel_ques_ids) is list and len(novel_ques_ids):
-                # evaluate results on novel subset
-
-                vqaEval.evaluate(novel_ques_ids)
+            # Novel subset, skills, concepts and skill-concept pairs from the same per-question accuracies
+            # 所有切片一次汇总，结果写到result文件旁边的_slices.json
+            slice_file = result_eval_file.replace('.json', '_slices.json')
+            slices = eval_slices(vqaEval, dataset.corpus, novel_ques_ids, report_file=slice_file)
+            print('Save the sliced accuracies to file: {}'.format(slice_file))
 
+            if 'novel' in slices:
                 # print accuracies
                 print("\n")
-                print("Novel Subset Accuracy is: %.02f\n" % (vqaEval.accuracy['overall']))
+                print("Novel Subset Accuracy is: %.02f\n" % (slices['novel']['novel']['accuracy']))
                 print("Per Answer Type Accuracy is the following:")
-                for ansType in vqaEval.accuracy['perAnswerType']:
-                    print("%s : %.02f" % (ansType, vqaEval.accuracy['perAnswerType'][ansType]))
+                for ansType in slices['novel_per_answer_type']:
+                    print("%s : %.02f" % (ansType, slices['novel_per_answer_type'][ansType]['accuracy']))
                 print("\n")
 
-            if val_ckpt_flag:
-                print('Write to log file: {}'.format(
-                    self.__C.LOG_PATH +
-                    'log_run_' + self.__C.CKPT_VERSION + '.txt',
-                    'a+')
-                )
-
-                logfile = open(
-                    self.__C.LOG_PATH +
-                    'log_run_' + self.__C.CKPT_VERSION + '.txt',
-                    'a+'
-                )
-
-            else:
-                print('Write to log file: {}'.format(
-                    self.__C.LOG_PATH +
-                    'log_run_' + self.__C.VERSION + '.txt',
-                    'a+')
-                )
-
-                logfile = open(
-                    self.__C.LOG_PATH +
-                    'log_run_' + self.__C.VERSION + '.txt',
-                    'a+'
-                )
+            logfile = self.open_eval_log(val_ckpt_flag)
 
             logfile.write("Overall Accuracy is: %.02f\n" % (vqaEval.accuracy['overall']))
             for ansType in vqaEval.accuracy['perAnswerType']:
                 logfile.write("%s : %.02f " % (ansType, vqaEval.accuracy['perAnswerType'][ansType]))
-            logfile.write("\n\n")
+            logfile.write("\n")
+            if 'novel' in slices:
+                logfile.write("Novel Subset Accuracy is: %.02f\n" % (slices['novel']['novel']['accuracy']))
+            logfile.write("\n")
+
+            if delta_dtype is not None:
+                # Same model and questions, image features rounded to FEAT_DTYPE_DELTA
+                delta_ans_ix_list = np.array(delta_ans_ix_list).reshape(-1)[:len(qid_list)][np.argsort(order)]
+                delta_result_file = result_eval_file.replace('.json', '_' + self.__C.FEAT_DTYPE_DELTA + '.json')
+                save_json_async(lambda: answer_list(delta_ans_ix_list), delta_result_file)
+
+                deltaEval = VQAEval(gtIndex=gt_index, resAnsIds=res_ans_ids(
+                    gt_index, qid_list, delta_ans_ix_list, dataset.ix_to_ans), n=2)
+                deltaEval.evaluate()
+
+                delta_str = "%s feature Accuracy is: %.02f (delta %+.02f)\n" % (
+                    self.__C.FEAT_DTYPE_DELTA,
+                    deltaEval.accuracy['overall'],
+                    deltaEval.accuracy['overall'] - overall_acc
+                )
+                print(delta_str)
+                logfile.write(delta_str + "\n")
+
             logfile.close()
 
+    def open_eval_log(self, val_ckpt_flag):
+        if val_ckpt_flag:
+            print('Write to log file: {}'.format(
+                self.__C.LOG_PATH +
+                'log_run_' + self.__C.CKPT_VERSION + '.txt',
+                'a+')
+            )
+
+            return open(
+                self.__C.LOG_PATH +
+                'log_run_' + self.__C.CKPT_VERSION + '.txt',
+                'a+'
+            )
+
+        else:
+            print('Write to log file: {}'.format(
+                self.__C.LOG_PATH +
+                'log_run_' + self.__C.VERSION + '.txt',
+                'a+')
+            )
+
+            return open(
+                self.__C.LOG_PATH +
+                'log_run_' + self.__C.VERSION + '.txt',
+                'a+'
+            )
+
+    def eval_estimate(self, running, visited_qids, delta_ans_ix_list, val_ckpt_flag):
+        # The pass stopped early (EVAL_CI): accuracies estimated from the questions evaluated so far,
+        # no result file is written
+        accuracy = running.report()
+        estimate_str = "Estimated Accuracy is: %.02f +- %.02f (%d of %d questions)\n" % (
+            accuracy['overall'], accuracy['half_width'], accuracy['count'], len(running.gt_index))
+
+        print("\n")
+        print(estimate_str)
+        print("Per Answer Type Accuracy is the following:")
+        for ansType in accuracy['perAnswerType']:
+            print("%s : %.02f" % (ansType, accuracy['perAnswerType'][ansType]))
+        if 'novel' in accuracy:
+            print("Novel Subset Accuracy is: %.02f" % (accuracy['novel']))
+        print("\n")
+
+        logfile = self.open_eval_log(val_ckpt_flag)
+        logfile.write(estimate_str)
+        for ansType in accuracy['perAnswerType']:
+            logfile.write("%s : %.02f " % (ansType, accuracy['perAnswerType'][ansType]))
+        logfile.write("\n")
+        if 'novel' in accuracy:
+            logfile.write("Novel Subset Accuracy is: %.02f\n" % (accuracy['novel']))
+        logfile.write("\n")
+
+        if delta_ans_ix_list:
+            # Same sample of questions, image features rounded to FEAT_DTYPE_DELTA
+            delta_ans_ix = np.array(delta_ans_ix_list).reshape(-1)[:accuracy['count']]
+            delta_acc = round(100 * gt_accuracy(
+                running.gt_index,
+                running.gt_index.qid_pos(visited_qids[:accuracy['count']]),
+                running.ans_to_gt[delta_ans_ix]
+            ).mean(), 2)
+
+            delta_str = "%s feature Accuracy is: %.02f (delta %+.02f)\n" % (
+                self.__C.FEAT_DTYPE_DELTA,
+                delta_acc,
+                delta_acc - accuracy['overall']
+            )
+            print(delta_str)
+            logfile.write(delta_str + "\n")
+
+        logfile.close()
+
     def run(self, run_mode):
         if run_mode == 'train':
             self.empty_log(self.__C.VERSION)
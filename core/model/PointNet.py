@@ -88,6 +88,9 @@ class PointNet(nn.Module):
         self.classifier = nn.Linear(__C.HIDDEN_SIZE, answer_size)
 
     def forward(self, img_feat, ques_ix, **kwargs):
+        # Features may be stored in half precision (IMG_FEAT_DTYPE), upcast before img_feat_linear
+        img_feat = img_feat.to(self.img_feat_linear.weight.dtype)
+
         # Make mask
         lang_feat_mask = self.make_mask(ques_ix.unsqueeze(2))
         img_feat_mask = self.make_mask(img_feat)
@@ -45,7 +45,6 @@ class Losses:
         # point_mask_tok: batch x 1; vector indicating where in the target sequence is the masked token used for pointing
 
         batch_size, num_toks, tok_dim = tgt.size()
-        n_refs = len(refs)
 
         row_id = torch.from_numpy(np.array(range(batch_size)))
         masked_tok = tgt[row_id.long(), point_mask_tok.squeeze(1)]  # batch_size x tok_dim
@@ -53,7 +52,7 @@ class Losses:
         all_ref_hiddens = torch.cat(refs, dim=1)
         all_ref_masks = torch.cat(ref_masks, dim=-1)
 
-        scores = torch.zeros(batch_size, num_toks * n_refs, dtype=tgt.dtype, device=tgt.device)
+        scores = torch.zeros(batch_size, all_ref_hiddens.size(1), dtype=tgt.dtype, device=tgt.device)
 
         for i in range(batch_size):
             scores[i, :] = torch.matmul(masked_tok[i], all_ref_hiddens[i].t()) / sqrt(tok_dim)
@@ -0,0 +1,86 @@
+from core.data.gt_index import answer_gt_ids, gt_accuracy
+import numpy as np
+
+
+# ----------------------------
+# ---- Running Accuracy ----
+# ----------------------------
+# 验证时每个batch的pred_argmax到达后立即计算准确率并累加：overall、新问题子集和每种答案类型。
+# The questions of a pass are a sample without replacement of the annotated ones, so the confidence
+# interval of the overall accuracy uses the finite population correction; it is only meaningful when
+# the questions are visited in a random order (see EVAL_CI).
+
+# Fewest evaluated questions before an early stop
+MIN_QUESTIONS = 1000
+
+
+class RunningAccuracy:
+    def __init__(self, gt_index, ix_to_ans, novel_ques_ids=None, z=1.96):
+        self.gt_index = gt_index
+        self.ans_to_gt = answer_gt_ids(gt_index, ix_to_ans)
+        self.z = z
+
+        self.novel = np.zeros(len(gt_index), bool)
+        if novel_ques_ids is not None and len(novel_ques_ids):
+            novel_ques_ids = np.asarray(novel_ques_ids, np.int64)
+            self.novel[gt_index.qid_pos(novel_ques_ids[np.isin(novel_ques_ids, gt_index.qids)])] = True
+
+        # Groups: 0 overall, 1 novel, 2.. answer types
+        n_groups = 2 + len(gt_index.ans_type_names)
+        self.sums = np.zeros(n_groups)
+        self.sq_sums = np.zeros(n_groups)
+        self.counts = np.zeros(n_groups, np.int64)
+
+    def update(self, qids, ans_ix):
+        # Returns the accuracy in [0, 1] of every question of the batch
+        pos = self.gt_index.qid_pos(np.asarray(qids, np.int64))
+        acc = gt_accuracy(self.gt_index, pos, self.ans_to_gt[ans_ix])
+
+        novel = self.novel[pos]
+        groups = np.concatenate([np.zeros(len(pos), np.int64), np.ones(novel.sum(), np.int64),
+                                 2 + np.asarray(self.gt_index.ans_type[pos])])
+        group_acc = np.concatenate([acc, acc[novel], acc])
+
+        self.sums += np.bincount(groups, weights=group_acc, minlength=len(self.sums))
+        self.sq_sums += np.bincount(groups, weights=group_acc ** 2, minlength=len(self.sums))
+        self.counts += np.bincount(groups, minlength=len(self.sums))
+        return acc
+
+    def accuracy(self, group=0):
+        return 100 * self.sums[group] / max(self.counts[group], 1)
+
+    def half_width(self, group=0):
+        # z * standard error of the mean accuracy, in percent
+        count = self.counts[group]
+        if count < 2:
+            return float('inf')
+        mean = self.sums[group] / count
+        var = max(self.sq_sums[group] / count - mean ** 2, 0.) * count / (count - 1)
+        fpc = (len(self.gt_index) - count) / max(len(self.gt_index) - 1, 1)
+        return 100 * self.z * np.sqrt(var / count * fpc)
+
+    def converged(self, max_half_width):
+        return self.counts[0] >= MIN_QUESTIONS and self.half_width() <= max_half_width
+
+    def summary(self):
+        # One line for the evaluation progress
+        if not self.counts[0]:
+            return ''
+        line = ' acc %.2f +- %.2f' % (self.accuracy(), self.half_width())
+        if self.counts[1]:
+            line += ', novel %.2f' % self.accuracy(1)
+        return line
+
+    def report(self, n=2):
+        report = {
+            'overall': round(self.accuracy(), n),
+            'half_width': round(self.half_width(), n),
+            'count': int(self.counts[0]),
+            'perAnswerType': {
+                name: round(self.accuracy(2 + type_id), n)
+                for type_id, name in enumerate(self.gt_index.ans_type_names) if self.counts[2 + type_id]
+            }
+        }
+        if self.counts[1]:
+            report['novel'] = round(self.accuracy(1), n)
+        return report
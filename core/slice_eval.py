@@ -0,0 +1,93 @@
+from core.data.data_utils import save_json
+import numpy as np
+
+
+# ---------------------------
+# ---- Sliced Evaluation ----
+# ---------------------------
+# 把每个问题的准确率按切片汇总：整体、新问题子集、每个技能、每个概念、每个技能-概念组合。
+# A slice family is (family name, group names, positions, group ids): question positions[i] belongs to
+# group group_ids[i]; a question may be in several groups of a family (all its concepts). Every family is
+# offset into one id space, so a single np.bincount aggregates all slices.
+
+def concept_entries(corpus, rows):
+    # (position in rows, concept id) of every 'all_concepts' entry (the 'concepts' keys when missing)
+    n_entries = corpus.all_concept_ptr[rows + 1] - corpus.all_concept_ptr[rows]
+    positions = np.repeat(np.arange(len(rows)), n_entries)
+    offsets = np.arange(len(positions)) - np.repeat(np.cumsum(n_entries) - n_entries, n_entries)
+    return positions, corpus.all_concept_id[corpus.all_concept_ptr[rows][positions] + offsets].astype(np.int64)
+
+
+def question_slices(corpus, rows, novel=None, ans_types=None):
+    """
+    rows: corpus row of every evaluated question
+    novel: bool mask of the novel questions, ans_types: (type names, type id of every question)
+    """
+    everyone = np.arange(len(rows))
+    families = [('overall', ['overall'], everyone, np.zeros(len(rows), np.int64))]
+    if ans_types is not None:
+        families.append(('per_answer_type', ans_types[0], everyone, ans_types[1]))
+
+    if novel is not None:
+        novel_pos = np.nonzero(novel)[0]
+        families.append(('novel', ['novel'], novel_pos, np.zeros(len(novel_pos), np.int64)))
+        if ans_types is not None:
+            families.append(('novel_per_answer_type', ans_types[0], novel_pos, ans_types[1][novel_pos]))
+
+    skill = corpus.skill_code[rows].astype(np.int64)
+    families.append(('per_skill', corpus.skill_names, np.nonzero(skill >= 0)[0], skill[skill >= 0]))
+
+    concept_pos, concept_id = concept_entries(corpus, rows)
+    families.append(('per_concept', corpus.concept_names, concept_pos, concept_id))
+
+    # Only the (skill, concept) pairs that occur are named
+    n_concepts = len(corpus.concept_names)
+    with_skill = skill[concept_pos] >= 0
+    pairs, pair_ix = np.unique(skill[concept_pos][with_skill] * n_concepts + concept_id[with_skill], return_inverse=True)
+    pair_names = [corpus.skill_names[pair // n_concepts] + '|' + corpus.concept_names[pair % n_concepts] for pair in pairs]
+    families.append(('per_skill_concept', pair_names, concept_pos[with_skill], pair_ix.reshape(-1)))
+
+    return families
+
+
+def slice_accuracy(families, acc, n=2):
+    """
+    acc: accuracy in [0, 1] of every question, returns {family: {group: {'accuracy', 'count'}}}
+    accuracies are in percent rounded to n places like VQAEval, empty groups are left out
+    """
+    offsets = np.cumsum([0] + [len(names) for _, names, _, _ in families])
+    positions = np.concatenate([family[2] for family in families])
+    groups = np.concatenate([family[3] + offset for family, offset in zip(families, offsets)])
+
+    sums = np.bincount(groups, weights=acc[positions], minlength=offsets[-1])
+    counts = np.bincount(groups, minlength=offsets[-1])
+
+    report = {}
+    for (family, names, _, _), offset in zip(families, offsets):
+        report[family] = {
+            name: {'accuracy': round(100 * float(sums[offset + i]) / counts[offset + i], n), 'count': int(counts[offset + i])}
+            for i, name in enumerate(names) if counts[offset + i]
+        }
+    return report
+
+
+def eval_slices(vqa_eval, corpus, novel_ques_ids=None, report_file=None):
+    """
+    Slices the per-question accuracies of the last vqa_eval.evaluate() call, optionally saved as json
+    """
+    ques_ids = np.asarray(vqa_eval.evalQuesIds, np.int64)
+    novel = None
+    if novel_ques_ids is not None and len(novel_ques_ids):
+        novel = np.isin(ques_ids, np.asarray(novel_ques_ids, np.int64))
+
+    families = question_slices(
+        corpus,
+        corpus.qid_rows(ques_ids),
+        novel=novel,
+        ans_types=(vqa_eval.ansTypes, vqa_eval.evalAnsTypeIds)
+    )
+    report = slice_accuracy(families, vqa_eval.accQA, n=vqa_eval.n)
+
+    if report_file is not None:
+        save_json(report, report_file)
+    return report
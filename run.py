@@ -4,7 +4,7 @@ from distutils import util as dutil
 
 from cfgs.base_cfgs import Cfgs
 from core.eval_novel import Execution as NovelEval
-from core.exec2steps import Execution as Exec2Steps
+from core.data.gt_index import get_gt_index
 
 import os
 
@@ -27,8 +27,8 @@ def parse_args():
 
     # 运行模式
     parser.add_argument('--RUN', dest='RUN_MODE',
-                        choices=['train', 'val', 'test', 'valNovel'],
-                        help='{train, val, test, valNovel}',
+                        choices=['train', 'val', 'test', 'valNovel', 'prepare', 'ensemble'],
+                        help='{train, val, test, valNovel, prepare, ensemble}',
                         type=str, required=True)
 
     # bert模型种类
@@ -58,7 +58,7 @@ def parse_args():
 
     # 结果评估的文件
     parser.add_argument('--RESULT_EVAL_FILE', dest='RESULT_EVAL_FILE',
-                        type=str, default=None, help='JSON file containing generated answers for evaluation.')
+                        type=str, nargs='+', default=None, help='JSON file(s) containing generated answers for evaluation.')
 
     # 新概念 在训练中没有标注的数据
     parser.add_argument('--CONCEPT', dest='CONCEPT',
@@ -121,6 +121,12 @@ def parse_args():
                              "'train' split)",
                         type=bool)
 
+    parser.add_argument('--EVAL_CI', dest='EVAL_CI',
+                        help='stop validating once the 95%% confidence '
+                             'interval of the accuracy is within +-EVAL_CI '
+                             'points (0: whole val split)',
+                        type=float)
+
     # 保存预测向量（仅在prediction时有效）
     parser.add_argument('--SAVE_PRED', dest='TEST_SAVE_PRED',
                         help='set True to save the '
@@ -128,6 +134,38 @@ def parse_args():
                              '(only work in testing)',
                         type=bool)
 
+    parser.add_argument('--PRED_DTYPE', dest='PRED_DTYPE',
+                        choices=['float32', 'float16'],
+                        help='dtype of the saved prediction vectors',
+                        type=str)
+
+    parser.add_argument('--PRED_TOPK', dest='PRED_TOPK',
+                        help='only save the top-k answer scores '
+                             'of every question (0: all)',
+                        type=int)
+
+    # 合并多个模型保存的预测向量
+    parser.add_argument('--PRED_FILES', dest='PRED_FILES',
+                        help='prediction directories saved with --SAVE_PRED (--RUN ensemble)',
+                        type=str, nargs='+')
+
+    parser.add_argument('--ENSEMBLE', dest='ENSEMBLE',
+                        choices=['mean', 'rank', 'vote'],
+                        help='how the predictions are combined',
+                        type=str)
+
+    parser.add_argument('--ENSEMBLE_WEIGHTS', dest='ENSEMBLE_WEIGHTS',
+                        help='one weight per prediction directory',
+                        type=float, nargs='+')
+
+    parser.add_argument('--ENSEMBLE_TOPK', dest='ENSEMBLE_TOPK',
+                        help='answers ranked / voted for by every model',
+                        type=int)
+
+    parser.add_argument('--ENSEMBLE_CHUNK', dest='ENSEMBLE_CHUNK',
+                        help='questions read at once',
+                        type=int)
+
     parser.add_argument('--BS', dest='BATCH_SIZE',
                         help='batch size during training',
                         type=int)
@@ -167,6 +205,14 @@ def parse_args():
                              'instead',
                         type=str)
 
+    parser.add_argument('--CKPT_EVERY', dest='CKPT_EVERY',
+                        help='save a resumable checkpoint every n steps, 0 to disable',
+                        type=int)
+
+    parser.add_argument('--RESUME_STEP', dest='RESUME_STEP',
+                        help='resume from the last step checkpoint of CKPT_VERSION',
+                        type=str2bool)
+
     parser.add_argument('--ACCU', dest='GRAD_ACCU_STEPS',
                         help='reduce gpu memory usage',
                         type=int)
@@ -175,6 +221,10 @@ def parse_args():
                         help='multithreaded loading',
                         type=int)
 
+    parser.add_argument('--PREFETCH', dest='PREFETCH',
+                        help='batches loaded and copied to the gpu ahead of training',
+                        type=int)
+
     parser.add_argument('--PINM', dest='PIN_MEM',
                         help='use pin memory',
                         type=bool)
@@ -183,6 +233,35 @@ def parse_args():
                         help='verbose print',
                         type=bool)
 
+    parser.add_argument('--PACKED_FEAT', dest='USE_PACKED_FEAT',
+                        help='read image features from the packed store '
+                             '(see utils/pack_img_feats.py) when available',
+                        type=str2bool)
+
+    parser.add_argument('--FEAT_DTYPE', dest='IMG_FEAT_DTYPE',
+                        choices=['float32', 'float16'],
+                        help='dtype of the image features in the data pipeline',
+                        type=str)
+
+    parser.add_argument('--FEAT_DTYPE_DELTA', dest='FEAT_DTYPE_DELTA',
+                        choices=['float16', 'bfloat16'],
+                        help='also evaluate val with features rounded to this dtype '
+                             'and report the accuracy delta',
+                        type=str)
+
+    parser.add_argument('--FEAT_CACHE', dest='IMG_FEAT_CACHE_SIZE',
+                        help='number of image features cached in shared memory '
+                             'across dataloader workers, 0 to disable',
+                        type=int)
+
+    parser.add_argument('--DYNAMIC_PAD', dest='DYNAMIC_PAD',
+                        help='pad each batch to its longest question and box count',
+                        type=str2bool)
+
+    parser.add_argument('--BUCKET_POOL', dest='BUCKET_POOL',
+                        help='number of batches sorted together by length, 0 for random batches',
+                        type=int)
+
     parser.add_argument('--DATA_PATH', dest='DATASET_PATH',
                         help='vqav2 dataset root path',
                         type=str)
@@ -223,13 +302,31 @@ if __name__ == '__main__':
     print('Hyper Parameters:')
     print(__C)
 
-    __C.check_path()
+    if __C.RUN_MODE == 'prepare':
+        # 只编译数据集，不需要图像特征
+        print('Compile datasets to', __C.COMPILED_DATA_PATH)
+        # The data and training modules import torch, they are only loaded by the modes using them
+        from core.data.corpus import prepare_corpora
+        prepare_corpora(__C)
+        if os.path.exists(__C.ANSWER_PATH['val']):
+            # 验证集GT索引（每轮验证和valNovel使用）
+            get_gt_index(__C, 'val')
+        exit(0)
+
+    if __C.RUN_MODE == 'ensemble':
+        # 只读取保存的预测向量，不需要数据集
+        from core.ensemble import run_ensemble
+        run_ensemble(__C)
+        exit(0)
 
     if __C.RUN_MODE == 'valNovel':
-        # 在新子集计算验证精度
+        # 在新子集计算验证精度，只需要验证集的问题和标注
         print('Compute validation accuracy on novel subsets')
         execution = NovelEval(__C)
     else:
+        __C.check_path()
+        from core.exec2steps import Execution as Exec2Steps
+
         if __C.USE_GROUNDING:
             # 使用技能-概念组合
             print('Use 2-step Loss')
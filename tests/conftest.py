@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import the repository packages (core, utils) as run.py does from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
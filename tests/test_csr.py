@@ -0,0 +1,65 @@
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from core.data.data_utils import csr_take_rows, lists_to_csr, proc_ans_list, ans_collate, prune_refsets, REFSET_KINDS
+import vqa_reference as ref
+
+ANSWERS = ['yes', 'Yes', 'no', '2', 'two', 'red', 'red, white', 'the dog', 'dog', 't-shirt', '1,000', 'cat']
+
+
+def random_lists(n, seed=0):
+    rng = random.Random(seed)
+    return [[rng.randrange(100) for _ in range(rng.choice([0, 0, 1, 3, 10]))] for _ in range(n)]
+
+
+def test_csr_take_rows():
+    lists = random_lists(200)
+    ptr = np.cumsum([0] + [len(l) for l in lists])
+    values = np.array([v for l in lists for v in l], np.int64)
+    scores = values.astype(np.float32) / 10
+
+    rows = np.random.RandomState(0).choice(len(lists), 150, replace=True)
+    new_ptr, (new_values, new_scores) = csr_take_rows(ptr, (values, scores), rows)
+
+    assert new_ptr[0] == 0 and len(new_ptr) == len(rows) + 1
+    for i, row in enumerate(rows):
+        assert new_values[new_ptr[i]:new_ptr[i + 1]].tolist() == lists[row]
+        assert new_scores[new_ptr[i]:new_ptr[i + 1]].tolist() == scores[ptr[row]:ptr[row + 1]].tolist()
+
+
+def test_sparse_answer_targets_match_dense():
+    # proc_ans_list + ans_collate give the dense scores of the original proc_ans
+    rng = random.Random(1)
+    ans_to_ix = {ans: ix for ix, ans in enumerate(['yes', 'no', '2', 'red', 'red white', 'dog', 'tshirt', '1000'])}
+    ans_list = [{'answers': [{'answer': rng.choice(ANSWERS)} for _ in range(rng.choice([0, 1, 10]))]}
+                for _ in range(300)]
+
+    ans_ptr, ans_ix, ans_score = proc_ans_list(ans_list, ans_to_ix)
+    batch = [(torch.zeros(1, 2), torch.zeros(1, dtype=torch.int64),
+              (torch.from_numpy(ans_ix[ans_ptr[row]:ans_ptr[row + 1]]),
+               torch.from_numpy(ans_score[ans_ptr[row]:ans_ptr[row + 1]])))
+             for row in range(len(ans_list))]
+    _, _, dense = ans_collate(batch, len(ans_to_ix))
+
+    expected = np.array([ref.proc_ans(ans, ans_to_ix, len(ans_to_ix)) for ans in ans_list], np.float32)
+    assert np.array_equal(dense.numpy(), expected)
+
+
+def test_prune_refsets():
+    # Reference questions longer than max_token are dropped group by group, the shared corpus is untouched
+    rng = random.Random(2)
+    groups = random_lists(60 * len(REFSET_KINDS), seed=3)
+    rs_ptr, rs_ref = lists_to_csr(groups)
+    corpus = SimpleNamespace(rs_ptr=rs_ptr, rs_ref=rs_ref, ques_len=np.array([rng.randint(1, 20) for _ in range(100)]))
+    rs_ref_before = rs_ref.copy()
+
+    new_ptr, new_ref = prune_refsets(corpus, max_token=14)
+
+    assert np.array_equal(corpus.rs_ref, rs_ref_before)
+    assert len(new_ptr) == len(rs_ptr)
+    for group, refs in enumerate(groups):
+        assert new_ref[new_ptr[group]:new_ptr[group + 1]].tolist() == \
+            [ref_row for ref_row in refs if corpus.ques_len[ref_row] <= 14]
@@ -0,0 +1,146 @@
+import copy
+import json
+import random
+
+import numpy as np
+import pytest
+
+from core.data.gt_index import GtIndex, gt_accuracy, load_res_answers, res_ans_ids
+from utils.vqa import VQA
+from utils.vqaEval import VQAEval
+import vqa_reference as ref
+
+# Raw answers with punctuation, case, article and number-word variants of the same normalized answer
+ANSWERS = ['yes', 'Yes', 'yes!', 'no', 'no.', '2', 'two', 'Two', '3', 'red', 'red, white', 'red white',
+           'the dog', 'dog', 'a dog', 'dogs', 't-shirt', 't shirt', 'tshirt', '1,000', '1000', 'on/off',
+           'dont know', "don't know", 'x-ray', '(none)', 'none']
+PREDICTIONS = ANSWERS + ['cat', 'unknown answer', '  yes ', 'yes\n', 'TWO', 'red,white']
+QUES_TYPES = ['what color is the', 'how many', 'is the', 'what is']
+ANS_TYPES = ['yes/no', 'number', 'other']
+
+
+def make_annotations(n, seed=0):
+    rng = random.Random(seed)
+    anns = []
+    for qid in rng.sample(range(10 ** 6), n):
+        num_gt = rng.choice([10, 10, 10, 1, 3, 7])
+        if rng.random() < 0.3:
+            # Unanimous annotators: the GT answers are not punctuation-processed
+            answers = [rng.choice(ANSWERS)] * num_gt
+        else:
+            pool = rng.sample(ANSWERS, rng.randint(1, 4))
+            answers = [rng.choice(pool) for _ in range(num_gt)]
+        anns.append({
+            'question_id': qid,
+            'image_id': qid // 10,
+            'question_type': rng.choice(QUES_TYPES),
+            'answer_type': rng.choice(ANS_TYPES),
+            'answers': [{'answer': ans, 'answer_confidence': 'yes', 'answer_id': i + 1}
+                        for i, ans in enumerate(answers)],
+            'multiple_choice_answer': answers[0]
+        })
+    return anns
+
+
+def make_predictions(anns, seed=1):
+    rng = random.Random(seed)
+    return {ann['question_id']: rng.choice(PREDICTIONS + [ann['answers'][0]['answer']]) for ann in anns}
+
+
+def reference_accuracy(anns, res, quesIds, n=2):
+    # The accuracy report of the original VQAEval.evaluate
+    gts = {ann['question_id']: copy.deepcopy(ann) for ann in anns}
+    accQA = ref.vqa_accuracy(gts, res, quesIds)
+
+    accQuesType, accAnsType = {}, {}
+    for quesId in quesIds:
+        accQuesType.setdefault(gts[quesId]['question_type'], []).append(accQA[quesId])
+        accAnsType.setdefault(gts[quesId]['answer_type'], []).append(accQA[quesId])
+
+    acc = [accQA[quesId] for quesId in quesIds]
+    return accQA, {
+        'overall': round(100 * float(sum(acc)) / len(acc), n),
+        'perQuestionType': {t: round(100 * float(sum(a)) / len(a), n) for t, a in accQuesType.items()},
+        'perAnswerType': {t: round(100 * float(sum(a)) / len(a), n) for t, a in accAnsType.items()}
+    }
+
+
+@pytest.fixture(scope='module')
+def fixture():
+    anns = make_annotations(3000)
+    res = make_predictions(anns)
+    return anns, res, GtIndex.from_annotations(copy.deepcopy(anns))
+
+
+def test_gt_accuracy_bit_identical(fixture):
+    anns, res, index = fixture
+    quesIds = [ann['question_id'] for ann in anns]
+    accQA, _ = reference_accuracy(anns, res, quesIds)
+
+    pos = index.qid_pos(np.array(quesIds, np.int64))
+    res_ids = np.array([index.ans_to_id.get(ref.prep_res_ans(res[quesId]), -2) for quesId in quesIds], np.int64)
+    acc = gt_accuracy(index, pos, res_ids)
+
+    # Exact float equality, not approx: the saved accuracies must not change
+    assert acc.tolist() == [accQA[quesId] for quesId in quesIds]
+
+
+@pytest.mark.parametrize('subset', [False, True])
+def test_vqa_eval_matches_original(fixture, subset):
+    anns, res, index = fixture
+    quesIds = [ann['question_id'] for ann in anns]
+    if subset:
+        quesIds = random.Random(2).sample(quesIds, 500)
+    accQA, accuracy = reference_accuracy(anns, res, quesIds)
+
+    vqaEval = VQAEval(gtIndex=index, resAnswers=res, n=2)
+    vqaEval.evaluate(quesIds if subset else None)
+
+    assert vqaEval.accuracy == accuracy
+    assert list(vqaEval.accuracy['perAnswerType']) == list(accuracy['perAnswerType'])
+    assert vqaEval.evalQA == {quesId: round(100 * accQA[quesId], 2) for quesId in quesIds}
+    assert vqaEval.accQA.tolist() == [accQA[quesId] for quesId in quesIds]
+
+
+def test_answer_index_input(fixture):
+    # Predicted answer indices handed straight to the evaluator (res_ans_ids) give the same report
+    anns, res, index = fixture
+    ix_to_ans = {str(ix): ans for ix, ans in enumerate(PREDICTIONS)}
+    rng = np.random.RandomState(3)
+    qids = np.array([ann['question_id'] for ann in anns], np.int64)[rng.permutation(len(anns))]
+    ans_ix = rng.randint(len(PREDICTIONS), size=len(qids))
+
+    by_ids = VQAEval(gtIndex=index, resAnsIds=res_ans_ids(index, qids, ans_ix, ix_to_ans), n=2)
+    by_ids.evaluate()
+    by_answers = VQAEval(gtIndex=index, resAnswers={
+        int(qid): ix_to_ans[str(ix)] for qid, ix in zip(qids, ans_ix)
+    }, n=2)
+    by_answers.evaluate()
+
+    assert by_ids.accuracy == by_answers.accuracy
+    assert by_ids.evalQA == by_answers.evalQA
+
+
+def test_vqa_objects_and_saved_index(fixture, tmp_path):
+    # The original entry point (VQA annotation / result objects) and a compiled, memory-mapped index
+    anns, res, index = fixture
+    ann_file, ques_file, res_file = tmp_path / 'ann.json', tmp_path / 'ques.json', tmp_path / 'res.json'
+    ann_file.write_text(json.dumps({'info': {}, 'data_type': 'mscoco', 'data_subtype': 'val2014',
+                                    'annotations': anns, 'license': {}}))
+    ques_file.write_text(json.dumps({'info': {}, 'task_type': 'Open-Ended', 'data_type': 'mscoco',
+                                     'data_subtype': 'val2014', 'license': {}, 'questions': [
+        {'question_id': ann['question_id'], 'image_id': ann['image_id'], 'question': 'what?'} for ann in anns
+    ]}))
+    res_file.write_text(json.dumps([{'question_id': qid, 'answer': ans} for qid, ans in res.items()]))
+
+    vqa = VQA(str(ann_file), str(ques_file))
+    vqaEval = VQAEval(vqa, vqa.loadRes(str(res_file), str(ques_file)), n=2)
+    vqaEval.evaluate()
+    _, accuracy = reference_accuracy(anns, res, vqa.getQuesIds())
+    assert vqaEval.accuracy == accuracy
+
+    index.save(str(tmp_path))
+    loaded = GtIndex.load(str(tmp_path))
+    by_loaded = VQAEval(gtIndex=loaded, resAnswers=load_res_answers(str(res_file), loaded), n=2)
+    by_loaded.evaluate()
+    assert by_loaded.accuracy == reference_accuracy(anns, res, [ann['question_id'] for ann in anns])[1]
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from core.data import normalize
+import vqa_reference as ref
+
+WORDS = list(normalize.contractions) + list(normalize.manual_map) + normalize.articles + \
+    ['yes', 'No', 'THE', 'Two', '1,000', '3.5', 'e.g.', 'dog\'s', 'tv', '10']
+CHARS = list('abcdefgxyzAZ0123456789 .\'\t\n*#:') + normalize.punct
+
+
+def random_texts(n, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        parts = []
+        for _ in range(rng.randint(0, 8)):
+            if rng.random() < 0.5:
+                parts.append(rng.choice(WORDS))
+            else:
+                parts.append(''.join(rng.choice(CHARS) for _ in range(rng.randint(1, 4))))
+        texts.append(rng.choice(['', ' ']).join(parts))
+    return texts
+
+
+EDGE_CASES = [
+    '', ' ', '.', 'a.', '1.5', '1,000', '1, 000', 'red, white', 'red,white', 'yes!', 'yes !', '(yes)',
+    'on/off', 'x-ray', 'one two three', 'The Dog', 'dont', 'isnt it', 'a' + '.' * 40, '. ' * 40,
+    'none of the above', 'semi;colon', 'back\\slash', '  padded  ', 'tab\tnew\nline'
+]
+
+
+@pytest.mark.parametrize('text', EDGE_CASES)
+def test_edge_cases(text):
+    assert normalize.process_punctuation(text) == ref.process_punctuation(text)
+    assert normalize.process_digit_article(text) == ref.process_digit_article(text)
+    assert normalize.prep_ans(text) == ref.prep_ans(text)
+    assert normalize.prep_res_ans(text) == ref.prep_res_ans(text)
+    assert normalize.get_words(text) == ref.get_words(text)
+
+
+def test_random_texts():
+    for text in random_texts(20000):
+        assert normalize.process_punctuation(text) == ref.process_punctuation(text), repr(text)
+        assert normalize.process_digit_article(text) == ref.process_digit_article(text), repr(text)
+        assert normalize.prep_ans(text) == ref.prep_ans(text), repr(text)
+        assert normalize.prep_res_ans(text) == ref.prep_res_ans(text), repr(text)
+        assert normalize.get_words(text) == ref.get_words(text), repr(text)
+
+
+def test_list_api_matches_single():
+    texts = random_texts(500, seed=1)
+    assert normalize.prep_ans_list(texts) == [ref.prep_ans(text) for text in texts]
+    assert normalize.process_punctuation_list(texts) == [ref.process_punctuation(text) for text in texts]
+    assert normalize.prep_res_ans_list(texts) == [ref.prep_res_ans(text) for text in texts]
+    assert normalize.get_words_list(texts) == [ref.get_words(text) for text in texts]
+
+
+def test_get_words_returns_fresh_lists():
+    # ques_words is memoized, callers may modify the returned list
+    words = normalize.get_words('What color is the cat?')
+    words.append('x')
+    assert normalize.get_words('What color is the cat?') == ['what', 'color', 'is', 'the', 'cat']
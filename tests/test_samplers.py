@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+import torch
+# noinspection PyPep8Naming
+import torch.utils.data as Data
+
+from core.data.data_utils import seeded_random, get_rng_state, set_rng_state
+from core.data.samplers import ResumableBatchSampler, ResumableLoader, random_batch_sampler
+
+
+class ToyDataSet(Data.Dataset):
+    """
+    Items draw a random number like the reference sampling of DataSet.seeded, so a resumed pass only
+    reproduces them when the sample_seed of the interrupted pass is restored
+    """
+    def __init__(self, size=30):
+        self.size = size
+        self.lengths = np.random.RandomState(0).randint(1, 20, size)
+        self.sample_seed = torch.full((1,), -1, dtype=torch.int64).share_memory_()
+
+    def __len__(self):
+        return self.size
+
+    def item_lengths(self):
+        return self.lengths
+
+    def item(self, idx):
+        with seeded_random((int(self.sample_seed) + int(idx)) % 2 ** 32):
+            return [int(idx), int(np.random.randint(10 ** 6))]
+
+    def __getitem__(self, idx):
+        # A list of indices is a whole batch (as RefPointDataSet.load_batch with batch_size=None)
+        if isinstance(idx, list):
+            return torch.tensor([self.item(ix) for ix in idx])
+        return torch.tensor(self.item(idx))
+
+
+def make_loader(bucket_pool, whole_batches, num_workers):
+    dataset = ToyDataSet()
+    sampler = ResumableBatchSampler(random_batch_sampler(dataset, 4, bucket_pool))
+    if whole_batches:
+        loader = Data.DataLoader(dataset, sampler=sampler, batch_size=None, num_workers=num_workers)
+    else:
+        loader = Data.DataLoader(dataset, batch_sampler=sampler, num_workers=num_workers)
+    return ResumableLoader(loader)
+
+
+def run(loader, steps):
+    return [loader.next().tolist() for _ in range(steps)]
+
+
+@pytest.mark.parametrize('bucket_pool', [0, 2])
+@pytest.mark.parametrize('whole_batches', [False, True])
+@pytest.mark.parametrize('num_workers', [0, 2])
+@pytest.mark.parametrize('stop_at', [0, 3, 7, 14])
+def test_resume_continues_the_same_batches(bucket_pool, whole_batches, num_workers, stop_at):
+    # 7 batches per pass: stop before the first pass, inside a pass, and at a pass boundary
+    np.random.seed(0)
+    torch.manual_seed(0)
+    reference = run(make_loader(bucket_pool, whole_batches, num_workers), 20)
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+    loader = make_loader(bucket_pool, whole_batches, num_workers)
+    head = run(loader, stop_at)
+    state, rng = loader.state_dict(), get_rng_state()
+    del loader
+
+    # A new process: other random states, restored after the loader state as in Execution.train
+    np.random.seed(123)
+    torch.manual_seed(123)
+    resumed = make_loader(bucket_pool, whole_batches, num_workers)
+    resumed.load_state_dict(state)
+    set_rng_state(rng)
+    tail = run(resumed, 20 - stop_at)
+
+    assert head + tail == reference
+
+
+def test_passes_cover_the_dataset_once():
+    np.random.seed(0)
+    loader = make_loader(0, False, 0)
+    for _ in range(2):
+        rows = [row for batch in loader for row, _ in batch.tolist()]
+        assert len(rows) == len(set(rows)) == 28  # drop_last
+    assert loader.consumed == 7
+
+
+def test_state_before_the_first_pass():
+    loader = make_loader(2, False, 0)
+    assert loader.state_dict()['sample_seed'] is None
+
+    np.random.seed(0)
+    reference = run(make_loader(2, False, 0), 3)
+    resumed = make_loader(2, False, 0)
+    resumed.load_state_dict(loader.state_dict())
+    np.random.seed(0)
+    assert run(resumed, 3) == reference
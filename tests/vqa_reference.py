@@ -0,0 +1,115 @@
+# Reference implementations copied from the original code (VQA evaluation API, MCAN data utils)
+# 原始实现的拷贝，只用于测试：优化后的实现必须与其输出完全一致
+import re
+
+from core.data.normalize import contractions, articles, punct
+
+manual_map = {'none': '0', 'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4',
+              'five': '5', 'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10'}
+period_strip = re.compile(r"(?!<=\d)(\.)(?!\d)")
+comma_strip = re.compile(r"(\d)(\,)(\d)")
+
+
+def process_punctuation(inText):
+    outText = inText
+    for p in punct:
+        if (p + ' ' in inText or ' ' + p in inText) \
+           or (re.search(comma_strip, inText) != None):
+            outText = outText.replace(p, '')
+        else:
+            outText = outText.replace(p, ' ')
+    outText = period_strip.sub("", outText, re.UNICODE)
+    return outText
+
+
+def process_digit_article(inText):
+    outText = []
+    tempText = inText.lower().split()
+    for word in tempText:
+        word = manual_map.setdefault(word, word)
+        if word not in articles:
+            outText.append(word)
+        else:
+            pass
+    for wordId, word in enumerate(outText):
+        if word in contractions:
+            outText[wordId] = contractions[word]
+    outText = ' '.join(outText)
+    return outText
+
+
+def prep_ans(answer):
+    answer = process_digit_article(process_punctuation(answer))
+    answer = answer.replace(',', '')
+    return answer
+
+
+def prep_res_ans(resAns):
+    resAns = resAns.replace('\n', ' ')
+    resAns = resAns.replace('\t', ' ')
+    resAns = resAns.strip()
+    resAns = process_punctuation(resAns)
+    resAns = process_digit_article(resAns)
+    return resAns
+
+
+def get_words(question_str):
+    return re.sub(
+        r"([.,'!?\"()*#:;])",
+        '',
+        question_str.lower()
+    ).replace('-', ' ').replace('/', ' ').split()
+
+
+def vqa_accuracy(gts, res, quesIds):
+    """
+    VQAEval.evaluate的原始循环：gts为{question id: 标注}（会被修改，传入拷贝），res为{question id: 预测答案}
+    Returns {question id: accuracy in [0, 1]}
+    """
+    accQA = {}
+    for quesId in quesIds:
+        resAns = prep_res_ans(res[quesId])
+        gtAcc = []
+        gtAnswers = [ans['answer'] for ans in gts[quesId]['answers']]
+        if len(set(gtAnswers)) > 1:
+            for ansDic in gts[quesId]['answers']:
+                ansDic['answer'] = process_punctuation(ansDic['answer'])
+        for gtAnsDatum in gts[quesId]['answers']:
+            otherGTAns = [item for item in gts[quesId]['answers'] if item != gtAnsDatum]
+            matchingAns = [item for item in otherGTAns if item['answer'] == resAns]
+            acc = min(1, float(len(matchingAns)) / 3)
+            gtAcc.append(acc)
+        accQA[quesId] = float(sum(gtAcc)) / len(gtAcc)
+    return accQA
+
+
+def get_score(occur):
+    if occur == 0:
+        return .0
+    elif occur == 1:
+        return .3
+    elif occur == 2:
+        return .6
+    elif occur == 3:
+        return .9
+    else:
+        return 1.
+
+
+def proc_ans(ans, ans_to_ix, ans_size):
+    # Dense answer scores of one annotation
+    ans_score = [0.] * ans_size
+    ans_prob_dict = {}
+
+    for ans_ in ans['answers']:
+        ans_proc = prep_ans(ans_['answer'])
+        if ans_proc not in ans_prob_dict:
+            ans_prob_dict[ans_proc] = 1
+        else:
+            ans_prob_dict[ans_proc] += 1
+
+    for ans_ in ans_prob_dict:
+        if ans_ in ans_to_ix:
+            ans_score[ans_to_ix[ans_]] = get_score(ans_prob_dict[ans_])
+
+    return ans_score
@@ -0,0 +1,66 @@
+# Convert GloVe vectors into the binary format read by core/data/data_utils.tokenize:
+#   glove_words.txt   : one word per line
+#   glove_vectors.npy : float32 [num_words, dim], row i is the vector of line i
+# Run from the utils directory (same as proc_ansdict.py), either from the GloVe text release
+#   python convert_glove.py --GLOVE_TXT ../datasets/glove/glove.840B.300d.txt
+# or from an installed spaCy vectors package
+#   python convert_glove.py --SPACY en_vectors_web_lg
+
+import numpy as np
+import argparse, os
+
+OUT_PATH = '../datasets/glove/'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert GloVe vectors to a memory-mappable binary')
+    parser.add_argument('--GLOVE_TXT', dest='GLOVE_TXT', type=str, default=None)
+    parser.add_argument('--SPACY', dest='SPACY', type=str, default=None)
+    parser.add_argument('--OUT_PATH', dest='OUT_PATH', type=str, default=OUT_PATH)
+    return parser.parse_args()
+
+
+def convert_txt(glove_txt, out_path):
+    with open(glove_txt, 'r', encoding='utf-8') as f:
+        first = f.readline().rstrip().split(' ')
+        dim = len(first) - 1
+        n_words = 1 + sum(1 for _ in f)
+
+    vectors = np.lib.format.open_memmap(
+        os.path.join(out_path, 'glove_vectors.npy'), mode='w+', dtype=np.float32, shape=(n_words, dim))
+    with open(glove_txt, 'r', encoding='utf-8') as f, \
+            open(os.path.join(out_path, 'glove_words.txt'), 'w', encoding='utf-8') as words_f:
+        for row, line in enumerate(f):
+            # A few GloVe tokens contain spaces, so the vector is taken from the right
+            parts = line.rstrip().split(' ')
+            words_f.write(' '.join(parts[:-dim]) + '\n')
+            vectors[row] = np.array(parts[-dim:], np.float32)
+            if row % 100000 == 0:
+                print('\rConverting: [{} | {}] '.format(row, n_words), end='          ')
+    vectors.flush()
+    print('\rConverted {} words of dimension {}'.format(n_words, dim))
+
+
+def convert_spacy(spacy_model, out_path):
+    import spacy
+
+    vocab = spacy.load(spacy_model).vocab
+    keys, rows = zip(*vocab.vectors.key2row.items())
+
+    np.save(os.path.join(out_path, 'glove_vectors.npy'), np.asarray(vocab.vectors.data[list(rows)], np.float32))
+    with open(os.path.join(out_path, 'glove_words.txt'), 'w', encoding='utf-8') as words_f:
+        for key in keys:
+            words_f.write(vocab.strings[key] + '\n')
+    print('Converted {} words of dimension {}'.format(len(keys), vocab.vectors.shape[1]))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    os.makedirs(args.OUT_PATH, exist_ok=True)
+    if args.GLOVE_TXT is not None:
+        convert_txt(args.GLOVE_TXT, args.OUT_PATH)
+    elif args.SPACY is not None:
+        convert_spacy(args.SPACY, args.OUT_PATH)
+    else:
+        print('Either --GLOVE_TXT or --SPACY is required')
+        exit(-1)
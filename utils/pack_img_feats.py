@@ -0,0 +1,34 @@
+# Pack the per-image BUTD .npz features of each split into one memory-mapped array.
+# Run from the utils directory (same as proc_ansdict.py):
+#   python pack_img_feats.py --SPLITS train,val,test
+
+import sys
+sys.path.append('../')
+from core.data.feat_store import pack_img_feats
+import argparse
+
+FEATURE_PATH = '../datasets/coco_extract/'
+
+IMG_FEAT_DIR = {
+    'train': 'train2014/',
+    'val': 'val2014/',
+    'test': 'test2015/',
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pack image features for memory-mapped loading')
+    parser.add_argument('--SPLITS', dest='SPLITS', type=str, default='train,val,test')
+    parser.add_argument('--FEAT_PATH', dest='FEATURE_PATH', type=str, default=FEATURE_PATH)
+    parser.add_argument('--OUT_PATH', dest='OUT_PATH', type=str, default=None,
+                        help='defaults to <FEAT_PATH>/packed/')
+    parser.add_argument('--DTYPE', dest='DTYPE', type=str, default='float32', choices=['float32', 'float16'],
+                        help='float16 halves the packed files, see IMG_FEAT_DTYPE')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    out_path = args.OUT_PATH or args.FEATURE_PATH + 'packed/'
+    for split in args.SPLITS.split(','):
+        pack_img_feats(args.FEATURE_PATH + IMG_FEAT_DIR[split], out_path, split, dtype=args.DTYPE)
@@ -5,10 +5,14 @@ __author__='aagrawal'
 # This code is based on the code written by Tsung-Yi Lin for MSCOCO Python API available at the following link: 
 # (https://github.com/tylin/coco-caption/blob/master/pycocoevalcap/eval.py).
 import sys
-import re
+import numpy as np
+from core.data import normalize
+from core.data.gt_index import GtIndex, gt_accuracy
 
 class VQAEval:
-	def __init__(self, vqa, vqaRes, n=2):
+	def __init__(self, vqa=None, vqaRes=None, n=2, gtIndex=None, resAnswers=None, resAnsIds=None):
+		# Either the VQA / result objects, or a prebuilt GT index and the predictions: {question id: answer},
+		# or the normalized answer ids in index order (core/data/gt_index.res_ans_ids)
 		self.n 			  = n
 		self.accuracy     = {}
 		self.evalQA       = {}
@@ -16,135 +20,97 @@ class VQAEval:
 		self.evalAnsType  = {}
 		self.vqa 		  = vqa
 		self.vqaRes       = vqaRes
-		self.params		  = {'question_id': vqa.getQuesIds()}
-		self.contractions = {"aint": "ain't", "arent": "aren't", "cant": "can't", "couldve": "could've", "couldnt": "couldn't",
-							 "couldn'tve": "couldn't've", "couldnt've": "couldn't've", "didnt": "didn't", "doesnt": "doesn't", "dont": "don't", "hadnt": "hadn't",
-							 "hadnt've": "hadn't've", "hadn'tve": "hadn't've", "hasnt": "hasn't", "havent": "haven't", "hed": "he'd", "hed've": "he'd've",
-							 "he'dve": "he'd've", "hes": "he's", "howd": "how'd", "howll": "how'll", "hows": "how's", "Id've": "I'd've", "I'dve": "I'd've",
-							 "Im": "I'm", "Ive": "I've", "isnt": "isn't", "itd": "it'd", "itd've": "it'd've", "it'dve": "it'd've", "itll": "it'll", "let's": "let's",
-							 "maam": "ma'am", "mightnt": "mightn't", "mightnt've": "mightn't've", "mightn'tve": "mightn't've", "mightve": "might've",
-							 "mustnt": "mustn't", "mustve": "must've", "neednt": "needn't", "notve": "not've", "oclock": "o'clock", "oughtnt": "oughtn't",
-							 "ow's'at": "'ow's'at", "'ows'at": "'ow's'at", "'ow'sat": "'ow's'at", "shant": "shan't", "shed've": "she'd've", "she'dve": "she'd've",
-							 "she's": "she's", "shouldve": "should've", "shouldnt": "shouldn't", "shouldnt've": "shouldn't've", "shouldn'tve": "shouldn't've",
-							 "somebody'd": "somebodyd", "somebodyd've": "somebody'd've", "somebody'dve": "somebody'd've", "somebodyll": "somebody'll",
-							 "somebodys": "somebody's", "someoned": "someone'd", "someoned've": "someone'd've", "someone'dve": "someone'd've",
-							 "someonell": "someone'll", "someones": "someone's", "somethingd": "something'd", "somethingd've": "something'd've",
-							 "something'dve": "something'd've", "somethingll": "something'll", "thats": "that's", "thered": "there'd", "thered've": "there'd've",
-							 "there'dve": "there'd've", "therere": "there're", "theres": "there's", "theyd": "they'd", "theyd've": "they'd've",
-							 "they'dve": "they'd've", "theyll": "they'll", "theyre": "they're", "theyve": "they've", "twas": "'twas", "wasnt": "wasn't",
-							 "wed've": "we'd've", "we'dve": "we'd've", "weve": "we've", "werent": "weren't", "whatll": "what'll", "whatre": "what're",
-							 "whats": "what's", "whatve": "what've", "whens": "when's", "whered": "where'd", "wheres": "where's", "whereve": "where've",
-							 "whod": "who'd", "whod've": "who'd've", "who'dve": "who'd've", "wholl": "who'll", "whos": "who's", "whove": "who've", "whyll": "why'll",
-							 "whyre": "why're", "whys": "why's", "wont": "won't", "wouldve": "would've", "wouldnt": "wouldn't", "wouldnt've": "wouldn't've",
-							 "wouldn'tve": "wouldn't've", "yall": "y'all", "yall'll": "y'all'll", "y'allll": "y'all'll", "yall'd've": "y'all'd've",
-							 "y'alld've": "y'all'd've", "y'all'dve": "y'all'd've", "youd": "you'd", "youd've": "you'd've", "you'dve": "you'd've",
-							 "youll": "you'll", "youre": "you're", "youve": "you've"}
-		self.manualMap    = { 'none': '0',
-							  'zero': '0',
-							  'one': '1',
-							  'two': '2',
-							  'three': '3',
-							  'four': '4',
-							  'five': '5',
-							  'six': '6',
-							  'seven': '7',
-							  'eight': '8',
-							  'nine': '9',
-							  'ten': '10'
-							}
-		self.articles     = ['a',
-							 'an',
-							 'the'
-							]
- 
-
-		self.periodStrip  = re.compile("(?!<=\d)(\.)(?!\d)")
-		self.commaStrip   = re.compile("(\d)(,)(\d)")
-		self.punct        = [';', r"/", '[', ']', '"', '{', '}',
-							 '(', ')', '=', '+', '\\', '_', '-',
-							 '>', '<', '@', '`', ',', '?', '!']
+		self.resAnswers   = resAnswers
+		self.resAnsIds    = resAnsIds
+		self.gtAnsIds     = None
+		if gtIndex is not None:
+			self.setGtIndex(gtIndex)
+			self.params	  = {'question_id': gtIndex.qids.tolist()}
+		else:
+			self.params	  = {'question_id': vqa.getQuesIds()}
+		# Normalization tables and functions are shared with the answer processing (core/data/normalize.py)
+		self.contractions = normalize.contractions
+		self.manualMap    = normalize.manual_map
+		self.articles     = normalize.articles
+		self.periodStrip  = normalize.period_strip
+		self.commaStrip   = normalize.comma_strip
+		self.punct        = normalize.punct
+
+	def buildGtIndex(self):
+		# Normalized GT answers of every question interned to integer ids (core/data/gt_index.py),
+		# built once per VQAEval unless a prebuilt index was passed in
+		self.setGtIndex(GtIndex.from_annotations([self.vqa.qa[quesId] for quesId in self.vqa.qa]))
+
+	def setGtIndex(self, gtIndex):
+		self.gtIndex     = gtIndex
+		self.gtNum       = gtIndex.num_gt
+		self.gtAnsIds    = gtIndex.ans_ids
+		self.ansToId     = gtIndex.ans_to_id
+		self.quesTypes   = gtIndex.ques_type_names
+		self.gtQuesTypes = gtIndex.ques_type
+		self.ansTypes    = gtIndex.ans_type_names
+		self.gtAnsTypes  = gtIndex.ans_type
 
-	
 	def evaluate(self, quesIds=None):
 		if quesIds == None:
 			quesIds = [quesId for quesId in self.params['question_id']]
-		gts = {}
-		res = {}
-		for quesId in quesIds:
-			gts[quesId] = self.vqa.qa[quesId]
-			res[quesId] = self.vqaRes.qa[quesId]
-		
+		if self.gtAnsIds is None:
+			self.buildGtIndex()
+
 		# =================================================
 		# Compute accuracy
 		# =================================================
-		accQA       = []
-		accQuesType = {}
-		accAnsType  = {}
 		print ("computing accuracy")
-		step = 0
-		for quesId in quesIds:
-			resAns      = res[quesId]['answer']
-			resAns      = resAns.replace('\n', ' ')
-			resAns      = resAns.replace('\t', ' ')
-			resAns      = resAns.strip()
-			resAns      = self.processPunctuation(resAns)
-			resAns      = self.processDigitArticle(resAns)
-			gtAcc  = []
-			gtAnswers = [ans['answer'] for ans in gts[quesId]['answers']]
-			if len(set(gtAnswers)) > 1: 
-				for ansDic in gts[quesId]['answers']:
-					ansDic['answer'] = self.processPunctuation(ansDic['answer'])
-			for gtAnsDatum in gts[quesId]['answers']:
-				otherGTAns = [item for item in gts[quesId]['answers'] if item!=gtAnsDatum]
-				matchingAns = [item for item in otherGTAns if item['answer']==resAns]
-				acc = min(1, float(len(matchingAns))/3)
-				gtAcc.append(acc)
-			quesType    = gts[quesId]['question_type']
-			ansType     = gts[quesId]['answer_type']
-			avgGTAcc = float(sum(gtAcc))/len(gtAcc)
-			accQA.append(avgGTAcc)
-			if quesType not in accQuesType:
-				accQuesType[quesType] = []
-			accQuesType[quesType].append(avgGTAcc)
-			if ansType not in accAnsType:
-				accAnsType[ansType] = []
-			accAnsType[ansType].append(avgGTAcc)
-			self.setEvalQA(quesId, avgGTAcc)
-			self.setEvalQuesType(quesId, quesType, avgGTAcc)
-			self.setEvalAnsType(quesId, ansType, avgGTAcc)
-			if step%100 == 0:
-				self.updateProgress(step/float(len(quesIds)))
-			step = step + 1
-
-		self.setAccuracy(accQA, accQuesType, accAnsType)
+		pos = self.gtIndex.qid_pos(np.array(quesIds, np.int64))
+		# -2: a predicted answer that is no GT answer of any question
+		if self.resAnsIds is not None:
+			resAnsIds = self.resAnsIds[pos]
+		else:
+			if self.resAnswers is not None:
+				resAnswers = [self.resAnswers[quesId] for quesId in quesIds]
+			else:
+				resAnswers = [self.vqaRes.qa[quesId]['answer'] for quesId in quesIds]
+			resAnsIds = np.array([
+				self.ansToId.get(resAns, -2) for resAns in normalize.prep_res_ans_list(resAnswers)
+			], np.int64)
+
+		# Leave-one-out: the GT answers other than the left out one that match the prediction
+		avgGTAcc = gt_accuracy(self.gtIndex, pos, resAnsIds)
+
+		# Only a few distinct accuracies exist, each is rounded once
+		uniqueAcc, accIx = np.unique(avgGTAcc, return_inverse=True)
+		evalAcc = np.array([round(100*acc, self.n) for acc in uniqueAcc.tolist()])[accIx.reshape(-1)]
+		quesIds = np.array(quesIds)
+		self.evalQA.update(zip(quesIds.tolist(), evalAcc.tolist()))
+
+		accQuesType = self.groupByType(self.quesTypes, self.gtQuesTypes[pos], quesIds, avgGTAcc, evalAcc, self.evalQuesType)
+		accAnsType = self.groupByType(self.ansTypes, self.gtAnsTypes[pos], quesIds, avgGTAcc, evalAcc, self.evalAnsType)
+
+		self.setAccuracy(avgGTAcc.tolist(), accQuesType, accAnsType)
+
+		# Per-question accuracies in [0, 1] of the last call, for the sliced evaluation (core/slice_eval.py)
+		self.evalQuesIds = quesIds
+		self.accQA = avgGTAcc
+		self.evalAnsTypeIds = self.gtAnsTypes[pos]
 		print ("Done computing accuracy")
-	
+
+	def groupByType(self, names, typeIds, quesIds, avgGTAcc, evalAcc, evalType):
+		# Accuracies of every type in question order, types in the order they first appear
+		accType = {}
+		order = np.argsort(typeIds, kind='stable')
+		bounds = np.searchsorted(typeIds[order], np.arange(len(names) + 1))
+		_, first = np.unique(typeIds, return_index=True)
+		for typeId in typeIds[np.sort(first)].tolist():
+			rows = order[bounds[typeId]:bounds[typeId + 1]]
+			accType[names[typeId]] = avgGTAcc[rows].tolist()
+			evalType.setdefault(names[typeId], {}).update(zip(quesIds[rows].tolist(), evalAcc[rows].tolist()))
+		return accType
+
 	def processPunctuation(self, inText):
-		outText = inText
-		for p in self.punct:
-			if (p + ' ' in inText or ' ' + p in inText) or (re.search(self.commaStrip, inText) != None):
-				outText = outText.replace(p, '')
-			else:
-				outText = outText.replace(p, ' ')	
-		outText = self.periodStrip.sub("",
-									  outText,
-									  re.UNICODE)
-		return outText
+		return normalize.process_punctuation(inText)
 	
 	def processDigitArticle(self, inText):
-		outText = []
-		tempText = inText.lower().split()
-		for word in tempText:
-			word = self.manualMap.setdefault(word, word)
-			if word not in self.articles:
-				outText.append(word)
-			else:
-				pass
-		for wordId, word in enumerate(outText):
-			if word in self.contractions: 
-				outText[wordId] = self.contractions[word]
-		outText = ' '.join(outText)
-		return outText
+		return normalize.process_digit_article(inText)
 
 	def setAccuracy(self, accQA, accQuesType, accAnsType):
 		self.accuracy['overall']         = round(100*float(sum(accQA))/len(accQA), self.n)